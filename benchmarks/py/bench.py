@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+"""Message level benchmarks for colugo pub/sub and req/rep
+
+Runs a sweep of payload sizes, publish rates, subscriber fan-out, request windows and transports on
+a single host, and writes one json object per run (json lines) to stdout or a file.
+
+    bazel run //benchmarks:bench -- --sizes 64,4096 --transports tcp,ipc,inproc --count 20000
+
+Transports:
+    tcp: clients connect with tcp:// over loopback
+    ipc: clients connect with ipc:// (from a separate zmq context, as if in another process)
+    inproc: clients connect with inproc:// from the node's own zmq context
+    local: subscribers are attached with colugo.py.Subscriber.connect_local() (pub/sub only)
+"""
+
+import argparse
+import json
+import logging
+import platform
+import struct
+import sys
+import time
+import zmq
+
+from colugo.py.context import Context
+from colugo.py.discovery_backend import StaticBackend
+from colugo.py.node import Node
+from colugo.py.reply_server import ReplyServer
+from colugo.py.request_client import RequestClient
+from colugo.py.subscriber import Subscriber
+
+TIMESTAMP = struct.Struct("!d")
+
+
+def percentile(values, p):
+    """Helper to get the p-th percentile of a sorted list
+
+    Args:
+        values: Sorted list of numbers
+        p: Percentile, 0-100
+
+    Returns:
+        float|None: The percentile, or None for an empty list
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def latency_stats(latencies):
+    """Summarize a list of latencies in seconds as microseconds
+
+    Args:
+        latencies: List of latencies in seconds
+
+    Returns:
+        Dict: p50, p90, p99 and max latency in microseconds
+    """
+    latencies = sorted(latencies)
+    stats = {}
+    for (name, p) in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)):
+        value = percentile(latencies, p)
+        stats["latency_{}_us".format(name)] = round(value * 1e6, 1) if value is not None else None
+    return stats
+
+
+class BenchmarkNode(Node):
+    """Node that runs benchmarks on its own event loop
+
+    Discovery is replaced by an empty static backend and sockets are connected explicitly, so each run
+    measures the transport and the Socket/ZMQStream hot path rather than the discovery layer.
+
+    Attributes:
+        remote_context: colugo.py.Context used by ipc and tcp clients, so they don't share the node's context
+        timeout: Seconds before an incomplete run is stopped
+    """
+
+    def __init__(self, timeout):
+        """Constructor
+
+        Args:
+            timeout: Seconds before an incomplete run is stopped
+        """
+        super(BenchmarkNode, self).__init__("Benchmark", discovery_backend=StaticBackend([]))
+        self.remote_context = Context()
+        self.timeout = timeout
+
+    def connect(self, client, server, transport):
+        """Connect a client socket to a server with a specific transport
+
+        Args:
+            client: colugo.py.Socket client object
+            server: colugo.py.Socket server object
+            transport: One of tcp, ipc, inproc or local
+        """
+        if transport == "local":
+            client.connect_local(server)
+        elif transport == "tcp":
+            client.connect(server.address, server.port)
+        else:
+            endpoint = server.ipc_endpoint if transport == "ipc" else server.inproc_endpoint
+            client.connect(server.address, server.port, endpoint)
+
+    def client_context(self, transport):
+        """Helper to get the context for a client socket using a transport
+
+        Args:
+            transport: One of tcp, ipc, inproc or local
+
+        Returns:
+            colugo.py.Context: Context for the client socket
+        """
+        return self.context if transport in ("inproc", "local") else self.remote_context
+
+    def run(self):
+        """Run the event loop until the benchmark stops it or the timeout elapses
+
+        Returns:
+            (float, float): Wall clock and process CPU seconds spent in the loop
+        """
+        timeout = self.loop.call_later(self.timeout, self.loop.stop)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        self.loop.start()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        self.loop.remove_timeout(timeout)
+        return (wall, cpu)
+
+    def pubsub(self, size, rate, fanout, transport, count, burst, batch_size=0):
+        """Publish count messages to fanout subscribers and measure throughput and latency
+
+        Args:
+            size: Payload size in bytes (at least 8, the send timestamp)
+            rate: Messages per second to publish, 0 to publish as fast as possible
+            fanout: Number of subscribers
+            transport: One of tcp, ipc, inproc or local
+            count: Number of messages to publish
+            burst: Number of messages published per event loop turn when rate is 0
+            batch_size: Receive up to this many messages per wakeup with Subscriber.callback_batch, 0 to
+                        receive one message per callback (default: 0)
+
+        Returns:
+            Dict: Results of the run
+        """
+        payload = bytearray(max(size, TIMESTAMP.size))
+        latencies = []
+        received = [0]
+        state = {"sent": 0, "active": True}
+        expected = count * fanout
+
+        def finish():
+            # timers of a finished run must not stop the next one
+            if state["active"]:
+                self.loop.stop()
+
+        def callback(message):
+            latencies.append(time.perf_counter() - TIMESTAMP.unpack_from(message)[0])
+            received[0] += 1
+            if received[0] == expected:
+                finish()
+
+        def callback_batch(messages):
+            now = time.perf_counter()
+            latencies.extend(now - TIMESTAMP.unpack_from(message)[0] for message in messages)
+            received[0] += len(messages)
+            if received[0] == expected:
+                finish()
+
+        def publish(n):
+            for _ in range(n):
+                TIMESTAMP.pack_into(payload, 0, time.perf_counter())
+                publisher.send(bytes(payload))
+            state["sent"] += n
+
+        def publish_burst():
+            if not state["active"]:
+                return
+            n = min(burst, count - state["sent"])
+            publish(n)
+            if state["sent"] < count:
+                self.loop.add_callback(publish_burst)
+            else:
+                self.loop.call_later(1.0, finish)
+
+        def publish_paced():
+            if not state["active"]:
+                return
+            # publish whatever is due, so the rate holds even if the loop falls behind
+            due = min(count, int((time.perf_counter() - start) * rate) + 1)
+            publish(due - state["sent"])
+            if state["sent"] < count:
+                self.loop.call_later(max(0.0, (state["sent"] / float(rate)) - (time.perf_counter() - start)),
+                                     publish_paced)
+            else:
+                self.loop.call_later(1.0, finish)
+
+        publisher = self.add_publisher("bench.pubsub", sndhwm=count, track_drops=True)
+        subscribers = []
+        for _ in range(fanout):
+            if batch_size:
+                subscriber = Subscriber(self.loop, "bench.pubsub", None, raw=True, ctx=self.client_context(transport),
+                                        callback_batch=callback_batch, batch_size=batch_size)
+            else:
+                subscriber = Subscriber(self.loop, "bench.pubsub", callback, raw=True,
+                                        ctx=self.client_context(transport))
+            subscriber.zmq_socket.setsockopt(zmq.RCVHWM, count)
+            self.connect(subscriber, publisher, transport)
+            subscribers.append(subscriber)
+        # give the subscriptions time to reach the publisher before the clock starts
+        self.loop.call_later(0.2, self.loop.stop)
+        self.loop.start()
+        start = time.perf_counter()
+        self.loop.add_callback(publish_paced if rate else publish_burst)
+        (wall, cpu) = self.run()
+        state["active"] = False
+        for subscriber in subscribers:
+            subscriber.close()
+        self.discovery.unregister_all_servers()
+        publisher.close()
+        result = {
+            "benchmark": "pubsub", "transport": transport, "size": size, "rate": rate, "fanout": fanout,
+            "batch_size": batch_size,
+            "sent": state["sent"], "received": received[0], "dropped": publisher.dropped,
+            "lost": expected - received[0], "seconds": round(wall, 4),
+            "msgs_per_sec": round(received[0] / wall, 1) if wall else None,
+            "mb_per_sec": round(received[0] * size / wall / 1e6, 3) if wall else None,
+            "cpu_us_per_msg": round(cpu / received[0] * 1e6, 3) if received[0] else None,
+        }
+        result.update(latency_stats(latencies))
+        return result
+
+    def reqrep(self, size, window, transport, count):
+        """Send count requests with up to window outstanding and measure throughput and latency
+
+        A window of 1 uses a plain zmq.REQ client and zmq.REP server; larger windows use a pipelined
+        client and a concurrent server.
+
+        Args:
+            size: Payload size in bytes of requests and replies (at least 8, the send timestamp)
+            window: Maximum number of outstanding requests
+            transport: One of tcp, ipc or inproc
+            count: Number of requests to send
+
+        Returns:
+            Dict: Results of the run
+        """
+        payload = bytearray(max(size, TIMESTAMP.size))
+        latencies = []
+        state = {"sent": 0, "received": 0, "active": True}
+
+        def request_handler(message, reply):
+            reply(message)
+
+        def reply_handler(message):
+            latencies.append(time.perf_counter() - TIMESTAMP.unpack_from(message)[0])
+            state["received"] += 1
+            if state["received"] == count:
+                self.loop.stop()
+            elif state["sent"] < count:
+                send()
+
+        def send():
+            if not state["active"]:
+                return
+            TIMESTAMP.pack_into(payload, 0, time.perf_counter())
+            state["sent"] += 1
+            client.send(bytes(payload), reply_handler, timeout=None)
+
+        pipelined = window > 1
+        server = ReplyServer(self.loop, "bench.reqrep", request_handler, raw=True, concurrent=pipelined,
+                             ctx=self.context)
+        server.bind()
+        client = RequestClient(self.loop, "bench.reqrep", raw=True, pipelined=pipelined,
+                               ctx=self.client_context(transport))
+        self.connect(client, server, transport)
+        self.loop.call_later(0.2, self.loop.stop)
+        self.loop.start()
+        for _ in range(min(window, count)):
+            self.loop.add_callback(send)
+        (wall, cpu) = self.run()
+        state["active"] = False
+        client.close()
+        server.close()
+        result = {
+            "benchmark": "reqrep", "transport": transport, "size": size, "window": window,
+            "sent": state["sent"], "received": state["received"], "lost": count - state["received"],
+            "seconds": round(wall, 4),
+            "msgs_per_sec": round(state["received"] / wall, 1) if wall else None,
+            "cpu_us_per_msg": round(cpu / state["received"] * 1e6, 3) if state["received"] else None,
+        }
+        result.update(latency_stats(latencies))
+        return result
+
+
+def int_list(value):
+    """Helper to parse a comma separated list of ints from the command line
+    """
+    return [int(v) for v in value.split(",") if v]
+
+
+def str_list(value):
+    """Helper to parse a comma separated list of strings from the command line
+    """
+    return [v for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="colugo message level benchmarks")
+    parser.add_argument("--benchmarks", type=str_list, default=["pubsub", "reqrep"],
+                        help="comma separated benchmarks to run (pubsub,reqrep)")
+    parser.add_argument("--sizes", type=int_list, default=[64, 1024, 65536], help="payload sizes in bytes")
+    parser.add_argument("--rates", type=int_list, default=[0],
+                        help="publish rates in messages per second, 0 is as fast as possible")
+    parser.add_argument("--fanouts", type=int_list, default=[1, 4], help="numbers of subscribers")
+    parser.add_argument("--batch-sizes", type=int_list, default=[0],
+                        help="messages received per wakeup with callback_batch, 0 is one message per callback")
+    parser.add_argument("--windows", type=int_list, default=[1, 16], help="numbers of outstanding requests")
+    parser.add_argument("--transports", type=str_list, default=["tcp", "ipc", "inproc", "local"],
+                        help="transports to use (tcp,ipc,inproc,local)")
+    parser.add_argument("--count", type=int, default=10000, help="messages per run")
+    parser.add_argument("--burst", type=int, default=100,
+                        help="messages published per loop turn when publishing as fast as possible")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a run is stopped")
+    parser.add_argument("--output", type=str, default=None, help="file to append results to (default: stdout)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    node = BenchmarkNode(args.timeout)
+    out = open(args.output, "a") if args.output else sys.stdout
+    host = {"host": platform.node(), "python": platform.python_version(), "zmq": zmq.zmq_version(),
+            "pyzmq": zmq.__version__, "time": time.time()}
+
+    def emit(result):
+        result.update(host)
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+    if "pubsub" in args.benchmarks:
+        for transport in args.transports:
+            for size in args.sizes:
+                for rate in args.rates:
+                    for fanout in args.fanouts:
+                        for batch_size in args.batch_sizes:
+                            emit(node.pubsub(size, rate, fanout, transport, args.count, args.burst, batch_size))
+    if "reqrep" in args.benchmarks:
+        for transport in args.transports:
+            if transport == "local":
+                continue
+            for size in args.sizes:
+                for window in args.windows:
+                    emit(node.reqrep(size, window, transport, args.count))
+    node.discovery.stop()
+    if args.output:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
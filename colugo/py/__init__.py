@@ -1 +1 @@
-__all__ = ['discovery', 'node', 'publisher', 'repeater', 'reply_server', 'request_client', 'subscriber', 'zsocket']
\ No newline at end of file
+__all__ = ['client_pool', 'codec', 'context', 'discovery', 'discovery_backend', 'message_log', 'metrics', 'node', 'player', 'publisher', 'recorder', 'repeater', 'reply_server', 'request_client', 'sequence', 'snapshot', 'subscriber', 'timer_wheel', 'trace', 'zsocket']
\ No newline at end of file
@@ -0,0 +1,141 @@
+import logging
+import zmq
+
+from colugo.py.zsocket import Socket
+
+
+class ClientPool:
+    """Warm spare zmq sockets for the request clients of a topic
+
+    When a request times out, a colugo.py.RequestClient resets its zmq socket. Without a pool, that means
+    closing the socket and creating and connecting a new one, and the next request waits for the new
+    connections to complete their handshakes. With a pool, the client swaps in a spare socket that was
+    created and connected to the same reply servers ahead of time. The old socket is closed on the next
+    event loop turn, and a new spare is created FILL_DELAY_MS later, so neither competes with the request
+    that usually follows a timeout.
+
+    A node keeps one pool per topic, shared by its (non-pipelined) request clients of that topic. Every
+    endpoint a client connects to is also connected by the spares, so a spare is only handed to a client
+    that is connected to exactly the same servers.
+
+    Attributes:
+        logger: Logger instance for pool activity
+        loop: Reference to the tornado event loop
+        ctx: colugo.py.Context used to create the spares
+        topic: Topic of the request clients
+        protocol: zmq socket type of the spares
+        size: Number of spares kept ready
+        spares: List of spare zmq.Socket objects
+        connections: Dict of (address, port) to the endpoint every spare is connected to
+        created: Number of spares created
+        swaps: Number of spares handed to clients
+        filling: If a fill() is already scheduled
+    """
+
+    FILL_DELAY_MS = 20
+
+    def __init__(self, loop, ctx, topic, protocol, size=1):
+        """Constructor
+
+        Args:
+            loop: Reference to the tornado event loop
+            ctx: colugo.py.Context used to create the spares
+            topic: Topic of the request clients
+            protocol: zmq socket type of the request clients
+            size: Number of spares to keep ready (default: 1)
+        """
+        self.logger = logging.getLogger("Socket")
+        self.loop = loop
+        self.ctx = ctx
+        self.topic = topic
+        self.protocol = protocol
+        self.size = size
+        self.spares = []
+        self.connections = {}
+        self.created = 0
+        self.swaps = 0
+        self.filling = False
+
+    def connect(self, address, port, endpoint):
+        """Connect the spares to an endpoint a client of the pool connected to
+
+        Args:
+            address: Decimal separated string (eg, 127.0.0.1) where service is bound
+            port: int associated with service port
+            endpoint: Endpoint the client connected with
+        """
+        if self.connections.get((address, port)) == endpoint:
+            return
+        self.connections[(address, port)] = endpoint
+        for spare in self.spares:
+            spare.connect(endpoint)
+        self.schedule_fill()
+
+    def disconnect(self, address, port):
+        """Disconnect the spares from a server that is gone, eg removed from the network or evicted from
+        the discovery snapshot
+
+        Args:
+            address: Decimal separated string (eg, 127.0.0.1) where service is bound
+            port: int associated with service port
+        """
+        endpoint = self.connections.pop((address, port), None)
+        if endpoint is None:
+            return
+        for spare in self.spares:
+            try:
+                spare.disconnect(endpoint)
+            except zmq.ZMQError as e:
+                self.logger.debug("Disconnecting spare from {} failed: {}".format(endpoint, e))
+
+    def take(self, connections):
+        """Get a spare connected to the same servers as a client, and schedule its replacement
+
+        Args:
+            connections: Dict of (address, port) to endpoint of the client
+
+        Returns:
+            zmq.Socket|None: Connected spare, or None if there is none ready for these connections
+        """
+        if not self.spares or connections != self.connections:
+            return None
+        spare = self.spares.pop()
+        self.swaps += 1
+        self.schedule_fill()
+        return spare
+
+    def recycle(self, stream):
+        """Close the stream (and zmq socket) a client swapped out, on the next event loop turn
+
+        Args:
+            stream: ZMQStream of the old socket
+        """
+        stream.stop_on_recv()
+        self.loop.add_callback(stream.close)
+
+    def schedule_fill(self):
+        """Helper to top up the spares after FILL_DELAY_MS
+        """
+        if not self.filling and len(self.spares) < self.size:
+            self.filling = True
+            self.loop.call_later(self.FILL_DELAY_MS / 1000.0, self.fill)
+
+    def fill(self):
+        """Create and connect spares until there are size of them
+        """
+        self.filling = False
+        while len(self.spares) < self.size and self.connections:
+            spare = self.ctx.socket(self.protocol, Socket.socket_options(self.protocol))
+            for endpoint in self.connections.values():
+                spare.connect(endpoint)
+            self.spares.append(spare)
+            self.created += 1
+        self.logger.debug("REQ \"{}\" pool has {} spares".format(self.topic, len(self.spares)))
+
+    def close(self):
+        """Close the spares
+        """
+        for spare in self.spares:
+            spare.close()
+        self.spares = []
+        self.connections = {}
@@ -0,0 +1,177 @@
+import abc
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(abc.ABC):
+    """Converts between application objects and the bytes carried in a message frame
+
+    A codec is given to a socket at construction time. Outgoing messages are encoded once when they
+    are sent, and incoming messages are decoded once when they are received, before being passed to
+    any callbacks. The codec name is advertised with the service by the discovery layer, so clients
+    can check that they speak the same format as the servers they connect to.
+
+    Attributes:
+        name: Name of the format, advertised by the discovery layer
+        zero_copy: If True, messages are received without copying and decode() is passed a memoryview
+                   of the zmq message buffer, otherwise it is passed bytes
+    """
+
+    name = None
+    zero_copy = False
+
+    @abc.abstractmethod
+    def encode(self, message):
+        """Convert an application object into a frame
+
+        Args:
+            message: Object to be sent
+
+        Returns:
+            bytes: Encoded message
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decode(self, data):
+        """Convert a received frame into an application object
+
+        Args:
+            data: bytes, or memoryview if zero_copy is set
+
+        Returns:
+            The decoded object
+        """
+        raise NotImplementedError
+
+    def decode_key(self, key):
+        """Convert the key frame of a keyed message into the key passed to filter callbacks
+
+        Args:
+            key: bytes, or memoryview if zero_copy is set
+
+        Returns:
+            str: Key decoded as UTF-8
+        """
+        return bytes(key).decode("utf-8")
+
+    @staticmethod
+    def from_name(name):
+        """Create a codec from an advertised name
+
+        Args:
+            name: Codec name (eg, json)
+
+        Returns:
+            colugo.py.Codec|None: New codec, or None if the name can't be constructed without more
+            information (eg, protobuf message types) or its module isn't installed
+        """
+        codecs = {StringCodec.name: StringCodec, RawCodec.name: RawCodec, JSONCodec.name: JSONCodec}
+        if msgpack is not None:
+            codecs[MsgpackCodec.name] = MsgpackCodec
+        codec = codecs.get(name)
+        return codec() if codec else None
+
+
+class StringCodec(Codec):
+    """UTF-8 strings, the default codec
+
+    Bytes are sent unchanged, so existing publishers of binary payloads keep working.
+    """
+
+    name = "string"
+
+    def encode(self, message):
+        if type(message) == str:
+            return message.encode("utf-8")
+        return message
+
+    def decode(self, data):
+        return bytes(data).decode("utf-8")
+
+
+class RawCodec(Codec):
+    """Binary payloads, passed to callbacks as zero-copy memoryviews of the zmq message buffer
+    """
+
+    name = "raw"
+    zero_copy = True
+
+    def encode(self, message):
+        if type(message) == str:
+            return message.encode("utf-8")
+        return message
+
+    def decode(self, data):
+        return data
+
+    def decode_key(self, key):
+        return key
+
+
+class JSONCodec(Codec):
+    """Any object that can be serialized by the json module
+    """
+
+    name = "json"
+
+    def encode(self, message):
+        return json.dumps(message).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """Any object that can be serialized by msgpack, requires the msgpack module
+    """
+
+    name = "msgpack"
+    zero_copy = True
+
+    def __init__(self):
+        """Constructor
+
+        Raises:
+            ImportError: If the msgpack module isn't installed
+        """
+        if msgpack is None:
+            raise ImportError("MsgpackCodec requires the msgpack module")
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class ProtobufCodec(Codec):
+    """Protobuf messages of a single type
+
+    The advertised name includes the full name of the message type, so clients only connect to
+    servers that send the same type.
+
+    Attributes:
+        message_class: Generated protobuf message class used to parse received messages
+    """
+
+    def __init__(self, message_class):
+        """Constructor
+
+        Args:
+            message_class: Generated protobuf message class (eg, test_pb2.TestMessage)
+        """
+        self.message_class = message_class
+        self.name = "protobuf/{}".format(message_class.DESCRIPTOR.full_name)
+
+    def encode(self, message):
+        return message.SerializeToString()
+
+    def decode(self, data):
+        message = self.message_class()
+        message.ParseFromString(data)
+        return message
@@ -0,0 +1,70 @@
+import uuid
+import zmq
+
+
+class Context:
+    """Wrapper class for zmq.Context that applies socket options in one place
+
+    All sockets created by a node share a single context. Options that should apply to every socket
+    (eg, zmq.LINGER, zmq.SNDHWM) are set on each socket as it is created, rather than on the zmq context
+    itself, so they never leak into sockets created elsewhere in the process.
+
+    Attributes:
+        id: Unique identifier of the context, sockets with the same context id can use inproc:// endpoints
+        zmq_context: Underlying zmq.Context object
+        socket_options: Dict of zmq socket option to value, applied to every socket created
+    """
+
+    default = None
+
+    def __init__(self, io_threads=1, max_sockets=None, socket_options=None, zmq_context=None):
+        """Constructor for the context class
+
+        Args:
+            io_threads: Number of zmq background I/O threads (default: 1)
+            max_sockets: Maximum number of sockets allowed on the context (default: None, zmq default)
+            socket_options: Dict of zmq socket option to value, applied to every socket created (default: None)
+            zmq_context: Existing zmq.Context to wrap instead of creating one, io_threads is ignored
+                         (default: None)
+        """
+        self.id = uuid.uuid4().hex
+        self.zmq_context = zmq_context if zmq_context else zmq.Context(io_threads=io_threads)
+        if max_sockets is not None:
+            self.zmq_context.set(zmq.MAX_SOCKETS, max_sockets)
+        self.socket_options = dict(socket_options) if socket_options else {}
+
+    @classmethod
+    def instance(cls):
+        """Returns the process wide default context, used by sockets created outside of a node
+
+        Returns:
+            colugo.py.Context: Context wrapping zmq.Context.instance()
+        """
+        if cls.default is None:
+            cls.default = cls(zmq_context=zmq.Context.instance())
+        return cls.default
+
+    def socket(self, protocol, options=None):
+        """Create a zmq.Socket and apply socket options
+
+        The context wide socket options are applied first, then the options specific to this socket.
+
+        Args:
+            protocol: zmq socket type
+            options: Dict of zmq socket option to value for this socket only (default: None)
+
+        Returns:
+            zmq.Socket: The new socket
+        """
+        sock = self.zmq_context.socket(protocol)
+        for (option, value) in self.socket_options.items():
+            sock.setsockopt(option, value)
+        if options:
+            for (option, value) in options.items():
+                sock.setsockopt(option, value)
+        return sock
+
+    def term(self):
+        """Terminate the underlying zmq context, all sockets must be closed first
+        """
+        self.zmq_context.term()
@@ -6,10 +6,20 @@ import logging
 class Directory:
     """Maintainer of discovered services on the network
 
+    Services are indexed by topic, by (topic, node uuid) and by mdns name, so adding, removing and
+    looking up services takes time proportional to the number of matching services rather than the
+    size of the directory. Each index maps to a dict used as an insertion ordered set of services.
+
+    Services are hashed by their contents (see colugo.py.Service.__hash__), so a service must not be
+    modified while it is in the directory.
+
     Attributes:
         logger: Logger instance, specific to activities within the service discovery layers
         node_uuid: Unique identifier of the local node where the directory is housed
-        servces: List of services that are currently active on the network (servers only)
+        index: Dict containing every service in the directory (service -> service)
+        topics: Dict of topic string to the services with that topic
+        topic_uuids: Dict of (topic, node uuid) to the services with that topic and node uuid
+        mdns_names: Dict of mdns name to the services with that name
     """
 
     def __init__(self, node_uuid):
@@ -20,7 +30,16 @@ class Directory:
         """
         self.logger = logging.getLogger("Discovery")
         self.node_uuid = node_uuid
-        self.services = []
+        self.index = {}
+        self.topics = {}
+        self.topic_uuids = {}
+        self.mdns_names = {}
+
+    @property
+    def services(self):
+        """List of services that are currently active on the network, in the order they were added
+        """
+        return list(self.index)
 
     def add(self, service):
         """Add a newly discovered service to the directory
@@ -34,7 +53,10 @@ class Directory:
         if self.check_existance(service):
             self.logger.warn("Service {}@{} already exists!".format(service.mdns_name, service.node_uuid))
             return False
-        self.services.append(service)
+        self.index[service] = service
+        self.topics.setdefault(service.topic, {})[service] = service
+        self.topic_uuids.setdefault((service.topic, service.node_uuid), {})[service] = service
+        self.mdns_names.setdefault(service.mdns_name, {})[service] = service
         return True
 
     def check_existance(self, service):
@@ -48,11 +70,8 @@ class Directory:
         Returns:
             Bool: If service exists in the directory
         """
-        for s in self.services:
-            # use Service eq operator to compare service definitions
-            if s == service:
-                return True
-        return False
+        # use Service hash and eq operators to compare service definitions
+        return service in self.index
 
     def remove(self, topic, service_uuid):
         """Remove a service from the directory
@@ -69,10 +88,73 @@ class Directory:
         Returns:
             Bool: If remove from directory was successful or not
         """
-        for s in self.services:
-            # since we only have access to the topic and uuid from the mdns name
-            # we can't use the colugo.py.Service comparitor here
-            if s.topic == topic and s.node_uuid == service_uuid:
-                self.services.remove(s)
-                return True
+        # since we only have access to the topic and uuid from the mdns name
+        # we can't use the colugo.py.Service comparitor here
+        for s in self.topic_uuids.get((topic, service_uuid), {}):
+            return self.remove_service(s)
         return False
+
+    def remove_service(self, service):
+        """Remove a specific service from the directory
+
+        Args:
+            service: Service object to be removed
+
+        Returns:
+            Bool: If remove from directory was successful or not
+        """
+        service = self.index.pop(service, None)
+        if service is None:
+            return False
+        self.discard(self.topics, service.topic, service)
+        self.discard(self.topic_uuids, (service.topic, service.node_uuid), service)
+        self.discard(self.mdns_names, service.mdns_name, service)
+        return True
+
+    def discard(self, index, key, service):
+        """Helper to remove a service from one of the indexes, dropping the key once it is empty
+
+        Args:
+            index: The index dict to remove the service from
+            key: Key of the index entry that holds the service
+            service: Service object to be removed
+        """
+        services = index.get(key)
+        if services is not None:
+            services.pop(service, None)
+            if not services:
+                del index[key]
+
+    def get(self, topic):
+        """Find all services with a topic
+
+        Args:
+            topic: Topic string to look up
+
+        Returns:
+            List: Services with the topic
+        """
+        return list(self.topics.get(topic, ()))
+
+    def get_by_uuid(self, topic, node_uuid):
+        """Find all services with a topic that belong to a node
+
+        Args:
+            topic: Topic string to look up
+            node_uuid: Unique identifier of the node that contains the services
+
+        Returns:
+            List: Services with the topic and node uuid
+        """
+        return list(self.topic_uuids.get((topic, node_uuid), ()))
+
+    def get_by_mdns_name(self, name):
+        """Find all services with an mdns name
+
+        Args:
+            name: mdns name (eg., _topicname._uuid._colugo._tcp.local.) to look up
+
+        Returns:
+            List: Services with the mdns name
+        """
+        return list(self.mdns_names.get(name, ()))
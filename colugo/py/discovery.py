@@ -1,32 +1,39 @@
 #!/usr/bin/env python
 
 import logging
-import socket
-from zeroconf import (
-    ServiceInfo,
-    ServiceBrowser,
-    ServiceStateChange,
-    Zeroconf,
-    ZeroconfServiceTypes,
-)
-
-from colugo.py.service import Service
+import time
+
+from colugo.py.service import Service, COLUGO_TYPE_STR
 from colugo.py.directory import Directory
+from colugo.py.discovery_backend import ZeroconfBackend
+from colugo.py.snapshot import Snapshot
 
 logging.basicConfig(
     format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
-COLUGO_TYPE_STR = "_colugo._tcp.local."
 
 
 class Discovery:
-    """Utility class for socket service discovery built on top of zeroconf
+    """Utility class for socket service discovery
     
     Since individual sockets must be bound and connect using protocols, addresses and ports, a
     service discovery layer is utilized to map topic strings for each server client to the 
     appropriate protocol, address and port on the network. Services (zmq sockets that bind to ports) 
-    are broadcast as zeroconf services using mdns (to both bonjour and avahi). Then, a listener 
-    receives those broadcasts and passes them upstream so connections can be made by clients that are
-    looking for those services.
+    are announced by a discovery backend, which also listens for the announcements of other nodes and
+    passes them upstream so connections can be made by clients that are looking for those services.
+
+    By default, services are broadcast as zeroconf services using mdns (colugo.py.ZeroconfBackend).
+    Where multicast is slow or unavailable, a static configuration (colugo.py.StaticBackend) or a
+    registry directory shared by nodes on the same host (colugo.py.FileBackend) can be used instead.
+
+    Backends may report services from their own threads. When an event loop is provided, found and lost
+    services are marshalled onto it with add_callback, so the directories and the on_add/on_remove
+    callbacks are only ever touched from the event loop thread.
+
+    If a snapshot path is provided, the server directory is persisted to that file and reloaded on
+    startup, so clients can connect to previously known servers straight away (see colugo.py.Snapshot).
+    Services loaded from the snapshot are unconfirmed until the backend finds the same service on the
+    network; unconfirmed services are evicted once snapshot_ttl seconds have passed, or as soon as the
+    same mdns name resolves to a different address. Services older than snapshot_ttl are not loaded.
 
     Naming conventions:
         service: Any zmq socket with an associated topic, address and port (local or remote)
@@ -38,35 +45,52 @@ class Discovery:
 
     Attributes:
         logger: Logger instance, specific to activities within the service discovery layers
-        zeroconf: Zeroconf object that runs it's own thread and handles mdns broadcasts
-        browser: Zeroconf object that listens for changes in service being broadcast
+        backend: colugo.py.DiscoveryBackend that announces and finds services
         node_uuid: Unique identifier for the node that houses this class object
         on_add: Application level callback for when new services are received by the browser
         on_remove: Application level callback for when removed services are received by the browser
         servers: Maintains a list of servers that are known to be active on the network
         clients: Maintains a list of clients that are known to be active on the network
+        loop: Tornado event loop that callbacks are marshalled onto, or None to call them from the
+              backend threads
+        snapshot: colugo.py.Snapshot the server directory is persisted to, or None
+        snapshot_ttl: Number of seconds services loaded from the snapshot are trusted without confirmation
+        unconfirmed: Dict of services loaded from the snapshot that haven't been seen on the network yet
+        save_pending: If a snapshot save is scheduled on the event loop
     """
 
-    def __init__(self, node_uuid, on_add, on_remove):
+    def __init__(self, node_uuid, on_add, on_remove, loop=None, backend=None, snapshot_path=None,
+                 snapshot_ttl=30.0):
         """Constructor
         
         Args:
             node_uuid: Unique identifier for the node that houses this class object
             on_add: Callback for when new services are received by the browser
             on_remove: Callback for when removed services are received by the browser
+            loop: Tornado event loop to run callbacks on (default: None)
+            backend: colugo.py.DiscoveryBackend to use (default: None, colugo.py.ZeroconfBackend)
+            snapshot_path: File to persist the server directory to, and warm start from (default: None)
+            snapshot_ttl: Seconds that snapshot services are trusted without confirmation (default: 30.0)
         """
         # grab the logger with the same name as the node
         self.logger = logging.getLogger("Discovery")
-        self.zeroconf = Zeroconf()
-        self.browser = ServiceBrowser(self.zeroconf, "_colugo._tcp.local.", self)
         self.node_uuid = node_uuid
         self.on_add = on_add
         self.on_remove = on_remove
         self.servers = Directory(self.node_uuid)
         self.clients = Directory(self.node_uuid)
+        self.loop = loop
+        self.snapshot = Snapshot(snapshot_path) if snapshot_path else None
+        self.snapshot_ttl = snapshot_ttl
+        self.unconfirmed = {}
+        self.save_pending = False
+        self.load_snapshot()
+        # start the backend last, since services can be found immediately
+        self.backend = backend if backend else ZeroconfBackend()
+        self.backend.start(self.loop, self.service_found, self.service_lost)
 
     def register_server(self, topic, socket_type, node_uuid, socket, address, port):
-        """Informs zeroconf that a new service should be broadcast to the network
+        """Informs the backend that a new service should be announced to the network
 
         This is typically used when a server socket is being constructed by a node.
 
@@ -80,27 +104,35 @@ class Discovery:
             socket: Integer where the socket is bound
             address: Address string (eg, 127.0.0.1) associated with the socket
             port: Integer where the socket is bound
+
+        Returns:
+            colugo.py.Service: The service that was registered
         """
         service = Service(topic, address, port, socket_type, node_uuid, socket)
+        if socket is not None:
+            # advertise the ipc:// and inproc:// endpoints for clients on the same host or in the same process
+            service.set_local_endpoints(socket)
+            service.codec = socket.codec.name
         # for local sockets, we need to add to the directory manually, not from the mdns callback
         # since we won't have access to the socket object for the mdns callbacks
         self.servers.add(service)
-        self.zeroconf.register_service(service.get_service_info())
+        self.backend.register(service)
+        return service
 
     def unregister_server(self, service):
-        """Informs zeroconf that a service is being removed and broadcasts that to the network
+        """Informs the backend that a service is being removed and announces that to the network
         
         This is typically used when a server socket (or an entire node) is going down.
 
         Args:
             service: colugo.py.Service object to broadcast as being removed
         """
-        self.zeroconf.unregister_service(service.get_service_info())
+        self.backend.unregister(service)
 
     def register_client(self, topic, socket_type, node_uuid, socket, address=None, port=None):
         """Add a client to the clients directory
 
-        This will not broadcast the service over zeroconf since other nodes don't care about clients.
+        This will not announce the service to the network since other nodes don't care about clients.
         TODO(pickledgator): Can server sockets detect if clients connect/disconnect? Do we care?
 
         Args:
@@ -121,35 +153,7 @@ class Discovery:
             service: colugo.py.Service object to remove
         """
         # TODO(pickledgator): Do other network servers/clients care if a local client goes down?
-        self.clients.remove(service)
-
-    def service_from_zeroconf_query(self, topic, uuid):
-        """Helper function to create a colguo.py.Service from a zeroconf query
-
-        Args:
-            topic: Topic string associated with the socket
-            uuid: Unique identifier of the local node where the socket is located
-        
-        Returns:
-            colugo.py.Service|None: Populated service if found on the network, otherwise None
-        """
-        def fix_socket_type(info):
-            # For whatever reason, zeroconf is casting a property=1 to property=True
-            # This just undoes that cast since socket_type will be an int (not bool)
-            if info.properties['socket_type'.encode('utf-8')] == True:
-                info.properties['socket_type'.encode('utf-8')] = 1
-            return info
-
-        info = ServiceInfo(type_=COLUGO_TYPE_STR,
-                           name="_{}._{}.{}".format(topic, uuid, COLUGO_TYPE_STR))
-        res = info.request(self.zeroconf, 1000)
-        address = port = node_uuid = None
-        service = Service()
-        if res:
-            info = fix_socket_type(info)
-            service.fill_from_info(info)
-            return service
-        return None
+        self.clients.remove_service(service)
 
     def unregister_all_servers(self):
         """Helper function to unregister all services that are servers
@@ -170,60 +174,151 @@ class Discovery:
                 self.unregister_client(c)
 
     def stop_listening(self):
-        """Stop the zeroconf browser callbacks from firing.
+        """Stop the backend from reporting found and lost services
+
+        When nodes are exiting, they announce that their sockets are going down and we may get
+        loop back messages for the local node's sockets. Since we don't care about these loopback
+        messages when a node is closing, the listeners can be turned off early.
+        """
+        self.backend.stop_listening()
+
+    def load_snapshot(self):
+        """Add the services recorded in the snapshot to the server directory as unconfirmed services
+        """
+        if not self.snapshot:
+            return
+        for service in self.snapshot.load(self.snapshot_ttl):
+            # our own services are registered as the node creates them
+            if service.node_uuid != self.node_uuid and self.servers.add(service):
+                self.unconfirmed[service] = service
+        if self.unconfirmed:
+            self.logger.info("Loaded {} services from snapshot {}".format(len(self.unconfirmed), self.snapshot.path))
+            if self.loop:
+                self.loop.call_later(self.snapshot_ttl, self.expire_snapshot)
+
+    def expire_snapshot(self):
+        """Evict all services loaded from the snapshot that haven't been confirmed on the network
+        """
+        for service in list(self.unconfirmed.values()):
+            self.evict(service)
+
+    def evict(self, service):
+        """Remove an unconfirmed snapshot service from the directory and notify the application
+
+        Args:
+            service: colugo.py.Service loaded from the snapshot
+        """
+        self.logger.debug("Evicting unconfirmed service: {}".format(service))
+        self.unconfirmed.pop(service, None)
+        self.servers.remove_service(service)
+        self.on_remove(service.topic)
+        self.schedule_save()
 
-        Techicanlly speaking, zeroconf.close() also calls this, but it turns out that when
-        nodes are exiting, they spam the network that their sockets are going down and we 
-        get loop back messages for the local node's sockets. Since we don't care about these 
-        loopback messages when a node is closing, we just turn of the service listeners for 
-        zeroconf early.
+    def schedule_save(self):
+        """Save the snapshot soon, coalescing bursts of directory changes into a single write
         """
-        self.zeroconf.remove_all_service_listeners()
+        if not self.snapshot or self.save_pending:
+            return
+        if self.loop:
+            self.save_pending = True
+            self.loop.call_later(1.0, self.save_snapshot)
+        else:
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        """Write the servers of other nodes in the directory to the snapshot
+
+        Services confirmed on the network are still there, so they are stamped with the time of the save
+        and the snapshot TTL applies to the age of the snapshot. Unconfirmed services keep the time they
+        were last seen, so they don't outlive the TTL by being saved again on every restart.
+        """
+        self.save_pending = False
+        if self.snapshot:
+            now = time.time()
+            services = [s for s in self.servers.services if s.node_uuid != self.node_uuid]
+            for service in services:
+                if service not in self.unconfirmed:
+                    service.timestamp = now
+            self.snapshot.save(services)
 
     def stop(self):
-        """Stop zeroconf and clean up threads
+        """Stop the backend and clean up threads
         """
+        self.save_snapshot()
         self.unregister_all_servers()
-        self.zeroconf.close()
+        self.backend.close()
+
+    def dispatch(self, callback, *args):
+        """Run a callback on the event loop thread, or immediately if there is no event loop
 
-    def topic_from_mdns_name(self, name):
-        """Helper to get topic and uuid information about a service
-        
         Args:
-            name: mdns name to parse
+            callback: Function to execute
+            args: Arguments passed to the callback
+        """
+        if self.loop:
+            self.loop.add_callback(callback, *args)
+        else:
+            callback(*args)
 
-        Returns:
-            (String, String): Topic string and uuid string of the socket
-        """
-        # assumes name is rigidly structured eg, _topic.string._colugo._tcp.local.
-        tokens = [t[:-1] for t in name.split("_")][1:]
-        return (tokens[0], tokens[1])
-
-    def add_service(self, zeroconf, service_type, name):
-        """This function is utilized by the zeroconf.ServiceBrowser callbacks
-        """
-        # get details of the newly discovered service
-        (topic, uuid) = self.topic_from_mdns_name(name)
-        # generate our full topic object from the acquired info
-        service = self.service_from_zeroconf_query(topic, uuid)
-        if service:
-            self.logger.debug("Service added: {}".format(name))
-            # try to add the topic to the directory
-            # this will fail for local topics that were already added
-            if not self.servers.check_existance(service):
-                if self.servers.add(service):
-                    self.on_add(service)
-
-    def remove_service(self, zeroconf, service_type, name):
-        """This function is utilized by the zeroconf.ServiceBrowser callbacks
-        """
-        (topic, uuid) = self.topic_from_mdns_name(name)
-        self.logger.debug("Service removed: {}".format(name))
+    def service_found(self, service):
+        """Backend callback for when a service is found, may run on any thread
+
+        Args:
+            service: colugo.py.Service that was found
+        """
+        self.dispatch(self.service_resolved, service)
+
+    def service_lost(self, topic, node_uuid):
+        """Backend callback for when a service goes away, may run on any thread
+
+        Args:
+            topic: Topic string of the service
+            node_uuid: Unique identifier of the node that contained the service
+        """
+        self.dispatch(self.service_removed, topic, node_uuid)
+
+    def service_resolved(self, service):
+        """Add a found service to the directory and notify the application
+
+        Args:
+            service: colugo.py.Service that was found
+        """
+        self.logger.debug("Service added: {}".format(service.mdns_name))
+        if self.unconfirmed:
+            confirmed = self.unconfirmed.pop(service, None)
+            if confirmed:
+                # the snapshot was right, and we're already connected
+                confirmed.timestamp = service.timestamp
+                self.schedule_save()
+                return
+            for stale in self.servers.get_by_mdns_name(service.mdns_name):
+                if stale in self.unconfirmed:
+                    # the service has moved since the snapshot was taken
+                    self.evict(stale)
+        # try to add the topic to the directory
+        # this will fail for local topics that were already added
+        if not self.servers.check_existance(service):
+            if self.servers.add(service):
+                self.on_add(service)
+                self.schedule_save()
+
+    def service_removed(self, topic, uuid):
+        """Remove a service from the directory and notify the application
+
+        Args:
+            topic: Topic string of the service
+            uuid: Unique identifier of the node that contained the service
+        """
+        self.logger.debug("Service removed: {}@{}".format(topic, uuid))
         # By time this callback occurs, we can no longer access the ServiceInfo
         # for the specified service, so we can have to remove our service from the
         # Directory based on the topic only.
         # TODO(pickledgator): This wont work if we have two services with the same topic
         # within the same node, however it works fine if the two services with the same
         # topic are on different nodes (due to inclusion of the uuid in the check)
+        for s in self.servers.get_by_uuid(topic, uuid)[:1]:
+            # Directory.remove() removes the first match
+            self.unconfirmed.pop(s, None)
         self.servers.remove(topic, uuid)
         self.on_remove(topic)
+        self.schedule_save()
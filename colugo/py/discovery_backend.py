@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from tornado import ioloop
+from zeroconf import (
+    ServiceInfo,
+    ServiceBrowser,
+    Zeroconf,
+)
+import zmq
+
+from colugo.py.service import Service, COLUGO_TYPE_STR
+
+
+class DiscoveryBackend:
+    """Interface between colugo.py.Discovery and the mechanism used to find services
+
+    A backend announces the servers of the local node and reports the servers it finds (including the
+    local node's own servers). Found and lost services may be reported from any thread; colugo.py.Discovery
+    takes care of moving them onto the event loop.
+
+    Attributes:
+        logger: Logger instance, specific to activities within the service discovery layers
+        loop: Tornado event loop of the node, set by start()
+        on_found: Callback for when a service is found, on_found(service)
+        on_lost: Callback for when a service goes away, on_lost(topic, node_uuid)
+    """
+
+    def __init__(self):
+        """Constructor
+        """
+        self.logger = logging.getLogger("Discovery")
+        self.loop = None
+        self.on_found = None
+        self.on_lost = None
+
+    def start(self, loop, on_found, on_lost):
+        """Start looking for services
+
+        Args:
+            loop: Tornado event loop of the node (may be None)
+            on_found: Callback for when a service is found, on_found(service)
+            on_lost: Callback for when a service goes away, on_lost(topic, node_uuid)
+        """
+        self.loop = loop
+        self.on_found = on_found
+        self.on_lost = on_lost
+
+    def register(self, service):
+        """Announce a local server
+
+        Args:
+            service: colugo.py.Service of the server
+        """
+        pass
+
+    def unregister(self, service):
+        """Withdraw the announcement of a local server
+
+        Args:
+            service: colugo.py.Service of the server
+        """
+        pass
+
+    def stop_listening(self):
+        """Stop reporting found and lost services
+        """
+        self.on_found = None
+        self.on_lost = None
+
+    def close(self):
+        """Stop the backend and clean up any threads or resources
+        """
+        self.stop_listening()
+
+    def found(self, service):
+        """Helper to report a found service, if still listening
+
+        Args:
+            service: colugo.py.Service that was found
+        """
+        on_found = self.on_found
+        if on_found:
+            on_found(service)
+
+    def lost(self, topic, node_uuid):
+        """Helper to report a lost service, if still listening
+
+        Args:
+            topic: Topic string of the service
+            node_uuid: Unique identifier of the node that contained the service
+        """
+        on_lost = self.on_lost
+        if on_lost:
+            on_lost(topic, node_uuid)
+
+
+class ZeroconfBackend(DiscoveryBackend):
+    """Discovery backend built on top of zeroconf
+
+    Services (zmq sockets that bind to ports) are broadcast as zeroconf services using mdns (to both
+    bonjour and avahi), and a browser listens for those broadcasts.
+
+    Browser callbacks arrive on the zeroconf thread. Resolving a service can block for up to a second,
+    so each resolution is handed to a pool of resolver threads, allowing many services to be resolved
+    concurrently without stalling the browser.
+
+    Attributes:
+        zeroconf: Zeroconf object that runs it's own thread and handles mdns broadcasts
+        browser: Zeroconf object that listens for changes in service being broadcast
+        resolver: Thread pool that resolves newly browsed services
+        generations: Dict of mdns name to a counter bumped each time the service is removed, used to
+                     discard resolutions that finish after their service was removed
+        lock: Lock held while the generations are read or changed and the matching service is reported, so a
+              removal is never reported before the resolution it overtook
+    """
+
+    def __init__(self, resolver_threads=8):
+        """Constructor
+
+        Args:
+            resolver_threads: Number of services that can be resolved concurrently (default: 8)
+        """
+        super(ZeroconfBackend, self).__init__()
+        self.zeroconf = Zeroconf()
+        self.browser = None
+        self.resolver = ThreadPoolExecutor(resolver_threads)
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def start(self, loop, on_found, on_lost):
+        """Start the zeroconf browser
+        """
+        super(ZeroconfBackend, self).start(loop, on_found, on_lost)
+        self.browser = ServiceBrowser(self.zeroconf, COLUGO_TYPE_STR, self)
+
+    def register(self, service):
+        """Informs zeroconf that a new service should be broadcast to the network
+        """
+        self.zeroconf.register_service(service.get_service_info())
+
+    def unregister(self, service):
+        """Informs zeroconf that a service is being removed and broadcasts that to the network
+        """
+        self.zeroconf.unregister_service(service.get_service_info())
+
+    def stop_listening(self):
+        """Stop the zeroconf browser callbacks from firing.
+
+        Techicanlly speaking, zeroconf.close() also calls this, but it turns out that when
+        nodes are exiting, they spam the network that their sockets are going down and we
+        get loop back messages for the local node's sockets. Since we don't care about these
+        loopback messages when a node is closing, we just turn of the service listeners for
+        zeroconf early.
+        """
+        with self.lock:
+            # a resolution that is reporting its service finishes first, none are reported after this
+            super(ZeroconfBackend, self).stop_listening()
+        # not under the lock, this waits for the browser thread, which may be waiting for the lock
+        self.zeroconf.remove_all_service_listeners()
+
+    def close(self):
+        """Stop zeroconf and clean up threads
+        """
+        super(ZeroconfBackend, self).close()  # DiscoveryBackend.close()
+        self.zeroconf.close()
+        # don't wait on queries that are still in flight, their results are no longer needed
+        self.resolver.shutdown(wait=False)
+
+    def service_from_zeroconf_query(self, topic, uuid):
+        """Helper function to create a colguo.py.Service from a zeroconf query
+
+        Args:
+            topic: Topic string associated with the socket
+            uuid: Unique identifier of the local node where the socket is located
+
+        Returns:
+            colugo.py.Service|None: Populated service if found on the network, otherwise None
+        """
+        def fix_socket_type(info):
+            # For whatever reason, zeroconf is casting a property=1 to property=True
+            # This just undoes that cast since socket_type will be an int (not bool)
+            if info.properties['socket_type'.encode('utf-8')] == True:
+                info.properties['socket_type'.encode('utf-8')] = 1
+            return info
+
+        info = ServiceInfo(type_=COLUGO_TYPE_STR,
+                           name="_{}._{}.{}".format(topic, uuid, COLUGO_TYPE_STR))
+        res = info.request(self.zeroconf, 1000)
+        service = Service()
+        if res:
+            info = fix_socket_type(info)
+            service.fill_from_info(info)
+            return service
+        return None
+
+    def topic_from_mdns_name(self, name):
+        """Helper to get topic and uuid information about a service
+
+        Args:
+            name: mdns name to parse
+
+        Returns:
+            (String, String): Topic string and uuid string of the socket
+        """
+        # assumes name is rigidly structured eg, _topic.string._colugo._tcp.local.
+        tokens = [t[:-1] for t in name.split("_")][1:]
+        return (tokens[0], tokens[1])
+
+    def add_service(self, zeroconf, service_type, name):
+        """This function is utilized by the zeroconf.ServiceBrowser callbacks
+
+        Only queues the service for resolution, so the zeroconf thread is never blocked.
+        """
+        # get details of the newly discovered service
+        (topic, uuid) = self.topic_from_mdns_name(name)
+        with self.lock:
+            generation = self.generations.get(name, 0)
+        try:
+            self.resolver.submit(self.resolve_service, topic, uuid, name, generation)
+        except RuntimeError:
+            # resolver has been shut down, the node is stopping
+            pass
+
+    def resolve_service(self, topic, uuid, name, generation):
+        """Query the network for the details of a browsed service, runs on a resolver thread
+
+        Args:
+            topic: Topic string associated with the socket
+            uuid: Unique identifier of the node where the socket is located
+            name: mdns name of the service
+            generation: Value of the removal counter for the service when it was browsed
+        """
+        # generate our full topic object from the acquired info
+        service = self.service_from_zeroconf_query(topic, uuid)
+        # drop the service if it was removed while it was being resolved, a removal can't be reported
+        # until the lock is released, so it is always reported after the service is found
+        with self.lock:
+            if service and self.generations.get(name, 0) == generation:
+                self.found(service)
+
+    def remove_service(self, zeroconf, service_type, name):
+        """This function is utilized by the zeroconf.ServiceBrowser callbacks
+        """
+        (topic, uuid) = self.topic_from_mdns_name(name)
+        with self.lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
+            self.lost(topic, uuid)
+
+
+class StaticBackend(DiscoveryBackend):
+    """Discovery backend that reads a fixed list of servers from configuration
+
+    Nothing is announced; local servers are still added to the node's directory as they are created.
+    Each entry is a dict with topic, address, port and socket_type keys (socket_type may be a zmq socket
+    type int or a name such as "PUB"), and optionally a node_uuid and codec name.
+
+    Attributes:
+        services: List of colugo.py.Service objects built from the configuration
+    """
+
+    def __init__(self, services):
+        """Constructor
+
+        Args:
+            services: List of service dicts, or the path to a json file containing that list
+        """
+        super(StaticBackend, self).__init__()
+        if isinstance(services, str):
+            with open(services) as f:
+                services = json.load(f)
+        self.services = [self.service_from_config(entry) for entry in services]
+
+    def service_from_config(self, entry):
+        """Helper to create a colugo.py.Service from a configuration entry
+
+        Args:
+            entry: Dict with topic, address, port, socket_type and optionally node_uuid and codec keys
+
+        Returns:
+            colugo.py.Service: Populated service
+        """
+        socket_type = entry["socket_type"]
+        if isinstance(socket_type, str):
+            socket_type = getattr(zmq, socket_type.upper())
+        return Service().fill_from_dict({
+            "topic": entry["topic"],
+            "address": entry["address"],
+            "port": int(entry["port"]),
+            "socket_type": socket_type,
+            "node_uuid": entry.get("node_uuid", "static"),
+            "timestamp": time.time(),
+            "codec": entry.get("codec"),
+        })
+
+    def start(self, loop, on_found, on_lost):
+        """Report every configured service as found
+        """
+        super(StaticBackend, self).start(loop, on_found, on_lost)
+        for service in self.services:
+            self.found(service)
+
+
+class FileBackend(DiscoveryBackend):
+    """Discovery backend that uses a directory of registration files shared by nodes on the same host
+
+    Each local server is announced by atomically writing a small json file into the registry directory,
+    and withdrawn by deleting it. The directory is polled on the event loop, so nodes converge within
+    one poll period without needing multicast. Registrations left behind by processes on this host that
+    have exited are ignored and cleaned up.
+
+    Attributes:
+        path: Registry directory
+        poll_ms: Number of milliseconds between scans of the registry directory
+        known: Dict of registration file name to (mtime, colugo.py.Service) for reported services
+        poller: tornado.ioloop.PeriodicCallback that scans the registry directory
+    """
+
+    def __init__(self, path=None, poll_ms=50):
+        """Constructor
+
+        Args:
+            path: Registry directory (default: None, colugo-registry in the system temp directory)
+            poll_ms: Number of milliseconds between scans of the registry directory (default: 50)
+        """
+        super(FileBackend, self).__init__()
+        self.path = path if path else os.path.join(tempfile.gettempdir(), "colugo-registry")
+        self.poll_ms = poll_ms
+        self.known = {}
+        self.poller = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def start(self, loop, on_found, on_lost):
+        """Scan the registry now and then every poll_ms on the event loop
+        """
+        super(FileBackend, self).start(loop, on_found, on_lost)
+        self.scan()
+        if loop:
+            self.poller = ioloop.PeriodicCallback(self.scan, self.poll_ms)
+            self.poller.start()
+
+    def file_name(self, service):
+        """Helper to get the registration file name of a service
+
+        Args:
+            service: colugo.py.Service of the server
+
+        Returns:
+            String: File name, unique for each bound socket of each node
+        """
+        return "{}.{}.json".format(service.node_uuid, service.port)
+
+    def register(self, service):
+        """Write the registration file of a local server
+        """
+        data = service.to_dict()
+        data["host"] = socket.gethostname()
+        data["pid"] = os.getpid()
+        path = os.path.join(self.path, self.file_name(service))
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def unregister(self, service):
+        """Delete the registration file of a local server
+        """
+        try:
+            os.remove(os.path.join(self.path, self.file_name(service)))
+        except OSError:
+            pass
+
+    def close(self):
+        """Stop polling the registry
+        """
+        super(FileBackend, self).close()
+        if self.poller:
+            self.poller.stop()
+
+    def alive(self, data):
+        """Check if the process that wrote a registration file is still running
+
+        Args:
+            data: Dict read from the registration file
+
+        Returns:
+            Bool: False only if the process was on this host and has exited
+        """
+        if data.get("host") != socket.gethostname():
+            return True
+        try:
+            os.kill(data["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except (OSError, KeyError):
+            pass
+        return True
+
+    def scan(self):
+        """Compare the registry directory with the reported services, reporting any changes
+        """
+        seen = set()
+        try:
+            names = [n for n in os.listdir(self.path) if n.endswith(".json")]
+        except OSError as e:
+            self.logger.warn("Could not read registry {}: {}".format(self.path, e))
+            return
+        for name in names:
+            path = os.path.join(self.path, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            seen.add(name)
+            known = self.known.get(name)
+            if known and known[0] == mtime:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                # being replaced, pick it up on the next scan
+                seen.discard(name)
+                continue
+            if not self.alive(data):
+                self.logger.debug("Removing stale registration {}".format(name))
+                self.unlink(path)
+                seen.discard(name)
+                continue
+            if known:
+                self.lost(known[1].topic, known[1].node_uuid)
+            service = Service().fill_from_dict(data)
+            self.known[name] = (mtime, service)
+            self.found(service)
+        for name in list(self.known):
+            if name not in seen:
+                (_, service) = self.known.pop(name)
+                self.lost(service.topic, service.node_uuid)
+
+    def unlink(self, path):
+        """Helper to delete a file, ignoring errors
+
+        Args:
+            path: Path of the file to delete
+        """
+        try:
+            os.remove(path)
+        except OSError:
+            pass
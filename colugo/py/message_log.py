@@ -0,0 +1,349 @@
+import bisect
+import json
+import mmap
+import struct
+
+
+class LogFormat:
+    """Layout of colugo message log files, shared by colugo.py.LogWriter and colugo.py.LogReader
+
+    A log file starts with MAGIC, followed by a sequence of blocks. Each block has a header with its type and
+    the length of its body:
+
+        block type (4 bytes) | body length (uint32) | body
+
+    TOPC blocks define a topic, with a json body {"id": int, "topic": string, "codec": string or null}. A
+    topic is always defined before the first chunk that contains its messages.
+
+    CHNK blocks hold a chunk of messages, with a per-topic time index ahead of the messages so readers can
+    tell what a chunk holds without reading it:
+
+        message count (uint32) | first time | last time (doubles) | topic count (uint16) |
+        per topic: topic id (uint16) | message count (uint32) | first time | last time (doubles) |
+        messages
+
+    Each message is stored as its receive time and the raw zmq frames, exactly as they were received:
+
+        time (double, seconds since the epoch) | topic id (uint16) | frame count (uint16) |
+        per frame: length (uint32) | frame
+
+    Blocks are only ever appended, so a log that was not closed cleanly can still be read up to the last
+    complete block.
+    """
+
+    MAGIC = b"COLUGOLOG\x01"
+    BLOCK = struct.Struct("!4sI")
+    TOPIC = b"TOPC"
+    CHUNK = b"CHNK"
+    CHUNK_HEADER = struct.Struct("!IddH")
+    CHUNK_TOPIC = struct.Struct("!HIdd")
+    RECORD = struct.Struct("!dHH")
+    FRAME = struct.Struct("!I")
+
+
+class LogWriter:
+    """Appends messages to a colugo message log file (see colugo.py.LogFormat)
+
+    Messages are collected in memory and written one chunk at a time. LogWriter is not thread safe; a
+    colugo.py.Recorder only uses it from its writer thread.
+
+    Attributes:
+        path: Path of the log file
+        chunk_size: Number of bytes of messages collected before a chunk is written
+        topics: Dict of topic string to topic id
+        file: File object of the log
+        chunk: bytearray of the messages of the current chunk
+        chunk_count: Number of messages in the current chunk
+        chunk_topics: Dict of topic id to [message count, first time, last time] for the current chunk
+        messages: Number of messages written
+    """
+
+    def __init__(self, path, chunk_size=1 << 20):
+        """Constructor, creates (or truncates) the log file
+
+        Args:
+            path: Path of the log file
+            chunk_size: Number of bytes of messages collected before a chunk is written (default: 1MB)
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.topics = {}
+        self.file = open(path, "wb")
+        self.file.write(LogFormat.MAGIC)
+        self.chunk = bytearray()
+        self.chunk_count = 0
+        self.chunk_topics = {}
+        self.messages = 0
+
+    def add_topic(self, topic, codec=None):
+        """Define a topic in the log, if it isn't already
+
+        Args:
+            topic: Topic string
+            codec: Name of the codec of the topic's messages (default: None)
+
+        Returns:
+            int: Topic id
+        """
+        if topic in self.topics:
+            return self.topics[topic]
+        topic_id = len(self.topics)
+        self.topics[topic] = topic_id
+        body = json.dumps({"id": topic_id, "topic": topic, "codec": codec}).encode("utf-8")
+        self.file.write(LogFormat.BLOCK.pack(LogFormat.TOPIC, len(body)))
+        self.file.write(body)
+        return topic_id
+
+    def write(self, timestamp, topic_id, frames):
+        """Add a message to the current chunk, writing the chunk out once it reaches chunk_size
+
+        Args:
+            timestamp: Receive time of the message, seconds since the epoch
+            topic_id: Topic id from add_topic()
+            frames: List of frames (bytes, memoryview or zmq.Frame) of the message
+        """
+        chunk = self.chunk
+        chunk += LogFormat.RECORD.pack(timestamp, topic_id, len(frames))
+        for frame in frames:
+            data = frame.buffer if hasattr(frame, "buffer") else frame
+            chunk += LogFormat.FRAME.pack(len(data))
+            chunk += data
+        self.chunk_count += 1
+        stats = self.chunk_topics.get(topic_id)
+        if stats is None:
+            self.chunk_topics[topic_id] = [1, timestamp, timestamp]
+        else:
+            stats[0] += 1
+            stats[2] = timestamp
+        if len(chunk) >= self.chunk_size:
+            self.write_chunk()
+
+    def write_chunk(self):
+        """Write the current chunk to the file, if it holds any messages
+        """
+        if not self.chunk_count:
+            return
+        first = min(stats[1] for stats in self.chunk_topics.values())
+        last = max(stats[2] for stats in self.chunk_topics.values())
+        header = bytearray(LogFormat.CHUNK_HEADER.pack(self.chunk_count, first, last, len(self.chunk_topics)))
+        for (topic_id, (count, topic_first, topic_last)) in self.chunk_topics.items():
+            header += LogFormat.CHUNK_TOPIC.pack(topic_id, count, topic_first, topic_last)
+        self.file.write(LogFormat.BLOCK.pack(LogFormat.CHUNK, len(header) + len(self.chunk)))
+        self.file.write(header)
+        self.file.write(self.chunk)
+        self.messages += self.chunk_count
+        self.chunk = bytearray()
+        self.chunk_count = 0
+        self.chunk_topics = {}
+
+    def flush(self):
+        """Write the current chunk and flush the file to the operating system
+        """
+        self.write_chunk()
+        self.file.flush()
+
+    def close(self):
+        """Write the current chunk and close the file
+        """
+        self.flush()
+        self.file.close()
+
+
+class Chunk:
+    """Index entry of a chunk of a colugo message log
+
+    Attributes:
+        offset: Offset in the file of the first message of the chunk
+        end_offset: Offset in the file just past the last message of the chunk
+        count: Number of messages in the chunk
+        start: Receive time of the first message
+        end: Receive time of the last message
+        topics: Dict of topic id to (message count, first time, last time)
+    """
+
+    def __init__(self, offset, end_offset, count, start, end, topics):
+        """Constructor
+
+        Args:
+            offset: Offset in the file of the first message of the chunk
+            end_offset: Offset in the file just past the last message of the chunk
+            count: Number of messages in the chunk
+            start: Receive time of the first message
+            end: Receive time of the last message
+            topics: Dict of topic id to (message count, first time, last time)
+        """
+        self.offset = offset
+        self.end_offset = end_offset
+        self.count = count
+        self.start = start
+        self.end = end
+        self.topics = topics
+
+
+class LogReader:
+    """Reads a colugo message log file (see colugo.py.LogFormat) through a read only memory map
+
+    Opening a log only reads the block headers, to build an index of the topics and chunks, so it takes the
+    same time no matter how many messages the chunks hold. Reading then seeks straight to the chunks that
+    overlap the requested time range and hold the requested topics, and messages are returned as
+    memoryviews of the mapped file, so nothing is copied until the application needs it.
+
+    Attributes:
+        path: Path of the log file
+        file: File object of the log
+        map: mmap.mmap of the log, or None for an empty log
+        topics: Dict of topic id to topic string
+        topic_ids: Dict of topic string to topic id
+        codecs: Dict of topic string to codec name (or None)
+        chunks: List of colugo.py.Chunk in file order
+        chunk_ends: List of the last receive time of each chunk, for seeking by time
+    """
+
+    def __init__(self, path):
+        """Constructor, maps the file and indexes its blocks
+
+        Args:
+            path: Path of the log file
+
+        Raises:
+            ValueError: If the file isn't a colugo message log
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = None
+        self.topics = {}
+        self.topic_ids = {}
+        self.codecs = {}
+        self.chunks = []
+        self.chunk_ends = []
+        size = self.file.seek(0, 2)
+        if size < len(LogFormat.MAGIC):
+            self.file.close()
+            raise ValueError("{} is not a colugo message log".format(path))
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(LogFormat.MAGIC)] != LogFormat.MAGIC:
+            self.close()
+            raise ValueError("{} is not a colugo message log".format(path))
+        self.index()
+
+    def index(self):
+        """Walk the block headers of the file, building the topic and chunk indexes
+        """
+        offset = len(LogFormat.MAGIC)
+        size = len(self.map)
+        while offset + LogFormat.BLOCK.size <= size:
+            (block, length) = LogFormat.BLOCK.unpack_from(self.map, offset)
+            body = offset + LogFormat.BLOCK.size
+            if body + length > size:
+                # the writer stopped part way through this block
+                break
+            if block == LogFormat.TOPIC:
+                info = json.loads(self.map[body:body + length].decode("utf-8"))
+                self.topics[info["id"]] = info["topic"]
+                self.topic_ids[info["topic"]] = info["id"]
+                self.codecs[info["topic"]] = info.get("codec")
+            elif block == LogFormat.CHUNK:
+                (count, start, end, topic_count) = LogFormat.CHUNK_HEADER.unpack_from(self.map, body)
+                position = body + LogFormat.CHUNK_HEADER.size
+                topics = {}
+                for _ in range(topic_count):
+                    (topic_id, topic_messages, first, last) = LogFormat.CHUNK_TOPIC.unpack_from(self.map, position)
+                    topics[topic_id] = (topic_messages, first, last)
+                    position += LogFormat.CHUNK_TOPIC.size
+                self.chunks.append(Chunk(position, body + length, count, start, end, topics))
+                self.chunk_ends.append(end)
+            offset = body + length
+
+    @property
+    def start_time(self):
+        """Receive time of the first message in the log, or None if it is empty
+        """
+        return self.chunks[0].start if self.chunks else None
+
+    @property
+    def end_time(self):
+        """Receive time of the last message in the log, or None if it is empty
+        """
+        return self.chunks[-1].end if self.chunks else None
+
+    def count(self, topic=None):
+        """Count the messages in the log, from the chunk index
+
+        Args:
+            topic: Only count the messages of this topic (default: None, all topics)
+
+        Returns:
+            int: Number of messages
+        """
+        if topic is None:
+            return sum(chunk.count for chunk in self.chunks)
+        topic_id = self.topic_ids.get(topic)
+        return sum(chunk.topics[topic_id][0] for chunk in self.chunks if topic_id in chunk.topics)
+
+    def read(self, topics=None, start=None, end=None):
+        """Iterate over the messages of the log, in the order they were recorded
+
+        Args:
+            topics: Iterable of topic strings to read (default: None, all topics)
+            start: Skip messages received before this time, seconds since the epoch (default: None)
+            end: Stop at messages received after this time, seconds since the epoch (default: None)
+
+        Yields:
+            (float, String, List): Receive time, topic and list of frames (memoryviews of the mapped file) of
+            each message
+        """
+        ids = None
+        if topics is not None:
+            ids = set(self.topic_ids[topic] for topic in topics if topic in self.topic_ids)
+            if not ids:
+                return
+        first = 0 if start is None else bisect.bisect_left(self.chunk_ends, start)
+        view = memoryview(self.map)
+        try:
+            for chunk in self.chunks[first:]:
+                if end is not None and chunk.start > end:
+                    return
+                if ids is not None and ids.isdisjoint(chunk.topics):
+                    continue
+                for record in self.read_chunk(view, chunk):
+                    (timestamp, topic_id, _) = record
+                    if start is not None and timestamp < start:
+                        continue
+                    if end is not None and timestamp > end:
+                        return
+                    if ids is None or topic_id in ids:
+                        yield (timestamp, self.topics[topic_id], record[2])
+        finally:
+            view.release()
+
+    def read_chunk(self, view, chunk):
+        """Helper to iterate over the messages of a chunk
+
+        Args:
+            view: memoryview of the mapped file
+            chunk: colugo.py.Chunk to read
+
+        Yields:
+            (float, int, List): Receive time, topic id and list of frames of each message
+        """
+        offset = chunk.offset
+        while offset < chunk.end_offset:
+            (timestamp, topic_id, frame_count) = LogFormat.RECORD.unpack_from(view, offset)
+            offset += LogFormat.RECORD.size
+            frames = []
+            for _ in range(frame_count):
+                (length,) = LogFormat.FRAME.unpack_from(view, offset)
+                offset += LogFormat.FRAME.size
+                frames.append(view[offset:offset + length])
+                offset += length
+            yield (timestamp, topic_id, frames)
+
+    def close(self):
+        """Unmap and close the file
+
+        Frames returned by read() must no longer be in use.
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
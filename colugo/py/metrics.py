@@ -0,0 +1,153 @@
+class Histogram:
+    """Histogram of durations with power of two buckets
+
+    Durations are recorded in microseconds into buckets whose upper bounds are powers of two (1us,
+    2us, 4us, ... ~36min), so recording a value is a couple of integer operations and the memory used
+    is fixed. Percentiles are reported as the upper bound of the bucket they fall in.
+
+    Attributes:
+        buckets: List of counts, bucket i holds durations of less than 2^i microseconds
+        count: Number of durations recorded
+        total: Sum of the durations recorded, in seconds
+        max: Largest duration recorded, in seconds
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        """Constructor
+        """
+        self.buckets = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Add a duration to the histogram
+
+        Args:
+            seconds: Duration in seconds
+        """
+        self.buckets[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Approximate a percentile of the recorded durations
+
+        Args:
+            p: Percentile, 0-100
+
+        Returns:
+            float|None: Upper bound in seconds of the bucket containing the percentile, or None if
+            nothing has been recorded
+        """
+        if not self.count:
+            return None
+        target = p / 100.0 * self.count
+        seen = 0
+        for (i, n) in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        """Summarize the histogram
+
+        Returns:
+            Dict: count, mean, p50, p90, p99 and max, with durations in seconds
+        """
+        return {"count": self.count, "mean": self.total / self.count if self.count else None,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99),
+                "max": self.max if self.count else None}
+
+
+class SocketMetrics:
+    """Counters for the activity of a single colugo.py.Socket
+
+    Sockets only update their metrics when they have a SocketMetrics object attached (see
+    colugo.py.Node), otherwise instrumentation costs a single attribute check per message.
+
+    Attributes:
+        messages_in: Number of messages received
+        messages_out: Number of messages sent
+        bytes_in: Number of bytes received, over all frames
+        bytes_out: Number of bytes sent, over all frames
+        drops: Number of messages that could not be queued by zmq, or that a subscriber held for too long
+        timeouts: Number of requests that timed out waiting for a reply
+        cycles: Number of times the socket was closed and re-created
+        connects: Number of connections made
+        reconnects: Number of connections made to an endpoint the socket was connected to before
+        endpoints: Set of (address, port) the socket has been connected to
+        gaps: Number of gaps in the sequence numbers of received messages (see colugo.py.SequenceTracker)
+        lost: Number of messages missing from those gaps
+        duplicates: Number of duplicate messages dropped
+        restarts: Number of publisher restarts detected
+        conflated: Number of messages skipped because a newer message with the same key arrived first
+        callback_time: colugo.py.Histogram of the time spent handling each received message
+    """
+
+    def __init__(self):
+        """Constructor
+        """
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.drops = 0
+        self.timeouts = 0
+        self.cycles = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.endpoints = set()
+        self.gaps = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.restarts = 0
+        self.conflated = 0
+        self.callback_time = Histogram()
+
+    def sent(self, frames):
+        """Count a message that was sent
+
+        Args:
+            frames: List of frames (bytes) of the message
+        """
+        self.messages_out += 1
+        self.bytes_out += sum(len(f) for f in frames)
+
+    def received(self, frames):
+        """Count a message that was received
+
+        Args:
+            frames: List of frames (bytes or zmq.Frame) of the message
+        """
+        self.messages_in += 1
+        self.bytes_in += sum(len(f) for f in frames)
+
+    def connected(self, address, port):
+        """Count a connection, and whether it is a reconnection
+
+        Args:
+            address: Address string of the server
+            port: Port of the server
+        """
+        self.connects += 1
+        if (address, port) in self.endpoints:
+            self.reconnects += 1
+        self.endpoints.add((address, port))
+
+    def to_dict(self):
+        """Snapshot of the counters
+
+        Returns:
+            Dict: Counter name to value, with callback_time summarized by colugo.py.Histogram.to_dict()
+        """
+        return {"messages_in": self.messages_in, "messages_out": self.messages_out, "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out, "drops": self.drops, "timeouts": self.timeouts,
+                "cycles": self.cycles, "connects": self.connects, "reconnects": self.reconnects,
+                "gaps": self.gaps, "lost": self.lost, "duplicates": self.duplicates, "restarts": self.restarts,
+                "conflated": self.conflated, "callback_time": self.callback_time.to_dict()}
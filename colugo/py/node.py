@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import functools
+import json
 import logging
 import os
 import sys
@@ -12,12 +13,20 @@ import uuid
 import zmq
 from zmq.eventloop.zmqstream import ZMQStream
 
+from colugo.py.client_pool import ClientPool
+from colugo.py.context import Context
 from colugo.py.discovery import Discovery
+from colugo.py.metrics import SocketMetrics
+from colugo.py.player import Player
 from colugo.py.publisher import Publisher
+from colugo.py.recorder import Recorder
 from colugo.py.subscriber import Subscriber
+from colugo.py.timer_wheel import TimerWheel
 from colugo.py.request_client import RequestClient
 from colugo.py.reply_server import ReplyServer
 from colugo.py.repeater import Repeater
+from colugo.py.service import HOST_ID
+from colugo.py.trace import Tracer
 
 logging.basicConfig(
     format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
@@ -31,21 +40,73 @@ class Node:
         logger: Logger instance, specific to activities within the node
         loop: Tornado event loop, socket send/receive, timers operate on this
         uuid: Globally (nearly) unique identifier of the node
-        discovery: Contains zeroconf threads and the topic/socket directories
+        discovery: Contains the discovery backend and the topic/socket directories
+        context: colugo.py.Context shared by all sockets of the node
+        local_transports: If True, servers also bind inproc:// and ipc:// endpoints
+        local_dispatch: If True, subscribers are attached directly to publishers in the same node
+        sockets: List of the open sockets created by the node, sockets are removed when they are closed
+        collect_metrics: If True, every socket is instrumented with a colugo.py.SocketMetrics
+        tracer: colugo.py.Tracer shared by every socket, or None if tracing is disabled
+        recorders: List of colugo.py.Recorder objects attached with add_recorder()
+        players: List of colugo.py.Player objects attached with add_player()
+        timers: Dict of the colugo.py.PeriodicTimer objects shared by the node's repeaters, by period and policy
+        wheel: colugo.py.TimerWheel for request timeouts and delayed callbacks, or None to use the event loop
+        client_spares: Number of warm spare sockets kept per request client topic
+        pools: Dict of topic to the colugo.py.ClientPool shared by the node's request clients of that topic
     """
 
-    def __init__(self, name):
+    def __init__(self, name, io_threads=1, max_sockets=None, socket_options=None, snapshot_path=None,
+                 snapshot_ttl=30.0, discovery_backend=None, local_transports=True,
+                 local_dispatch=False, metrics=False, trace=False, timer_tick_ms=None, client_spares=0):
         """Constructor for the node class
 
         Args:
             name: Name of the node, used for the logger name
+            io_threads: Number of zmq background I/O threads, increase for high throughput (default: 1)
+            max_sockets: Maximum number of zmq sockets the node may open (default: None, zmq default)
+            socket_options: Dict of zmq socket option to value applied to every socket the node creates,
+                            eg, {zmq.LINGER: 0} (default: None)
+            snapshot_path: File used to persist discovered services, so that clients can connect to them
+                           immediately the next time the node starts (default: None)
+            snapshot_ttl: Seconds that services loaded from the snapshot are trusted before being
+                          confirmed by service discovery (default: 30.0)
+            discovery_backend: colugo.py.DiscoveryBackend used to announce and find services
+                               (default: None, zeroconf)
+            local_transports: Bind servers to inproc:// and ipc:// endpoints as well as tcp://, so clients in the
+                              same process or on the same host can skip the TCP stack (default: True)
+            local_dispatch: Hand message objects from publishers directly to subscribers in this node, without
+                            serializing them or going through zmq (default: False)
+            metrics: Count messages, bytes, drops, timeouts and callback durations for every socket, see
+                     metrics() (default: False)
+            trace: Stamp messages sent by publishers and request clients with trace metadata, and record
+                   per-topic latency histograms of traced messages received, see colugo.py.Tracer
+                   (default: False)
+            timer_tick_ms: Schedule request timeouts and delayed callbacks on a colugo.py.TimerWheel with ticks
+                           of this many milliseconds, where they fire up to one tick late (default: None, schedule
+                           each one on the event loop)
+            client_spares: Number of spare sockets kept connected for each request client topic, swapped in
+                           when a request times out, see colugo.py.ClientPool (default: 0, no pools)
         """
         self.name = name
         self.logger = logging.getLogger(self.name)
         self.logger.info("Node {} is initializing".format(self.name))
         self.loop = ioloop.IOLoop.current()
         self.uuid = str(uuid.uuid1())
-        self.discovery = Discovery(self.uuid, self.add_service_handler, self.remove_service_handler)
+        self.local_transports = local_transports
+        self.local_dispatch = local_dispatch
+        self.sockets = []
+        self.collect_metrics = metrics
+        self.tracer = Tracer(self.uuid) if trace else None
+        self.recorders = []
+        self.players = []
+        self.timers = {}
+        self.wheel = TimerWheel(self.loop, timer_tick_ms) if timer_tick_ms else None
+        self.client_spares = client_spares
+        self.pools = {}
+        self.context = Context(io_threads, max_sockets, socket_options)
+        self.discovery = Discovery(self.uuid, self.add_service_handler, self.remove_service_handler, loop=self.loop,
+                                   backend=discovery_backend, snapshot_path=snapshot_path,
+                                   snapshot_ttl=snapshot_ttl)
         # exit conditions
         signal.signal(signal.SIGINT, lambda sig, frame: self.loop.add_callback_from_signal(self.stop))
 
@@ -59,34 +120,165 @@ class Node:
         """ Stop the event loop and close all open sockets
         """
         self.logger.info("Node {} is stopping".format(self.name))
+        for recorder in self.recorders:
+            recorder.close()
+        self.recorders = []
+        for player in self.players:
+            player.close()
+        self.players = []
+        for pool in self.pools.values():
+            pool.close()
+        self.pools = {}
         self.discovery.stop()
         self.loop.stop()
 
-    def add_repeater(self, delay_ms, callback):
+    def add_repeater(self, delay_ms, callback, policy=Repeater.SKIP):
         """Helper function to add a repeater to the node using the node's event loop
             Use functools.partial(callback, arg1, arg2, etc.) to pass arguemnts to callback
 
+        Repeaters of the node with the same period and policy share a single event loop timer.
+
         Args:
             delay_ms: Number of milliseconds between callback executions
             callback: Function to execute on repeat
+            policy: What to do with runs missed while the event loop was busy, Repeater.SKIP or
+                    Repeater.CATCH_UP (default: Repeater.SKIP)
 
         Returns:
             colugo.py.repeater object that the application layer can manipulate
         """
         self.logger.info("Adding repeater to node {} with rate {}ms".format(self.name, delay_ms))
-        rep = Repeater(self.loop, delay_ms, callback)
+        rep = Repeater(self.loop, delay_ms, callback, policy=policy, timers=self.timers)
         return rep
 
+    def add_recorder(self, path, topics, chunk_size=1 << 20, chunk_ms=1000):
+        """Helper function to record the messages of some topics to a log file, see colugo.py.Recorder
+
+        The recorder is closed when the node stops, or can be closed earlier with Recorder.close().
+
+        Args:
+            path: Path of the log file, truncated if it exists
+            topics: Iterable of topic strings to record
+            chunk_size: Number of bytes of messages per chunk of the log (default: 1MB)
+            chunk_ms: Maximum number of milliseconds a message waits before its chunk is written (default: 1000)
+
+        Returns:
+            colugo.py.Recorder object
+        """
+        self.logger.info("Recording {} to {}".format(", ".join(topics), path))
+        recorder = Recorder(self, path, topics, chunk_size=chunk_size, chunk_ms=chunk_ms)
+        self.recorders.append(recorder)
+        return recorder
+
+    def add_player(self, path, topics=None, speed=1.0, start=None, end=None, on_finish=None, codecs=None):
+        """Helper function to replay a log recorded with add_recorder() through publishers on this node, see
+        colugo.py.Player
+
+        Call Player.start() to begin playback, once subscribers have had time to connect.
+
+        Args:
+            path: Path of the log file
+            topics: Iterable of topic strings to play back (default: None, every topic in the log)
+            speed: Playback speed multiple, 1.0 for real time (default: 1.0), or None for as fast as possible
+            start: Time in the log to start from, seconds since the epoch (default: None, start of the log)
+            end: Time in the log to stop at, seconds since the epoch (default: None, end of the log)
+            on_finish: Callback executed when the end of playback is reached (default: None)
+            codecs: Dict of topic to colugo.py.Codec, for recorded codecs that can't be created from their
+                    name alone (default: None)
+
+        Returns:
+            colugo.py.Player object
+        """
+        self.logger.info("Adding player of {} to node {}".format(path, self.name))
+        player = Player(self, path, topics=topics, speed=speed, start=start, end=end, on_finish=on_finish,
+                        codecs=codecs)
+        self.players.append(player)
+        return player
+
+    def add_metrics_exporter(self, delay_ms, exporter=None):
+        """Helper function to periodically export the metrics of every socket
+
+        Args:
+            delay_ms: Number of milliseconds between exports
+            exporter: Function called with the result of metrics() (default: None, log as json at INFO)
+
+        Returns:
+            colugo.py.repeater object that the application layer can manipulate
+        """
+        if not self.collect_metrics:
+            self.logger.warn("Metrics are not enabled for node {}, create it with metrics=True".format(self.name))
+        if exporter is None:
+            exporter = lambda metrics: self.logger.info("Metrics: {}".format(json.dumps(metrics)))
+        return self.add_repeater(delay_ms, lambda: exporter(self.metrics()))
+
+    def metrics(self):
+        """Snapshot of the metrics of every socket created by the node
+
+        Returns:
+            List: Dict per instrumented socket, with its topic, socket class, bound or connected address and
+            port, and the counters from colugo.py.SocketMetrics.to_dict()
+        """
+        metrics = []
+        for sock in self.sockets:
+            if sock.metrics is not None:
+                entry = {"topic": sock.topic, "socket": type(sock).__name__, "address": sock.address,
+                         "port": sock.port}
+                entry.update(sock.metrics.to_dict())
+                metrics.append(entry)
+        return metrics
+
+    def add_socket(self, sock):
+        """Keep track of a socket created by the node, instrumenting it if metrics or tracing are enabled
+
+        Args:
+            sock: colugo.py.Socket object
+        """
+        if self.collect_metrics:
+            sock.metrics = SocketMetrics()
+        sock.tracer = self.tracer
+        sock.wheel = self.wheel
+        sock.on_close = self.remove_socket
+        self.sockets.append(sock)
+
+    def remove_socket(self, sock):
+        """Forget a socket of the node, called when the socket is closed
+
+        Args:
+            sock: colugo.py.Socket object
+        """
+        if sock in self.sockets:
+            self.sockets.remove(sock)
+
     def add_delayed_callback(self, delay_ms, callback):
         """Helper function to execute a callback function at a time in the future
 
+        With timer_tick_ms set on the node, callbacks are scheduled on the node's timer wheel, so they fire up
+        to timer_tick_ms late.
+
         Args:
             delay_ms: Number of milliseconds in the future when you want the callback to fire
             callback: Function to execute
+
+        Returns:
+            Handle that can be passed to remove_delayed_callback()
         """
-        self.loop.call_later(delay_ms / 1000.0, callback)
+        if self.wheel is not None:
+            return self.wheel.call_later(delay_ms, callback)
+        return self.loop.call_later(delay_ms / 1000.0, callback)
 
-    def add_publisher(self, topic):
+    def remove_delayed_callback(self, handle):
+        """Cancel a callback added with add_delayed_callback(), if it hasn't run yet
+
+        Args:
+            handle: Handle returned by add_delayed_callback()
+        """
+        if self.wheel is not None:
+            self.wheel.remove_timeout(handle)
+        else:
+            self.loop.remove_timeout(handle)
+
+    def add_publisher(self, topic, sndhwm=None, sndbuf=None, batch=False, track_drops=False, codec=None,
+                      sequenced=False):
         """Helper function to add a colugo.py.Publisher object to the node
 
         Each individual Node may only have one publisher per topic, however, multiple Nodes (local or remote)
@@ -97,18 +289,31 @@ class Node:
 
         Args:
             topic: Topic string that identifies the socket on the network
+            sndhwm: Send high-water mark, in messages, per subscriber (default: None, zmq default)
+            sndbuf: Kernel send buffer size in bytes (default: None, OS default)
+            batch: Buffer messages passed to send() and write them once per event loop turn (default: False)
+            track_drops: Count messages dropped at the high-water mark in Publisher.dropped, at the cost of one
+                         slow subscriber stalling all of them, see colugo.py.Publisher (default: False)
+            codec: colugo.py.Codec used to encode messages, eg colugo.py.JSONCodec() (default: None, UTF-8 strings)
+            sequenced: Number every message so subscribers can detect lost messages, see
+                       colugo.py.SequenceTracker (default: False)
 
         Returns:
             colugo.py.Publisher object, call send() to send a message
         """
         # Since the socket binds to a random open port as a server, we need to grab the port after socket creation
-        sock = Publisher(self.loop, topic)
+        sock = Publisher(self.loop, topic, sndhwm=sndhwm, sndbuf=sndbuf, batch=batch, track_drops=track_drops,
+                         ctx=self.context, codec=codec, sequenced=sequenced, node_uuid=self.uuid)
+        self.add_socket(sock)
         # bind immediately so we can publish the correct address and port in the zeroconf broadcast
-        sock.bind()
-        self.discovery.register_server(topic, zmq.PUB, self.uuid, sock, sock.address, sock.port)
+        sock.bind(self.local_transports)
+        service = self.discovery.register_server(topic, sock.protocol, self.uuid, sock, sock.address, sock.port)
+        # connect local subscribers, on the next loop turn so the application has the socket first
+        self.loop.add_callback(self.add_service_handler, service)
         return sock
 
-    def add_subscriber(self, topic, callback, on_connect=None):
+    def add_subscriber(self, topic, callback, on_connect=None, raw=False, codec=None, on_gap=None,
+                       conflate=False, max_rate_hz=None, batch=False, callback_batch=None, batch_size=100):
         """Helper function to add a colugo.py.Subscriber object to the node
 
         Each individual Node may have numerous subscribers using the same topic, and multiple Nodes (local or remote)
@@ -119,17 +324,39 @@ class Node:
 
         Args:
             topic: Topic string that identifies the socket on the network
-            callback: Function handler when messages are received
+            callback: Function handler when messages are received, may be None if only key prefix
+                      callbacks are registered with Subscriber.add_filter()
             on_connect: Callback handler when a connection is made with the publisher socket (default: None)
+            raw: Pass messages to the callback as zero-copy memoryviews instead of decoded strings,
+                 useful for binary payloads such as protobufs (default: False)
+            codec: colugo.py.Codec used to decode messages, publishers with a different codec are not connected
+                   to (default: None, use the codec of the first publisher found)
+            on_gap: Callback handler executed with (node uuid, first missing sequence number, received sequence
+                    number) when messages from a sequenced publisher are lost (default: None)
+            conflate: Only deliver the latest message of each key, for topics that stream state where stale
+                      messages are useless (default: False)
+            max_rate_hz: Maximum number of times per second the callbacks are run, each time with the latest
+                         message of each key (default: None, unlimited)
+            batch: With max_rate_hz, pass the callbacks a list of every message received since they last
+                   ran, up to colugo.py.Subscriber.DRAIN_LIMIT of them, requires max_rate_hz (default: False)
+            callback_batch: Function handler passed the list of messages received in one event loop wakeup,
+                            for high rate topics (default: None)
+            batch_size: Maximum number of messages passed to callback_batch at once (default: 100)
 
         Returns:
             colugo.py.Subscriber object
         """
-        sock = Subscriber(self.loop, topic, callback, on_connect)
+        sock = Subscriber(self.loop, topic, callback, on_connect, raw=raw, ctx=self.context, codec=codec,
+                          on_gap=on_gap, conflate=conflate, max_rate_hz=max_rate_hz, batch=batch,
+                          callback_batch=callback_batch, batch_size=batch_size, timers=self.timers)
+        self.add_socket(sock)
         self.discovery.register_client(topic, zmq.SUB, node_uuid=self.uuid, socket=sock)
+        # connect on the next loop turn, so the application has the socket before on_connect fires
+        self.loop.add_callback(self.connect_known_services, sock)
         return sock
 
-    def add_reply_server(self, topic, callback):
+    def add_reply_server(self, topic, callback, raw=False, concurrent=False, executor=None, max_concurrency=None,
+                         codec=None):
         """Helper function to add a colugo.py.ReplyServer object to the node
 
         Each individual Node may only have one reply server per topic, however, multiple Nodes (local or remote)
@@ -142,19 +369,35 @@ class Node:
 
         TODO(pickledgator): Re-think the round robin pattern when multiple reply servers share the same topic.
 
+        By default, requests are handled one at a time. In concurrent mode, the server uses a zmq.ROUTER
+        socket and many requests may be in flight at once; the callback receives a per-request reply handle
+        and may be a coroutine, or run on an executor (see colugo.py.ReplyServer).
+
         Args:
             topic: Topic string that identifies the socket on the network
             callback: Function handler when a request message is received
+            raw: Pass requests to the callback as zero-copy memoryviews instead of decoded strings
+                 (default: False)
+            concurrent: Allow multiple requests in flight at once (default: False)
+            executor: concurrent.futures.Executor to run callback(message) on, its return value is the reply,
+                      implies concurrent (default: None)
+            max_concurrency: Maximum number of requests in flight before the server stops reading new
+                             requests (default: None, unlimited)
+            codec: colugo.py.Codec used to decode requests and encode replies (default: None, UTF-8 strings)
 
         Returns:
             colugo.py.ReplyServer object
         """
-        sock = ReplyServer(self.loop, topic, callback)
-        sock.bind()
-        self.discovery.register_server(topic, zmq.REP, self.uuid, sock, sock.address, sock.port)
+        sock = ReplyServer(self.loop, topic, callback, raw=raw, concurrent=concurrent, executor=executor,
+                           max_concurrency=max_concurrency, ctx=self.context, codec=codec)
+        self.add_socket(sock)
+        sock.bind(self.local_transports)
+        service = self.discovery.register_server(topic, sock.protocol, self.uuid, sock, sock.address, sock.port)
+        # connect local request clients, on the next loop turn so the application has the socket first
+        self.loop.add_callback(self.add_service_handler, service)
         return sock
 
-    def add_request_client(self, topic, on_connect):
+    def add_request_client(self, topic, on_connect, raw=False, pipelined=False, max_outstanding=None, codec=None):
         """Helper function to add a colugo.py.RequestClient object to the node
 
         Each individual Node may have multiple request clients using the same topic and multiple Nodes 
@@ -169,19 +412,42 @@ class Node:
         where timeout is in milliseconds, and on_timeout is the callback handler when a timeout on the
         reply occurs.
 
+        By default, only one request may be outstanding at a time. In pipelined mode, the client uses a
+        zmq.DEALER socket and any number of requests (up to max_outstanding) may be in flight at once, each
+        with its own callback and timeout.
+
+        With client_spares set on the node, other request clients share a pool of spare sockets per topic
+        (see colugo.py.ClientPool), so a timed out client is reset with a socket that is already connected.
+
         Args:
             topic: Topic string that identifies the socket on the network
             on_connect: Callback handler when a connection is made with the reply server socket
+            raw: Pass replies to the callback as zero-copy memoryviews instead of decoded strings
+                 (default: False)
+            pipelined: Allow multiple outstanding requests, matched to replies by request id (default: False)
+            max_outstanding: Maximum number of outstanding requests in pipelined mode (default: None, unlimited)
+            codec: colugo.py.Codec used to encode requests and decode replies, reply servers with a different codec
+                   are not connected to (default: None, use the codec of the first reply server found)
 
         Returns:
             colugo.py.RequestClient object
         """
-        sock = RequestClient(self.loop, topic, on_connect)
-        self.discovery.register_client(topic, zmq.REQ, node_uuid=self.uuid, socket=sock)
+        pool = None
+        if self.client_spares and not pipelined:
+            if topic not in self.pools:
+                self.pools[topic] = ClientPool(self.loop, self.context, topic, zmq.REQ, self.client_spares)
+            pool = self.pools[topic]
+        sock = RequestClient(self.loop, topic, on_connect, raw=raw, pipelined=pipelined,
+                             max_outstanding=max_outstanding, ctx=self.context, codec=codec, pool=pool)
+        self.add_socket(sock)
+        self.discovery.register_client(topic, sock.protocol, node_uuid=self.uuid, socket=sock)
+        # connect on the next loop turn, so the application has the socket before on_connect fires
+        self.loop.add_callback(self.connect_known_services, sock)
         return sock
 
     def add_service_handler(self, service):
-        """Callback handler for when the discovery thread finds a new service on the network
+        """Callback handler for when the discovery layer finds a new service on the network, runs on the
+        event loop
 
         This callback is used to allow client sockets to automatically connect to new services
         that appear on the network. When a new service is announced, it will iterate through 
@@ -191,17 +457,59 @@ class Node:
         Args:
             service: colugo.py.Service object containing information about the new service
         """
-        for client in self.discovery.clients.services:
-            if service.topic == client.topic and client.socket:
-                client.socket.connect(service.address, service.port)
+        for client in self.discovery.clients.get(service.topic):
+            if client.socket:
+                self.connect_client(client.socket, service)
+
+    def connect_known_services(self, sock):
+        """Connect a newly added client socket to the servers already in the directory for its topic
+
+        This includes local servers and servers loaded from the discovery snapshot, which won't be
+        announced again by the discovery layer.
+
+        Args:
+            sock: colugo.py.Socket client object
+        """
+        for service in self.discovery.servers.get(sock.topic):
+            self.connect_client(sock, service)
+
+    def connect_client(self, sock, service):
+        """Connect a client socket to a service, unless it is already connected to it
+
+        The cheapest transport that can reach the service is used: inproc:// for servers in the same
+        context, ipc:// for servers on the same host and tcp:// otherwise. With local_dispatch enabled,
+        subscribers are attached straight to publishers of this node instead.
+
+        Servers whose advertised codec doesn't match the client's are skipped (see
+        colugo.py.Socket.negotiate_codec).
+
+        Args:
+            sock: colugo.py.Socket client object
+            service: colugo.py.Service object of the server to connect to
+        """
+        if (service.address, service.port) in sock.connections:
+            return
+        if self.tracer is not None and service.host_id == HOST_ID:
+            # processes on the same host share the monotonic clock
+            self.tracer.set_offset(service.node_uuid, 0.0)
+        if not sock.negotiate_codec(service.codec):
+            self.logger.warn("Not connecting \"{}\" to {}, codec {} doesn't match {}".format(
+                sock.topic, service, service.codec, sock.codec.name))
+            return
+        if self.local_dispatch and service.node_uuid == self.uuid and isinstance(sock, Subscriber) \
+                and isinstance(service.socket, Publisher):
+            sock.connect_local(service.socket)
+        else:
+            sock.connect(service.address, service.port, service.best_endpoint(sock.ctx.id))
 
     def remove_service_handler(self, topic):
-        """Callback handler for when the discovery thread identifies that a service has been removed
-        from the network.
+        """Callback handler for when the discovery layer identifies that a service has been removed
+        from the network, runs on the event loop.
 
         It's important to note that since python zeroconf has no way to obtain the full service info
         from the service after it has been removed, the only data we have available for this callback
-        is the topic name (derived from the mdns name that left the network).
+        is the topic name (derived from the mdns name that left the network). Client sockets of the topic
+        are disconnected from every server that is no longer in the directory.
 
         TODO(pickledgator): Look into refactoring zeroconf to provide more than just the mdns name for
         add and remove callbacks within the browser.
@@ -210,9 +518,13 @@ class Node:
             topic: The topic string associated with the service that was removed from the network
 
         """
-        for client in self.discovery.clients.services:
-            if topic == client.topic and client.socket:
-                self.logger.warn("Service {} removed, but still associated with local client".format(topic))
-                # TODO(pickledgator): Figure out why this method fails when discovery finds a disconnect
-                # Does zmq automatically call disconnect for us somehow?
-                # client.socket.disconnect()
+        # the removed service is already gone from the directory, so drop every connection to a server
+        # that isn't in it any more (this also covers services evicted from the snapshot)
+        servers = set((s.address, s.port) for s in self.discovery.servers.get(topic))
+        for client in self.discovery.clients.get(topic):
+            if client.socket:
+                for (address, port) in list(client.socket.connections):
+                    if (address, port) not in servers:
+                        self.logger.debug("Service {} at {}:{} removed, disconnecting client".format(
+                            topic, address, port))
+                        client.socket.disconnect_from(address, port)
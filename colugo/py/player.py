@@ -0,0 +1,200 @@
+import logging
+import time
+
+from colugo.py.codec import Codec, RawCodec
+from colugo.py.message_log import LogReader
+
+
+class Player:
+    """Replays a colugo message log (see colugo.py.LogFormat) through publishers on a node
+
+    One publisher is added to the node for each topic played back, advertising the codec the topic was
+    recorded with. Messages are streamed from the memory-mapped log by colugo.py.LogReader and published
+    with colugo.py.Publisher.send_frames(), without being decoded.
+
+    Playback is scheduled against time.monotonic(): every message is due at the time the playback
+    started plus its offset in the log divided by the speed, so the original spacing of the messages is
+    kept and scheduling delays don't add up over a long log. A speed of 2.0 plays twice as fast as the
+    recording, and a speed of None plays as fast as possible. Messages that are already due are sent in
+    bursts of up to BURST messages, yielding to the event loop in between.
+
+    Messages are written to zmq without blocking, so at high speeds, messages are dropped for subscribers
+    that reach the high-water mark (see colugo.py.Publisher.dropped).
+
+    Attributes:
+        logger: Logger instance for playback activity
+        node: colugo.py.Node the player publishes through
+        reader: colugo.py.LogReader of the log
+        topics: List of topics played back
+        publishers: Dict of topic to colugo.py.Publisher
+        speed: Playback speed multiple, or None for as fast as possible
+        start_time: Time in the log playback starts from, seconds since the epoch
+        end_time: Time in the log playback stops at, seconds since the epoch, or None for the end of the log
+        on_finish: Callback executed when the end of playback is reached, or None
+        running: If playback is in progress
+        messages: Number of messages published
+        position: Log time of the last message published, or None
+        lag: Longest time a message was published after it was due, in seconds
+        iterator: Iterator over the messages of the log still to be played
+        next: The next (time, topic, frames) to be played, read from the iterator ahead of time
+        origin: (monotonic time, log time) the schedule is counted from, or None before the first message
+        timeout: Handle of the scheduled tick(), or None
+    """
+
+    BURST = 1000
+
+    def __init__(self, node, path, topics=None, speed=1.0, start=None, end=None, on_finish=None, codecs=None):
+        """Constructor, opens the log and adds the publishers to the node
+
+        Playback doesn't begin until start() is called, leaving time for subscribers to discover and
+        connect to the new publishers.
+
+        Args:
+            node: colugo.py.Node to publish through
+            path: Path of the log file
+            topics: Iterable of topic strings to play back (default: None, every topic in the log)
+            speed: Playback speed multiple, 1.0 for real time (default: 1.0), or None for as fast as possible
+            start: Time in the log to start from, seconds since the epoch (default: None, start of the log)
+            end: Time in the log to stop at, seconds since the epoch (default: None, end of the log)
+            on_finish: Callback executed when the end of playback is reached (default: None)
+            codecs: Dict of topic to colugo.py.Codec to publish with, for codecs that can't be created from
+                    their name alone, eg colugo.py.ProtobufCodec (default: None)
+
+        Raises:
+            ValueError: If the file isn't a colugo message log
+        """
+        self.logger = logging.getLogger("Player")
+        self.node = node
+        self.reader = LogReader(path)
+        if topics is None:
+            self.topics = sorted(self.reader.topic_ids)
+        else:
+            self.topics = [topic for topic in topics if topic in self.reader.topic_ids]
+        self.speed = speed
+        self.start_time = self.reader.start_time if start is None else start
+        self.end_time = end
+        self.on_finish = on_finish
+        self.running = False
+        self.messages = 0
+        self.position = None
+        self.lag = 0.0
+        self.iterator = None
+        self.next = None
+        self.origin = None
+        self.timeout = None
+        self.publishers = {}
+        for topic in self.topics:
+            self.publishers[topic] = node.add_publisher(topic, codec=self.codec(topic, codecs or {}))
+
+    def codec(self, topic, codecs):
+        """Helper to get the codec to publish a topic with
+
+        Args:
+            topic: Topic string
+            codecs: Dict of topic to colugo.py.Codec given to the constructor
+
+        Returns:
+            colugo.py.Codec|None: Codec, or None for the default codec
+        """
+        if topic in codecs:
+            return codecs[topic]
+        name = self.reader.codecs.get(topic)
+        if name is None:
+            return None
+        codec = Codec.from_name(name)
+        if codec is None:
+            self.logger.warn("Can't create codec {} for {}, publishing it as raw".format(name, topic))
+            return RawCodec()
+        return codec
+
+    def start(self):
+        """Start, or resume, playback
+
+        After pause(), the schedule is counted again from the next message, so time spent paused is
+        skipped rather than caught up.
+        """
+        if self.running:
+            return
+        if self.iterator is None:
+            self.iterator = self.reader.read(self.topics, self.start_time, self.end_time)
+        self.running = True
+        self.origin = None
+        self.timeout = self.node.loop.call_later(0, self.tick)
+
+    def pause(self):
+        """Stop playback, keeping the position so start() resumes from the next message
+        """
+        self.running = False
+        if self.timeout is not None:
+            self.node.loop.remove_timeout(self.timeout)
+            self.timeout = None
+
+    def seek(self, timestamp):
+        """Move playback to a time in the log, using the log's chunk index
+
+        Args:
+            timestamp: Time in the log to continue from, seconds since the epoch
+        """
+        self.release()
+        self.start_time = timestamp
+        self.iterator = self.reader.read(self.topics, timestamp, self.end_time)
+        self.origin = None
+
+    def tick(self):
+        """Publish the messages that are due, then schedule the next tick
+        """
+        self.timeout = None
+        if not self.running:
+            return
+        now = time.monotonic()
+        for _ in range(self.BURST):
+            if self.next is None:
+                self.next = next(self.iterator, None)
+                if self.next is None:
+                    self.finish()
+                    return
+            (timestamp, topic, frames) = self.next
+            if self.origin is None:
+                self.origin = (now, timestamp)
+            if self.speed:
+                due = self.origin[0] + (timestamp - self.origin[1]) / self.speed
+                if due > now:
+                    self.timeout = self.node.loop.call_later(due - now, self.tick)
+                    return
+                self.lag = max(self.lag, now - due)
+            self.publishers[topic].send_frames(frames)
+            self.messages += 1
+            self.position = timestamp
+            self.next = None
+        # burst is over, let the event loop handle everything else before continuing
+        self.timeout = self.node.loop.call_later(0, self.tick)
+
+    def finish(self):
+        """Helper to end playback once the log (or the end time) is reached
+        """
+        self.logger.info("Played {} messages from {}".format(self.messages, self.reader.path))
+        self.running = False
+        self.release()
+        if self.on_finish:
+            self.on_finish()
+
+    def release(self):
+        """Helper to drop the iterator over the log, releasing its views of the mapped file
+        """
+        self.next = None
+        if self.iterator is not None:
+            self.iterator.close()
+            self.iterator = None
+
+    def close(self):
+        """Stop playback, remove the publishers from the node and close the log
+        """
+        self.pause()
+        self.release()
+        for (topic, sock) in self.publishers.items():
+            for service in self.node.discovery.servers.get(topic):
+                if service.socket is sock:
+                    self.node.discovery.unregister_server(service)
+            sock.close()
+        self.publishers = {}
+        self.reader.close()
@@ -1,4 +1,7 @@
+import random
+import uuid
 import zmq
+from colugo.py.sequence import SequenceTracker
 from colugo.py.zsocket import Socket
 
 
@@ -11,33 +14,261 @@ class Publisher(Socket):
     Address and port data are assigned to the specified topic at bind time within the 
     colugo.py.Socket class.
 
+    Messages are encoded with the publisher's codec (see colugo.py.Codec), UTF-8 strings by default.
+    The codec name is advertised by the discovery layer, so subscribers can check that they understand
+    the messages before connecting.
+
     To send a message using the publisher socket after it has been constructed, use the 
-    send() method (inherited from colugo.py.Socket)
+    send() method. Messages may optionally carry a sub-key, which is sent as a separate leading
+    frame so that subscribers can filter on it within libzmq (see colugo.py.Subscriber.add_filter).
+
+    Messages are written straight to the zmq socket without blocking rather than being queued on the
+    ZmqStream, so a message that can't be queued because a subscriber has reached the high-water
+    mark is dropped. In batch mode, send() only buffers the message and the whole burst is written in
+    a single event loop callback (or when flush() is called). send_many() writes an iterable of
+    messages immediately. send_frames() publishes a message that is already encoded, eg one read back
+    from a log by colugo.py.Player.
+
+    Plain zmq.PUB sockets drop silently at the high-water mark, and only for the subscriber that is
+    behind. When track_drops is enabled, the socket is created as zmq.XPUB with zmq.XPUB_NODROP so that
+    those drops are reported and counted in dropped. Note that in this mode, a single subscriber at its
+    high-water mark causes every message to be dropped for all subscribers until it catches up, so one
+    slow consumer stalls the fast ones. Only use it where every subscriber is expected to keep up, eg to
+    size the high-water mark. The subscription messages an XPUB socket receives are read and discarded.
+
+    Subscribers in the same node may be attached to the publisher directly (see
+    colugo.py.Subscriber.connect_local). Each message sent is then also handed, as the original python
+    object, to those subscribers on the next event loop turn, skipping serialization and zmq entirely.
+    Remote subscribers still receive the message over the wire.
+
+    When the publisher has a colugo.py.Tracer, every message is sent as [key, message, trace frame], with
+    an empty key frame for messages without a key. The send time in the trace frame is taken when send()
+    is called, so time spent buffered in batch mode counts towards the latency seen by subscribers.
+    Messages handed to local subscribers are not traced.
+
+    A sequenced publisher sends every message as [key, message, sequence frame] instead, so subscribers
+    can detect lost, duplicate and restarted streams (see colugo.py.SequenceTracker). Traced messages are
+    always sequenced, since the trace frame carries the same fields.
 
     Attributes:
         loop: Reference to the tornado event loop
         topic: The topic associated with the socket on the network
+        batch: If True, send() buffers messages until the next flush()
+        pending: List of buffered messages (lists of frames) waiting for flush()
+        dropped: Number of messages that could not be queued by zmq
+        local_subscribers: List of colugo.py.Subscriber objects in the same node attached directly
+        sequenced: If True, messages carry a sequence frame
+        sequence: Sequence number of the last message sent with a sequence or trace frame
+        epoch: Random number identifying this publisher among the publishers its node creates for the topic
+        origin: uuid of the publisher's node, as 16 bytes
     """
 
-    def __init__(self, loop, topic):
+    def __init__(self, loop, topic, sndhwm=None, sndbuf=None, batch=False, track_drops=False, ctx=None, codec=None,
+                 sequenced=False, node_uuid=None):
         """Constructor for the publisher class
 
         Args:
             loop: Reference to the tornado event loop
             topic: The topic associated with the socket on the network
+            sndhwm: Send high-water mark, in messages, per subscriber (default: None, zmq default)
+            sndbuf: Kernel send buffer size in bytes (default: None, OS default)
+            batch: Buffer messages passed to send() and write them once per event loop turn (default: False)
+            track_drops: Count messages dropped at the high-water mark (default: False)
+            ctx: colugo.py.Context used to create the socket (default: None, process wide default)
+            codec: colugo.py.Codec used to encode messages (default: None, UTF-8 strings)
+            sequenced: Send a sequence frame with every message (default: False)
+            node_uuid: uuid string of the publisher's node, identifies the sequence stream (default: None,
+                       a random uuid)
         """
-        super(Publisher, self).__init__(loop, zmq.PUB)  # Socket.__init__()
+        super(Publisher, self).__init__(loop, zmq.XPUB if track_drops else zmq.PUB, ctx=ctx,
+                                        codec=codec)  # Socket.__init__()
         self.topic = topic
+        self.batch = batch
+        self.pending = []
+        self.dropped = 0
+        self.local_subscribers = []
+        self.sequenced = sequenced
+        self.sequence = 0
+        self.epoch = random.getrandbits(32)
+        self.origin = uuid.UUID(node_uuid).bytes if node_uuid else uuid.uuid4().bytes
+        if track_drops:
+            # report EAGAIN at the high-water mark rather than dropping silently
+            self.zmq_socket.setsockopt(zmq.XPUB_NODROP, 1)
+        self.set_send_buffer(sndhwm, sndbuf)  # Socket.set_send_buffer()
 
-    def bind(self):
+    def bind(self, local_transports=True):
         """Just calls the colugo.py.Socket.bind() but has a helpful print
+
+        Args:
+            local_transports: Also bind the inproc:// and ipc:// endpoints (default: True)
         """
-        (addr, port) = super(Publisher, self).bind()  # Socket.bind()
+        (addr, port) = super(Publisher, self).bind(local_transports)  # Socket.bind()
         self.logger.debug("PUB \"{}\" binding to tcp://{}:{}".format(self.topic, addr, port))
+        if self.protocol == zmq.XPUB:
+            # zmq queues subscription messages on XPUB sockets until they are read
+            self.stream.on_recv(self.subscription_handler)
+
+    def subscription_handler(self, frames):
+        """Discard the subscription messages received by the zmq.XPUB socket in track_drops mode
+
+        Args:
+            frames: List of frames of the subscription message
+        """
+        for frame in frames:
+            if frame:
+                self.logger.debug("PUB \"{}\" {} {}".format(
+                    self.topic, "subscribe" if frame[0] == 1 else "unsubscribe", frame[1:]))
+
+    def send(self, message, key=None):
+        """Publish a message, optionally under a sub-key
+
+        Keyed messages are sent as a two-part message [key, message]. Subscriber sockets match their
+        filters against the key frame.
+
+        Args:
+            message: Message to be sent, encoded with the publisher's codec
+            key: Sub-key for the message (string or bytes) (default: None)
+
+        Returns:
+            Bool: If the message was queued by zmq (or buffered, in batch mode)
+        """
+        if self.local_subscribers:
+            self.send_local(message, key)
+        return self.publish(self.message_frames(self.encode(message), key))  # Socket.encode()
+
+    def send_frames(self, frames):
+        """Publish a message that is already encoded, laid out as it was received by a subscriber
+
+        Any trace or sequence frame is replaced with this publisher's own, so subscribers see a replayed
+        message as part of this publisher's stream rather than as a duplicate from the original publisher.
+        Local subscribers are handed the message decoded with the publisher's codec.
+
+        Args:
+            frames: List of frames (bytes or memoryview): [message], [key, message] or
+                    [key, message, trace or sequence frame]
+
+        Returns:
+            Bool: If the message was queued by zmq (or buffered, in batch mode)
+        """
+        if len(frames) == 1:
+            (key, data) = (None, frames[0])
+        else:
+            # an empty key frame only stands for "no key" when it is followed by a trace or sequence frame
+            key = bytes(frames[0]) if (len(frames) == 2 or len(frames[0])) else None
+            data = frames[1]
+        if self.batch:
+            # the frames may be views of a buffer that is gone by the time the burst is written
+            data = bytes(data)
+        if self.local_subscribers:
+            self.send_local(self.codec.decode(bytes(data)), key)
+        return self.publish(self.message_frames(data, key))
+
+    def publish(self, frames):
+        """Helper to write a message, or buffer it until the next flush() in batch mode
+
+        Args:
+            frames: List of frames of the message, from message_frames()
+
+        Returns:
+            Bool: If the message was queued by zmq (or buffered, in batch mode)
+        """
+        if not self.batch:
+            return self.write(frames)
+        self.pending.append(frames)
+        if len(self.pending) == 1:
+            # first message of the burst, write everything out on the next loop turn
+            self.loop.add_callback(self.flush)
+        return True
+
+    def send_many(self, messages, key=None):
+        """Publish a burst of messages immediately, in order
+
+        Args:
+            messages: Iterable of messages to be sent, encoded with the publisher's codec
+            key: Sub-key applied to every message (string or bytes) (default: None)
+
+        Returns:
+            int: Number of messages queued by zmq
+        """
+        sent = 0
+        for message in messages:
+            if self.local_subscribers:
+                self.send_local(message, key)
+            if self.write(self.message_frames(self.encode(message), key)):  # Socket.encode()
+                sent += 1
+        return sent
+
+    def message_frames(self, data, key=None):
+        """Helper to lay out the frames of an encoded message
+
+        Args:
+            data: Encoded message
+            key: Sub-key for the message (string or bytes) (default: None)
+
+        Returns:
+            List: [message], [key, message], or [key, message, trace or sequence frame]
+        """
+        if self.tracer is not None:
+            self.sequence += 1
+            return [b"" if key is None else key, data, self.tracer.stamp(self.sequence, self.epoch)]
+        if self.sequenced:
+            self.sequence += 1
+            return [b"" if key is None else key, data, SequenceTracker.stamp(self.epoch, self.sequence, self.origin)]
+        return [data] if key is None else [key, data]
+
+    def send_local(self, message, key=None):
+        """Hand a message object to the subscribers attached with colugo.py.Subscriber.connect_local()
+
+        Args:
+            message: Message to be delivered, passed through unchanged
+            key: Sub-key for the message (string or bytes) (default: None)
+        """
+        key = None if key is None else self.pack(key)  # Socket.pack()
+        for subscriber in self.local_subscribers:
+            subscriber.deliver_local(key, message)
+
+    def flush(self):
+        """Write all messages buffered in batch mode
+
+        Returns:
+            int: Number of messages queued by zmq
+        """
+        pending, self.pending = self.pending, []
+        sent = 0
+        for frames in pending:
+            if self.write(frames):
+                sent += 1
+        return sent
+
+    def write(self, frames):
+        """Send a list of frames on the zmq socket without blocking
+
+        Args:
+            frames: List of frames (strings or bytes) that make up the message
+
+        Returns:
+            Bool: If the message was queued by zmq
+        """
+        frames = [self.pack(f) for f in frames]  # Socket.pack()
+        try:
+            self.zmq_socket.send_multipart(frames, zmq.NOBLOCK)
+        except zmq.Again:
+            self.dropped += 1
+            if self.metrics is not None:
+                self.metrics.drops += 1
+            return False
+        if self.metrics is not None:
+            self.metrics.sent(frames)
+        return True
 
     def close(self):
-        """Just calls the colugo.py.Socket.close()
+        """Flushes any buffered messages and calls colugo.py.Socket.close()
         """
-        # TODO(pickledgator): We can problably remove this and just use the base class method
+        if self.pending:
+            self.flush()
+        for subscriber in self.local_subscribers:
+            if self in subscriber.local_publishers:
+                subscriber.local_publishers.remove(self)
+        self.local_subscribers = []
         # Socket.unbind() is handled within the close call
         super(Publisher, self).close()  # Socket.close()
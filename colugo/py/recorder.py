@@ -0,0 +1,205 @@
+import collections
+import threading
+import time
+import zmq
+
+from colugo.py.message_log import LogWriter
+from colugo.py.subscriber import Subscriber
+from colugo.py.trace import Tracer
+
+
+class RecordingSubscriber(Subscriber):
+    """Subscriber that hands the raw frames of every message to a colugo.py.Recorder
+
+    Messages are received without copying and never decoded, so keys, trace and sequence frames are recorded
+    exactly as they were published.
+
+    Attributes:
+        recorder: colugo.py.Recorder the messages are handed to
+    """
+
+    def __init__(self, loop, topic, recorder, ctx=None):
+        """Constructor
+
+        Args:
+            loop: Reference to the tornado event loop
+            topic: The topic to record
+            recorder: colugo.py.Recorder the messages are handed to
+            ctx: colugo.py.Context used to create the socket (default: None, process wide default)
+        """
+        super(RecordingSubscriber, self).__init__(loop, topic, None, raw=True, ctx=ctx)  # Subscriber.__init__()
+        self.recorder = recorder
+        self.set_filter()  # Socket.set_filter()
+
+    def message_handler(self, frames):
+        """Hand the message to the recorder
+
+        Messages are not drained in batches like other subscribers do, so each one is timestamped when it is
+        received rather than when the batch is.
+
+        Args:
+            frames: List of frames received from the socket
+        """
+        self.recorder.record(self.topic, frames)
+
+
+class Recorder:
+    """Records the messages of a set of topics to a colugo message log (see colugo.py.LogFormat)
+
+    The recorder subscribes to each topic through the node, like any other subscriber. Received messages are
+    only timestamped and queued on the event loop; a writer thread takes them off the queue every
+    flush_ms, appends them to the current chunk and writes chunks out as they fill up. Chunks are also
+    written at least every chunk_ms, so a crash loses little data. Use colugo.py.LogReader to read the log.
+
+    Messages are timestamped with the time they were received, or, when the node has a colugo.py.Tracer and
+    the message carries a trace frame, with the time it was sent (corrected by the tracer's clock offset of
+    the sending node), so bursts keep their spacing when the recorder falls behind. Times are taken from the
+    monotonic clock and converted to seconds since the epoch once, when the recorder starts. The writer thread
+    sorts the messages it takes off the queue by time, and never writes a time earlier than the last one, as
+    colugo.py.LogReader expects when seeking.
+
+    The queue is not bounded, so a disk that can't keep up with the topics shows up as memory growth.
+
+    Attributes:
+        node: colugo.py.Node the recorder is attached to
+        path: Path of the log file
+        topics: List of topics recorded
+        subscribers: List of colugo.py.RecordingSubscriber, one per topic
+        writer: colugo.py.LogWriter used by the writer thread
+        queue: collections.deque of (time, topic, list of frames) waiting for the writer thread
+        messages: Number of messages received
+        clock_offset: Seconds since the epoch minus time.monotonic(), when the recorder started
+        codecs: Dict of topic to the codec name advertised by its publishers, looked up on the event loop
+        running: If the writer thread should keep running
+        thread: The writer thread
+    """
+
+    def __init__(self, node, path, topics, chunk_size=1 << 20, chunk_ms=1000, flush_ms=50):
+        """Constructor, creates the log file, subscribes to the topics and starts the writer thread
+
+        Args:
+            node: colugo.py.Node to attach to
+            path: Path of the log file, truncated if it exists
+            topics: Iterable of topic strings to record
+            chunk_size: Number of bytes of messages per chunk (default: 1MB)
+            chunk_ms: Maximum number of milliseconds a message waits before its chunk is written (default: 1000)
+            flush_ms: Number of milliseconds between writer thread wakeups (default: 50)
+        """
+        self.node = node
+        self.path = path
+        self.topics = list(topics)
+        self.chunk_ms = chunk_ms
+        self.flush_ms = flush_ms
+        self.writer = LogWriter(path, chunk_size)
+        self.queue = collections.deque()
+        self.messages = 0
+        self.clock_offset = time.time() - time.monotonic()
+        self.codecs = {}
+        self.running = True
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="colugo-recorder", daemon=True)
+        self.thread.start()
+        self.subscribers = [self.subscribe(topic) for topic in self.topics]
+
+    def subscribe(self, topic):
+        """Helper to add a recording subscriber for a topic to the node
+
+        Args:
+            topic: Topic string to record
+
+        Returns:
+            colugo.py.RecordingSubscriber object
+        """
+        sock = RecordingSubscriber(self.node.loop, topic, self, ctx=self.node.context)
+        self.node.add_socket(sock)
+        self.node.discovery.register_client(topic, zmq.SUB, node_uuid=self.node.uuid, socket=sock)
+        self.node.loop.add_callback(self.node.connect_known_services, sock)
+        return sock
+
+    def record(self, topic, frames):
+        """Timestamp a received message and queue it for the writer thread, runs on the event loop
+
+        Args:
+            topic: Topic of the message
+            frames: List of frames of the message
+        """
+        self.messages += 1
+        if topic not in self.codecs:
+            self.codecs[topic] = self.codec(topic)
+        self.queue.append((self.timestamp(frames), topic, frames))
+
+    def timestamp(self, frames):
+        """Helper to get the log time of a message, see the class description
+
+        Args:
+            frames: List of frames of the message
+
+        Returns:
+            float: Seconds since the epoch
+        """
+        now = time.monotonic()
+        tracer = self.node.tracer
+        if tracer is not None and len(frames) == 3:
+            trace = Tracer.parse(bytes(frames[2]))
+            if trace is not None:
+                (sent, _, _, origin) = trace
+                now = min(now, sent - tracer.offset(origin))
+        return now + self.clock_offset
+
+    def codec(self, topic):
+        """Helper to get the name of the codec advertised by the publishers of a topic
+
+        Args:
+            topic: Topic string
+
+        Returns:
+            String|None: Codec name, or None if unknown
+        """
+        for service in self.node.discovery.servers.get(topic):
+            if service.codec:
+                return service.codec
+        return None
+
+    def run(self):
+        """Writer thread, appends queued messages to the log until close() is called
+        """
+        chunk_started = None
+        last_time = 0.0
+        while True:
+            self.wake.wait(self.flush_ms / 1000.0)
+            running = self.running
+            batch = []
+            while self.queue:
+                batch.append(self.queue.popleft())
+            # send times of traced messages interleave with receive times of the others
+            batch.sort(key=lambda entry: entry[0])
+            for (timestamp, topic, frames) in batch:
+                topic_id = self.writer.topics.get(topic)
+                if topic_id is None:
+                    topic_id = self.writer.add_topic(topic, self.codecs.get(topic))
+                last_time = max(last_time, timestamp)
+                self.writer.write(last_time, topic_id, frames)
+            now = time.monotonic()
+            if not self.writer.chunk_count:
+                chunk_started = None
+            elif chunk_started is None:
+                chunk_started = now
+            elif now - chunk_started >= self.chunk_ms / 1000.0:
+                self.writer.flush()
+                chunk_started = None
+            if not running:
+                break
+        self.writer.close()
+
+    def close(self):
+        """Stop recording, write everything that was received and close the log
+        """
+        for sock in self.subscribers:
+            for service in self.node.discovery.clients.get(sock.topic):
+                if service.socket is sock:
+                    self.node.discovery.unregister_client(service)
+            sock.close()
+        self.subscribers = []
+        self.running = False
+        self.wake.set()
+        self.thread.join()
@@ -1,36 +1,220 @@
-from tornado import ioloop
+import logging
+
+from colugo.py.metrics import Histogram
+
+
+class RepeaterStats:
+    """Timing statistics of a colugo.py.Repeater
+
+    Attributes:
+        runs: Number of times the callback was executed
+        skipped: Number of deadlines missed and not caught up
+        caught_up: Number of extra runs made to catch up with missed deadlines
+        overruns: Number of runs where the callback took longer than the period
+        lateness: colugo.py.Histogram of how long after its deadline each run started
+        callback_time: colugo.py.Histogram of callback execution time
+    """
+
+    def __init__(self):
+        """Constructor
+        """
+        self.runs = 0
+        self.skipped = 0
+        self.caught_up = 0
+        self.overruns = 0
+        self.lateness = Histogram()
+        self.callback_time = Histogram()
+
+    def to_dict(self):
+        """Snapshot of the statistics
+
+        Returns:
+            Dict: Counters, plus summaries of the lateness (jitter) and callback time histograms
+        """
+        return {"runs": self.runs, "skipped": self.skipped, "caught_up": self.caught_up,
+                "overruns": self.overruns, "lateness": self.lateness.to_dict(),
+                "callback_time": self.callback_time.to_dict()}
+
+
+class PeriodicTimer:
+    """Single event loop timer that runs every colugo.py.Repeater attached to it, at the same deadlines
+
+    Deadlines are absolute times on the event loop's monotonic clock (IOLoop.time()), each one period
+    after the last, so time spent in callbacks or waking up late never shifts the following deadlines.
+    When the timer wakes up after one or more whole periods have passed, the missed deadlines are
+    skipped, or run back to back with the CATCH_UP policy (at most CATCH_UP_LIMIT of them, the rest are
+    skipped).
+
+    Attributes:
+        loop: Reference to the tornado event loop
+        period: Number of seconds between deadlines
+        policy: colugo.py.Repeater.SKIP or colugo.py.Repeater.CATCH_UP
+        repeaters: List of the colugo.py.Repeater objects run by the timer
+        deadline: Loop time of the next run, or None when the timer isn't running
+        timeout: Handle of the scheduled run, or None
+    """
+
+    CATCH_UP_LIMIT = 10
+
+    def __init__(self, loop, period_ms, policy):
+        """Constructor
+
+        Args:
+            loop: Reference to the tornado event loop
+            period_ms: Number of milliseconds between deadlines
+            policy: colugo.py.Repeater.SKIP or colugo.py.Repeater.CATCH_UP
+        """
+        self.logger = logging.getLogger("Repeater")
+        self.loop = loop
+        self.period = period_ms / 1000.0
+        self.policy = policy
+        self.repeaters = []
+        self.deadline = None
+        self.timeout = None
+
+    def add(self, repeater):
+        """Attach a repeater, starting the timer if it was idle
+
+        Args:
+            repeater: colugo.py.Repeater object
+        """
+        self.repeaters.append(repeater)
+        if self.deadline is None:
+            self.deadline = self.loop.time() + self.period
+            self.timeout = self.loop.call_at(self.deadline, self.run)
+
+    def remove(self, repeater):
+        """Detach a repeater, stopping the timer once no repeaters are left
+
+        Args:
+            repeater: colugo.py.Repeater object
+
+        Returns:
+            Bool: If the timer is now idle
+        """
+        self.repeaters.remove(repeater)
+        if self.repeaters:
+            return False
+        if self.timeout is not None:
+            self.loop.remove_timeout(self.timeout)
+        self.timeout = None
+        self.deadline = None
+        return True
+
+    def run(self):
+        """Run the attached repeaters for the deadline that has passed, and any missed ones
+        """
+        self.timeout = None
+        deadline = self.deadline
+        missed = int((self.loop.time() - deadline) / self.period)
+        runs = 1
+        skipped = missed
+        if self.policy == Repeater.CATCH_UP:
+            runs += min(missed, self.CATCH_UP_LIMIT)
+            skipped = missed - (runs - 1)
+        for i in range(runs):
+            for repeater in list(self.repeaters):
+                if repeater.timer is self:
+                    repeater.run(deadline + i * self.period, self.period, caught_up=(i > 0))
+        if self.deadline is None:
+            # every repeater was stopped by a callback
+            return
+        for repeater in self.repeaters:
+            repeater.stats.skipped += skipped
+        self.deadline = deadline + (missed + 1) * self.period
+        self.timeout = self.loop.call_at(self.deadline, self.run)
 
 
 class Repeater:
     """Periodic repeater that executes a callback function at a specified interval
 
-    Basically a simple wrapper function for Tornado.ioloop.PeriodicCallback(). Does not
-    account for compiling time drift.
+    Callbacks run at absolute deadlines on the event loop's monotonic clock, one period apart, so they
+    don't drift however long the callbacks take (see colugo.py.PeriodicTimer). If the event loop is
+    blocked for more than a period, the missed runs are skipped (SKIP, the default) or made up straight
+    away (CATCH_UP). Lateness, callback time, overruns and skipped runs are tracked in stats.
+
+    Repeaters given the same timers dict (eg, by colugo.py.Node) share one event loop timer with every
+    other repeater of the same period and policy, so a node with many periodic tasks only pays for
+    one timer per period.
+
+    A repeater keeps running until stop() is called, whether or not the application keeps a reference
+    to it.
 
     Attributes:
-        rep: PeriodicCallback object
+        loop: Reference to the tornado event loop
+        delay_ms: Number of milliseconds between callback executions
+        callback: Callback to execute
+        policy: SKIP or CATCH_UP
+        timers: Dict of (delay_ms, policy) to the shared colugo.py.PeriodicTimer, or None for a private timer
+        timer: colugo.py.PeriodicTimer running the repeater, or None when stopped
+        stats: colugo.py.RepeaterStats of the repeater
     """
-    def __init__(self, loop, delay_ms, callback):
-        """Constructor for the class
+
+    SKIP = "skip"
+    CATCH_UP = "catch_up"
+
+    def __init__(self, loop, delay_ms, callback, policy=SKIP, timers=None):
+        """Constructor for the class, starts the repeater
+
         Args:
             loop: Reference to the tornado event loop
             delay_ms: Number of milliseconds before callback execution
             callback: Callback to execute after delay_ms have elapsed
+            policy: What to do with runs missed while the event loop was busy, SKIP or CATCH_UP
+                    (default: SKIP)
+            timers: Dict shared by repeaters that should share timers (default: None, a private timer)
         """
-        self.rep = ioloop.PeriodicCallback(callback, delay_ms)
+        self.logger = logging.getLogger("Repeater")
+        self.loop = loop
+        self.delay_ms = delay_ms
+        self.callback = callback
+        self.policy = policy
+        self.timers = timers
+        self.timer = None
+        self.stats = RepeaterStats()
         self.start()
 
     def start(self):
-        """Enable the task on the event loop
+        """Enable the task on the event loop, if it isn't already
         """
-        self.rep.start()
+        if self.timer is not None:
+            return
+        key = (self.delay_ms, self.policy)
+        if self.timers is None:
+            self.timer = PeriodicTimer(self.loop, self.delay_ms, self.policy)
+        else:
+            if key not in self.timers:
+                self.timers[key] = PeriodicTimer(self.loop, self.delay_ms, self.policy)
+            self.timer = self.timers[key]
+        self.timer.add(self)
 
     def stop(self):
         """Stop the task on the event loop
         """
-        self.rep.stop()
+        if self.timer is None:
+            return
+        (timer, self.timer) = (self.timer, None)
+        if timer.remove(self) and self.timers is not None and self.timers.get((self.delay_ms, self.policy)) is timer:
+            del self.timers[(self.delay_ms, self.policy)]
 
-    def __del__(self):
-        """Deconstructor
+    def run(self, deadline, period, caught_up=False):
+        """Execute the callback for a deadline, called by the timer
+
+        Args:
+            deadline: Loop time the run was due
+            period: Number of seconds between deadlines
+            caught_up: If this is an extra run for a missed deadline (default: False)
         """
-        self.stop()
+        start = self.loop.time()
+        self.stats.lateness.record(max(start - deadline, 0.0))
+        try:
+            self.callback()
+        except Exception:
+            self.logger.exception("Repeater callback {} failed".format(self.callback))
+        elapsed = self.loop.time() - start
+        self.stats.callback_time.record(elapsed)
+        self.stats.runs += 1
+        if caught_up:
+            self.stats.caught_up += 1
+        if elapsed > period:
+            self.stats.overruns += 1
@@ -1,3 +1,6 @@
+import inspect
+import functools
+from tornado import gen
 import zmq
 from colugo.py.zsocket import Socket
 
@@ -26,29 +29,78 @@ class ReplyServer(Socket):
     messages are received by the REP in a row prior to a reply message being sent back, the original request 
     message will be dropped and only the second reply message will be handled.
 
+    In concurrent mode, the server is backed by a zmq.ROUTER socket instead, and any number of requests
+    may be in flight at once. Each request is passed to the callback with its own colugo.py.Reply handle,
+    which keeps the routing envelope of that request, so replies can be sent in any order. The callback
+    may also be a coroutine, in which case a non-None return value is sent as the reply. If an executor
+    (concurrent.futures.ThreadPoolExecutor or ProcessPoolExecutor) is provided, the callback is called as
+    callback(message) on the executor and its return value is sent as the reply, so it must not touch the
+    event loop (and must be picklable for process pools). When max_concurrency requests are in flight, the
+    server stops reading from the socket until one of them is replied to; further requests queue up in
+    zmq and eventually push back on the request clients.
+
+    When the server has a colugo.py.Tracer, the latency of traced requests is recorded under the server's
+    topic, and replies to them carry an echo frame so request clients can estimate their clock offset
+    to this node.
+
     Attributes:
         topic: The topic associated with the socket on the network
         callback: Handler executed when the socket receives messages from a request client
+        concurrent: If True, the socket is a zmq.ROUTER that allows multiple requests in flight
+        executor: concurrent.futures.Executor used to run the callback in concurrent mode, or None
+        max_concurrency: Maximum number of requests in flight in concurrent mode (None is unlimited)
+        in_flight: Number of requests that have been received but not yet replied to
+        paused: If True, the server has stopped reading requests because max_concurrency was reached
+        request_trace: (trace frame, receive time) of the traced request waiting for a reply, in non
+                       concurrent mode
     """
 
-    def __init__(self, loop, topic, callback):
+    def __init__(self, loop, topic, callback, raw=False, concurrent=False, executor=None, max_concurrency=None, ctx=None,
+                 codec=None):
         """Constructor for reply server socket
         Args:
             loop: Reference to tornado event loop
             topic: The topic associated with the socket on the network
             callback: Handler executed when the socket receives messages from a request client
+            raw: Pass requests to the callback as zero-copy memoryviews instead of decoded
+                 strings (default: False)
+            concurrent: Use a zmq.ROUTER socket that allows multiple requests in flight (default: False)
+            executor: concurrent.futures.Executor to run the callback on, implies concurrent (default: None)
+            max_concurrency: Maximum number of requests in flight in concurrent mode (default: None)
+            ctx: colugo.py.Context used to create the socket (default: None, process wide default)
+            codec: colugo.py.Codec used to decode requests and encode replies (default: None, UTF-8 strings)
         """
-        super(ReplyServer, self).__init__(loop, zmq.REP)  # Socket.__init__()
+        self.concurrent = concurrent or executor is not None
+        super(ReplyServer, self).__init__(loop, zmq.ROUTER if self.concurrent else zmq.REP, raw=raw, ctx=ctx,
+                                          codec=codec)  # Socket.__init__()
         self.callback = callback
         self.topic = topic
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.paused = False
+        self.request_trace = None
 
-    def bind(self):
+    def bind(self, local_transports=True):
         """Calls the socket's bind function and stages the socket to listen
+
+        Args:
+            local_transports: Also bind the inproc:// and ipc:// endpoints (default: True)
         """
-        (addr, port) = super(ReplyServer, self).bind()  # Socket.bind()
+        (addr, port) = super(ReplyServer, self).bind(local_transports)  # Socket.bind()
         self.logger.debug("REP \"{}\" binding to tcp://{}:{}".format(self.topic, addr, port))
         # start listening, and prep the send function to pass back to the application callback
-        self.receive(self.request_handler)  # Socket.receive()
+        self.listen()
+
+    def listen(self):
+        """Setup the receive handler for the socket type
+        """
+        if self.concurrent:
+            self.receive(self.router_handler, multipart=True)  # Socket.receive()
+        elif self.tracer is not None:
+            self.receive(self.traced_request_handler, multipart=True)  # Socket.receive()
+        else:
+            self.receive(self.request_handler)  # Socket.receive()
 
     def request_handler(self, message):
         """Message received helper that provides the application callback with a reference to
@@ -57,12 +109,187 @@ class ReplyServer(Socket):
         Args:
             message: Received message on the socket
         """
-        # Pass the request message and the socket's send function back out to the application
+        # Pass the request message and the socket's reply function back out to the application
         # to process before replying
-        self.callback(message, self.send)
+        self.callback(message, self.reply)
+
+    def traced_request_handler(self, frames):
+        """Message received helper that records the trace frame of a request, if any, before handling it
+
+        Args:
+            frames: List of frames received, [request] or [request, trace frame]
+        """
+        self.request_trace = self.observe(frames, 1)
+        self.request_handler(self.unpack(frames[0]))  # Socket.unpack()
+
+    def observe(self, frames, index):
+        """Helper to record the latency of a traced request
+
+        Args:
+            frames: List of frames received
+            index: Index of the trace frame in frames
+
+        Returns:
+            (bytes, float)|None: Trace frame and receive time, or None if the request isn't traced
+        """
+        if self.tracer is None or len(frames) <= index:
+            return None
+        received = self.tracer.now()
+        frame = self.frame_bytes(frames[index])  # Socket.frame_bytes()
+        if self.tracer.observe(self.topic, frame, received) is None:
+            return None
+        return (frame, received)
+
+    def echo(self, trace):
+        """Helper to build the echo frame for the reply to a traced request
+
+        Args:
+            trace: (trace frame, receive time) of the request, or None
+
+        Returns:
+            List: [echo frame], or an empty list if the request isn't traced
+        """
+        if trace is None or self.tracer is None:
+            return []
+        return [self.tracer.echo(*trace)]
+
+    def reply(self, message):
+        """Encode a reply with the socket's codec and send it back to the request client
+
+        Args:
+            message: Reply message to be sent
+        """
+        if self.tracer is None:
+            self.send(self.encode(message))  # Socket.send()
+            return
+        (trace, self.request_trace) = (self.request_trace, None)
+        self.send([self.encode(message)] + self.echo(trace))  # Socket.send()
+
+    def router_handler(self, frames):
+        """Message received helper for concurrent mode that splits off the routing envelope and
+        dispatches the request to the application callback
+
+        Args:
+            frames: List of frames received, [routing frames..., empty delimiter, request]
+        """
+        delimiter = None
+        for i, frame in enumerate(frames):
+            if len(frame) == 0:
+                delimiter = i
+                break
+        if delimiter is None or delimiter + 1 >= len(frames):
+            self.logger.warn("REP \"{}\" received malformed request with {} frames".format(self.topic, len(frames)))
+            return
+        reply = Reply(self, frames[:delimiter + 1], self.observe(frames, delimiter + 2))
+        message = self.unpack(frames[delimiter + 1])  # Socket.unpack()
+        self.in_flight += 1
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            self.pause()
+        if self.executor:
+            future = self.loop.run_in_executor(self.executor, self.callback, message)
+            self.loop.add_future(future, functools.partial(self.handler_done, reply))
+            return
+        try:
+            result = self.callback(message, reply)
+        except Exception as e:
+            self.logger.error("REP \"{}\" request handler failed: {}".format(self.topic, e))
+            reply.abandon()
+            return
+        if inspect.isawaitable(result):
+            self.loop.add_future(gen.convert_yielded(result), functools.partial(self.handler_done, reply))
+
+    def handler_done(self, reply, future):
+        """Sends the result of a coroutine or executor request handler as the reply
+
+        Args:
+            reply: colugo.py.Reply handle for the request
+            future: Completed future of the request handler
+        """
+        try:
+            result = future.result()
+        except Exception as e:
+            self.logger.error("REP \"{}\" request handler failed: {}".format(self.topic, e))
+            reply.abandon()
+            return
+        if result is not None:
+            reply(result)
+        elif not reply.done:
+            # the handler returned without replying, so nothing will ever be sent for this request
+            reply.abandon()
+
+    def request_done(self):
+        """Releases a concurrency slot once a request is replied to (or abandoned)
+        """
+        self.in_flight -= 1
+        if self.stream and self.paused and (not self.max_concurrency or self.in_flight < self.max_concurrency):
+            self.resume()
+
+    def pause(self):
+        """Stop reading requests from the socket, leaving them queued in zmq
+        """
+        if self.stream and not self.paused:
+            self.stream.stop_on_recv()
+            self.paused = True
+
+    def resume(self):
+        """Start reading requests from the socket again after pause()
+        """
+        self.paused = False
+        self.listen()
 
     def close(self):
         """Just calls the colugo.py.Socket.close()
         """
         # Socket.unbind() is handled within the close call
         super(ReplyServer, self).close()  # Socket.close()
+
+
+class Reply:
+    """Handle for replying to a single request received by a concurrent colugo.py.ReplyServer
+
+    Call the handle with the reply message. Only the first call sends a reply, and replies to requests
+    that were still being handled when the server was closed are dropped.
+
+    Attributes:
+        server: The colugo.py.ReplyServer that received the request
+        envelope: List of routing frames (including the empty delimiter) of the request
+        trace: (trace frame, receive time) of a traced request, or None
+        done: If the request has been replied to or abandoned
+    """
+
+    def __init__(self, server, envelope, trace=None):
+        """Constructor for the reply handle
+
+        Args:
+            server: The colugo.py.ReplyServer that received the request
+            envelope: List of routing frames (including the empty delimiter) of the request
+            trace: (trace frame, receive time) of a traced request (default: None)
+        """
+        self.server = server
+        self.envelope = envelope
+        self.trace = trace
+        self.done = False
+
+    def __call__(self, message):
+        """Send the reply back to the request client
+
+        Args:
+            message: Reply message to be sent, encoded with the server's codec
+        """
+        if self.done:
+            self.server.logger.warn("REP \"{}\" request was already replied to".format(self.server.topic))
+            return
+        self.done = True
+        if self.server.stream is None:
+            # the handler finished after the server was closed, there is no one left to reply to
+            self.server.logger.debug("REP \"{}\" is closed, dropping late reply".format(self.server.topic))
+            return
+        self.server.send(self.envelope + [self.server.encode(message)] + self.server.echo(self.trace))  # Socket.send()
+        self.server.request_done()
+
+    def abandon(self):
+        """Give up on the request without replying, releasing its concurrency slot
+        """
+        if not self.done:
+            self.done = True
+            self.server.request_done()
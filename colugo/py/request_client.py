@@ -1,3 +1,4 @@
+import struct
 import zmq
 from colugo.py.zsocket import Socket
 
@@ -18,9 +19,10 @@ class RequestClient(Socket):
     the request client socket will wait for a reply. Until a reply is received, it is recommended that 
     additional requests are not sent. As an optional (but recommended) parameter, requests can have an
     associated "wait for reply" timeout. If a timeout occurs before a reply is received, the request socket
-    is reset (closed and re-connected) to ensure that should the reply server become available again, 
-    subsequent requests can still be serviced. This works even if the address/port of the reply server
-    change on the network since the new connection will be initiated by the discovery layer.
+    is reset (closed and re-connected to the same servers) to ensure that should the reply server become
+    available again, subsequent requests can still be serviced. This works even if the address/port of the
+    reply server change on the network since the new connection will be initiated by the discovery layer.
+    With a colugo.py.ClientPool, the reset swaps in a spare socket that is already connected instead.
 
     Due to the nature of zmq.REQ sockets, the REP socket can only handle a single request per reply 
     (there is an internal state machine inside the the REQ socket type that prevents it from sending or 
@@ -28,51 +30,184 @@ class RequestClient(Socket):
     messages are received by the REP in a row prior to a reply message being sent back, the original request 
     message will be dropped and only the second reply message will be handled.
 
+    In pipelined mode, the client is backed by a zmq.DEALER socket instead, and any number of requests
+    may be outstanding at once, each with its own callback and timeout. Every request is prefixed with
+    a request id frame ahead of the empty delimiter frame, which reply servers treat as part of the
+    routing envelope and return untouched, so replies are matched back to their request by id. A timeout
+    in pipelined mode only affects its own request; the socket is not reset.
+
+    When the client has a colugo.py.Tracer, a trace frame is sent after each request. Reply servers with a
+    tracer answer with an echo frame, from which the round trip of the request and the clock offset of
+    the server's node are recorded.
+
     Attributes:
         topic: The topic associated with the socket on the network
         callback: Handler executed when the socket receives messages (passed at send() time)
         on_connect: Callback handler when a connection is attempted
+        pipelined: If True, the socket is a zmq.DEALER that allows multiple outstanding requests
+        max_outstanding: Maximum number of outstanding requests in pipelined mode (None is unlimited)
+        pending: Dict of request id to (callback, timeout, timeout_handler) for outstanding requests
+                 in pipelined mode
+        pool: colugo.py.ClientPool of warm spare sockets swapped in on timeouts, or None
     """
 
-    def __init__(self, loop, topic, on_connect=None):
+    def __init__(self, loop, topic, on_connect=None, raw=False, pipelined=False, max_outstanding=None, ctx=None,
+                 codec=None, pool=None):
         """Constructor for request client
 
         Args:
             loop: Reference to the tornado event loop
             topic: The topic associated with the socket on the network
             on_connect: Callback handler when a connection is attempted (default: None)
+            raw: Pass replies to the callback as zero-copy memoryviews instead of decoded
+                 strings (default: False)
+            pipelined: Use a zmq.DEALER socket that allows multiple outstanding requests (default: False)
+            max_outstanding: Maximum number of outstanding requests in pipelined mode (default: None)
+            ctx: colugo.py.Context used to create the socket (default: None, process wide default)
+            codec: colugo.py.Codec used to encode requests and decode replies (default: None, negotiated with
+                   the reply server)
+            pool: colugo.py.ClientPool to take a spare socket from when a request times out, not used in
+                  pipelined mode (default: None)
         """
-        super(RequestClient, self).__init__(loop, zmq.REQ)  # Socket.__init__()
+        super(RequestClient, self).__init__(loop, zmq.DEALER if pipelined else zmq.REQ, raw=raw, ctx=ctx,
+                                            codec=codec)  # Socket.__init__()
         self.callback = None
         self.topic = topic
         self.on_connect = on_connect
+        self.pipelined = pipelined
+        self.max_outstanding = max_outstanding
+        self.pending = {}
+        self.request_count = 0
+        self.pool = None if pipelined else pool
 
-    def connect(self, address, port):
+    def connect(self, address, port, endpoint=None):
         """Connect to socket at a specified address and port
 
         Args:
             address: Decimal separated string (eg, 127.0.0.1) where service is bound
             port: int associated with service port
+            endpoint: Endpoint to connect to instead of tcp://address:port (default: None)
         """
-        self.logger.debug("REQ \"{}\" connecting to tcp://{}:{}".format(self.topic, address, port))
-        super(RequestClient, self).connect(address, port) # Socket.connect()
+        super(RequestClient, self).connect(address, port, endpoint)  # Socket.connect()
+        self.logger.debug("REQ \"{}\" connected to {}".format(self.topic, self.endpoint))
+        if self.pool is not None:
+            self.pool.connect(address, port, self.endpoint)
+        if self.pipelined:
+            # replies for every outstanding request arrive through the same handler
+            self.receive(self.pipelined_reply_handler, multipart=True)  # Socket.receive()
         if self.on_connect:
             self.on_connect()
 
+    def disconnect_from(self, address, port):
+        """Disconnect from a server, and the spares of the pool with it
+
+        Args:
+            address: Decimal separated string (eg, 127.0.0.1) where service is bound
+            port: int associated with service port
+        """
+        super(RequestClient, self).disconnect_from(address, port)  # Socket.disconnect_from()
+        if self.pool is not None:
+            self.pool.disconnect(address, port)
+
     def send(self, message, callback, timeout=2000, timeout_handler=None):
         """Helper function for sending a request message with a reply timeout
 
-        Receive timeouts are reset each time send() is called
+        Receive timeouts are reset each time send() is called, except in pipelined mode where each
+        request has its own timeout.
 
         Args:
             message: The message to be sent
             callback: The application callback handler when a reply is received
             timeout: Number of milliseconds to wait for a reply before calling timeout handler
             timeout_handler: The application callback handler when a timeout occurs
+
+        Returns:
+            bytes|None: In pipelined mode, the request id, or None if too many requests are outstanding
         """
+        if self.pipelined:
+            return self.send_pipelined(message, callback, timeout, timeout_handler)
         self.callback = callback
+        if self.tracer is not None:
+            self.request_count += 1
+            self.receive(self.traced_reply_handler, timeout, timeout_handler, multipart=True)  # Socket.receive()
+            super(RequestClient, self).send([self.encode(message), self.tracer.stamp(self.request_count)])
+            return
         self.receive(self.reply_callback, timeout, timeout_handler)  # Socket.receive()
-        super(RequestClient, self).send(message)  # Socket.send()
+        super(RequestClient, self).send(self.encode(message))  # Socket.send()
+
+    def send_pipelined(self, message, callback, timeout, timeout_handler):
+        """Send a request on the zmq.DEALER socket, tagged with a new request id
+
+        Args:
+            message: The message to be sent
+            callback: The application callback handler when a reply is received
+            timeout: Number of milliseconds to wait for a reply before calling timeout handler
+            timeout_handler: The application callback handler when a timeout occurs
+
+        Returns:
+            bytes|None: The request id, or None if too many requests are outstanding
+        """
+        if self.max_outstanding is not None and len(self.pending) >= self.max_outstanding:
+            self.logger.error("REQ \"{}\" has {} outstanding requests, dropping request".format(
+                self.topic, len(self.pending)))
+            return None
+        self.request_count += 1
+        request_id = struct.pack("!Q", self.request_count)
+        handle = None
+        if timeout:
+            handle = self.call_later(timeout, self.request_timeout, request_id)  # Socket.call_later()
+        self.pending[request_id] = (callback, handle, timeout_handler)
+        # the request id sits ahead of the empty delimiter, so it is returned as part of the envelope
+        frames = [request_id, b"", self.encode(message)]
+        if self.tracer is not None:
+            frames.append(self.tracer.stamp(self.request_count))
+        super(RequestClient, self).send(frames)  # Socket.send()
+        return request_id
+
+    def pipelined_reply_handler(self, frames):
+        """Match a reply received on the zmq.DEALER socket to its outstanding request
+
+        Args:
+            frames: List of frames received, [request id, empty delimiter, reply]
+        """
+        if len(frames) < 3:
+            self.logger.warn("REQ \"{}\" received malformed reply with {} frames".format(self.topic, len(frames)))
+            return
+        request_id = self.frame_bytes(frames[0])  # Socket.frame_bytes()
+        entry = self.pending.pop(request_id, None)
+        if entry is None:
+            # the request already timed out
+            self.logger.debug("REQ \"{}\" dropping late reply".format(self.topic))
+            return
+        (callback, handle, _) = entry
+        if handle:
+            self.remove_timeout(handle)  # Socket.remove_timeout()
+        if self.tracer is not None and len(frames) > 3:
+            self.tracer.observe_reply(self.topic, self.frame_bytes(frames[3]), self.tracer.now())
+        if callback:
+            callback(self.unpack(frames[2]))  # Socket.unpack()
+
+    def request_timeout(self, request_id):
+        """Handles a pipelined request that did not receive a reply in time
+
+        Args:
+            request_id: Id of the request that timed out
+        """
+        entry = self.pending.pop(request_id, None)
+        if self.metrics is not None:
+            self.metrics.timeouts += 1
+        if entry and entry[2]:
+            entry[2]()
+
+    def traced_reply_handler(self, frames):
+        """Records the echo frame of a reply to a traced request before passing the reply on
+
+        Args:
+            frames: List of frames received, [reply, echo frame]
+        """
+        if len(frames) > 1:
+            self.tracer.observe_reply(self.topic, self.frame_bytes(frames[1]), self.tracer.now())
+        self.reply_callback(self.unpack(frames[0]))  # Socket.unpack()
 
     def reply_callback(self, message):
         """Ensures that the reply callback function is valid before passing to the application
@@ -80,12 +215,38 @@ class RequestClient(Socket):
         Args:
             message: The message the was received
         """
-        if self.callback:
-            self.callback(message)
-        # clear the callback since the next request could be a different one
-        self.callback = None
+        # clear the callback since the next request could be a different one, before calling it so that
+        # a request sent from within the callback keeps its own callback
+        (callback, self.callback) = (self.callback, None)
+        if callback:
+            callback(message)
+
+    def cycle_socket(self):
+        """Reset the socket after a reply timeout, swapping in a spare from the pool when one is ready
+
+        Otherwise, calls colugo.py.Socket.cycle_socket().
+        """
+        spare = self.pool.take(self.connections) if self.pool is not None else None
+        if spare is None:
+            super(RequestClient, self).cycle_socket()  # Socket.cycle_socket()
+            return
+        if self.metrics is not None:
+            self.metrics.cycles += 1
+        self.logger.debug("REQ \"{}\" swapping in a spare socket".format(self.topic))
+        (stream, old) = (self.stream, self.zmq_socket)
+        self.stream = None
+        self.zmq_socket = spare
+        self.start_stream()  # Socket.start_stream()
+        if stream is not None:
+            self.pool.recycle(stream)
+        else:
+            old.close()
 
     def close(self):
-        """Calls colugo.py.Socket.close()
+        """Cancels outstanding pipelined requests and calls colugo.py.Socket.close()
         """
+        for (_, handle, _) in self.pending.values():
+            if handle:
+                self.remove_timeout(handle)  # Socket.remove_timeout()
+        self.pending = {}
         super(RequestClient, self).close()
@@ -0,0 +1,122 @@
+import struct
+import uuid
+
+
+class SequenceTracker:
+    """Follows the sequence numbers of the publishers a subscriber receives from, to detect lost messages
+
+    Sequenced publishers (see colugo.py.Publisher) send every message with a metadata frame after the
+    payload, holding the publisher's epoch, the sequence number of the message and the uuid of the
+    publisher's node:
+
+        b"S" | epoch (uint32) | sequence (uint64) | node uuid (16 bytes)
+
+    Traced messages carry the same fields in their trace frame (see colugo.py.Tracer). Sequence numbers
+    start at 1 and increase by one for every message a publisher sends. The epoch is chosen at random when
+    the publisher is created, so a publisher that is re-created by the same node is recognized as a
+    restart rather than a burst of duplicates.
+
+    Each node is a separate stream. For every message, the tracker compares its sequence number to the last
+    one received on the stream:
+        - One more than the last: in order
+        - More than one ahead: a gap, the messages in between were lost (eg, dropped at the high-water mark)
+        - Not ahead: a duplicate (eg, received over two connections to the same publisher), which is not
+          delivered
+        - Different epoch: a restart, and the messages the new publisher sent before this one were lost
+    The first message of a stream is taken as the start of the stream, since messages published before
+    the subscriber connected were never meant for it.
+
+    Attributes:
+        on_gap: Callback handler executed with (node uuid, first missing sequence number, received sequence
+                number) when messages are lost, or None
+        streams: Dict of node uuid to [epoch, last sequence number received]
+        gaps: Number of gaps detected
+        lost: Number of messages lost in gaps
+        duplicates: Number of duplicate messages dropped
+        restarts: Number of publisher restarts detected
+    """
+
+    TAG = b"S"
+    SEQUENCE = struct.Struct("!cIQ16s")
+
+    def __init__(self, on_gap=None):
+        """Constructor
+
+        Args:
+            on_gap: Callback handler for lost messages (default: None)
+        """
+        self.on_gap = on_gap
+        self.streams = {}
+        self.gaps = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.restarts = 0
+
+    @staticmethod
+    def stamp(epoch, sequence, origin):
+        """Build the sequence frame for an outgoing message
+
+        Args:
+            epoch: Epoch of the publisher
+            sequence: Sequence number of the message
+            origin: uuid of the publisher's node, as 16 bytes
+
+        Returns:
+            bytes: Sequence frame
+        """
+        return SequenceTracker.SEQUENCE.pack(SequenceTracker.TAG, epoch, sequence, origin)
+
+    @staticmethod
+    def parse(frame):
+        """Unpack a sequence frame
+
+        Args:
+            frame: bytes of the frame following the message payload
+
+        Returns:
+            (int, int, String)|None: Epoch, sequence number and node uuid of the publisher, or None if the
+            frame isn't a sequence frame
+        """
+        if len(frame) != SequenceTracker.SEQUENCE.size or frame[:1] != SequenceTracker.TAG:
+            return None
+        (_, epoch, sequence, origin) = SequenceTracker.SEQUENCE.unpack(frame)
+        return (epoch, sequence, str(uuid.UUID(bytes=origin)))
+
+    def check(self, epoch, sequence, origin, metrics=None):
+        """Check the sequence number of a received message against its stream
+
+        Args:
+            epoch: Epoch of the publisher
+            sequence: Sequence number of the message
+            origin: uuid of the publisher's node
+            metrics: colugo.py.SocketMetrics of the subscriber to update, or None (default: None)
+
+        Returns:
+            Bool: If the message should be delivered (ie, it isn't a duplicate)
+        """
+        stream = self.streams.get(origin)
+        if stream is None:
+            self.streams[origin] = [epoch, sequence]
+            return True
+        if stream[0] != epoch:
+            self.restarts += 1
+            if metrics is not None:
+                metrics.restarts += 1
+            stream[0] = epoch
+            stream[1] = 0
+        last = stream[1]
+        if sequence <= last:
+            self.duplicates += 1
+            if metrics is not None:
+                metrics.duplicates += 1
+            return False
+        if sequence > last + 1:
+            self.gaps += 1
+            self.lost += sequence - last - 1
+            if metrics is not None:
+                metrics.gaps += 1
+                metrics.lost += sequence - last - 1
+            if self.on_gap:
+                self.on_gap(origin, last + 1, sequence)
+        stream[1] = sequence
+        return True
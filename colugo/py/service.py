@@ -1,10 +1,18 @@
 #!/usr/bin/env python
 
 import socket
+import time
 from zeroconf import ServiceInfo
 import zmq
 
 COLUGO_TYPE_STR = "_colugo._tcp.local."
+# socket types that bind and are announced, including the XPUB sockets of publishers that track drops and
+# the ROUTER sockets of concurrent reply servers
+SERVER_TYPES = (zmq.PUB, zmq.XPUB, zmq.REP, zmq.ROUTER)
+# files holding an identifier of the machine, hostnames aren't unique enough to tell machines apart
+HOST_ID_FILES = ["/etc/machine-id", "/var/lib/dbus/machine-id", "/proc/sys/kernel/random/boot_id"]
+# address to whether it belongs to an interface of this machine, see Service.is_local_address()
+LOCAL_ADDRESSES = {}
 
 
 class Service:
@@ -18,6 +26,12 @@ class Service:
         node_uuid: Unique identifier of the node that contains the service
         mdns_name: Name string of the service as identified by zeroconf (eg., _topicname._uuid._colugo._tcp.local.)
         server: Bool if the socket type is a server or a client TODO(pickledgator): maybe dont need this
+        timestamp: Time (seconds since epoch) when the service was created or last seen on the network
+        host_id: Identifier of the host where the service is located
+        context_id: Identifier of the colugo.py.Context that created the socket, or None
+        ipc_endpoint: ipc:// endpoint the socket is bound to, or None
+        inproc_endpoint: inproc:// endpoint the socket is bound to, or None
+        codec: Name of the colugo.py.Codec used for message payloads, or None if unknown
     """
 
     def __init__(self, topic=None, address=None, port=None, socket_type=None, node_uuid=None, socket=None):
@@ -44,7 +58,81 @@ class Service:
         self.socket_type = socket_type
         self.node_uuid = node_uuid
         self.mdns_name = "_{}._{}.{}".format(self.topic, self.node_uuid, COLUGO_TYPE_STR)
-        self.server = True if (socket_type == zmq.PUB or socket_type == zmq.REP) else False
+        self.server = socket_type in SERVER_TYPES
+        self.timestamp = time.time()
+        self.host_id = HOST_ID
+        self.context_id = None
+        self.ipc_endpoint = None
+        self.inproc_endpoint = None
+        self.codec = None
+
+    def set_local_endpoints(self, sock):
+        """Copy the same host and same process endpoints of a bound socket
+
+        Args:
+            sock: colugo.py.Socket that the service was created for
+        """
+        self.context_id = sock.ctx.id
+        self.ipc_endpoint = sock.ipc_endpoint
+        self.inproc_endpoint = sock.inproc_endpoint
+
+    def best_endpoint(self, context_id):
+        """Choose the cheapest endpoint that a client can reach the service on
+
+        inproc:// is used for clients created by the same context, ipc:// for clients on the same host and
+        tcp:// otherwise. A service is on the same host if it has the same host_id and is bound to an address
+        of one of this machine's interfaces, so machines (or containers) with the same identifier but
+        separate network stacks, and so separate ipc files, still use tcp://.
+
+        Args:
+            context_id: Identifier of the colugo.py.Context of the client socket
+
+        Returns:
+            String: Endpoint to connect to
+        """
+        if self.inproc_endpoint and self.context_id == context_id:
+            return self.inproc_endpoint
+        if self.ipc_endpoint and self.host_id == HOST_ID and Service.is_local_address(self.address):
+            return self.ipc_endpoint
+        return "tcp://{}:{}".format(self.address, self.port)
+
+    @staticmethod
+    def read_host_id():
+        """Identify the machine, from the first of HOST_ID_FILES that can be read
+
+        Returns:
+            String: The machine id, or the hostname if none of the files can be read
+        """
+        for path in HOST_ID_FILES:
+            try:
+                with open(path) as f:
+                    host_id = f.read().strip()
+            except OSError:
+                continue
+            if host_id:
+                return host_id
+        return socket.gethostname()
+
+    @staticmethod
+    def is_local_address(address):
+        """Check if an address belongs to one of this machine's interfaces, by binding a udp socket to it
+
+        Args:
+            address: Decimal separated string (eg, 127.0.0.1)
+
+        Returns:
+            Bool: If the address is local, the result is cached in LOCAL_ADDRESSES
+        """
+        if address not in LOCAL_ADDRESSES:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.bind((address, 0))
+                LOCAL_ADDRESSES[address] = True
+            except (OSError, TypeError):
+                LOCAL_ADDRESSES[address] = False
+            finally:
+                s.close()
+        return LOCAL_ADDRESSES[address]
 
     def get_service_info(self):
         """Generate zeroconf.ServiceInfo object from class data
@@ -57,7 +145,10 @@ class Service:
                            address=socket.inet_aton(self.address),
                            port=self.port,
                            # server='{}.local.'.format(socket.gethostname()),
-                           properties={"topic": self.topic, "socket_type": str(self.socket_type), "node_uuid": self.node_uuid})
+                           properties={"topic": self.topic, "socket_type": str(self.socket_type), "node_uuid": self.node_uuid,
+                                       "host_id": self.host_id, "context_id": self.context_id or "",
+                                       "ipc": self.ipc_endpoint or "", "inproc": self.inproc_endpoint or "",
+                                       "codec": self.codec or ""})
         return info
 
     def fill_from_info(self, info):
@@ -78,6 +169,12 @@ class Service:
                 return zmq.REQ
             elif value == 4:
                 return zmq.REP
+            elif value == 5:
+                return zmq.DEALER
+            elif value == 6:
+                return zmq.ROUTER
+            elif value == 9:
+                return zmq.XPUB
             else:
                 return None
 
@@ -87,13 +184,61 @@ class Service:
         self.node_uuid = info.properties['node_uuid'.encode('utf-8')].decode('utf-8')
         self.topic = info.properties['topic'.encode('utf-8')].decode('utf-8')
         self.mdns_name = info.name
-        self.server = True if (self.socket_type == zmq.PUB or self.socket_type == zmq.REP) else False
+        self.server = self.socket_type in SERVER_TYPES
+        self.timestamp = time.time()
+        # optional properties, not advertised by older nodes
+        def optional(key):
+            value = info.properties.get(key.encode('utf-8'))
+            return value.decode('utf-8') if isinstance(value, bytes) and value else None
+        self.host_id = optional('host_id')
+        self.context_id = optional('context_id')
+        self.ipc_endpoint = optional('ipc')
+        self.inproc_endpoint = optional('inproc')
+        self.codec = optional('codec')
+        return self
+
+    def to_dict(self):
+        """Generate a dict of the class data that can be serialized (eg, to json)
+
+        Returns:
+            Dict: The topic, address, port, socket_type, node_uuid, timestamp, local endpoints and codec of the
+            service
+        """
+        return {"topic": self.topic, "address": self.address, "port": self.port,
+                "socket_type": self.socket_type, "node_uuid": self.node_uuid, "timestamp": self.timestamp,
+                "host_id": self.host_id, "context_id": self.context_id, "ipc": self.ipc_endpoint,
+                "inproc": self.inproc_endpoint, "codec": self.codec}
+
+    def fill_from_dict(self, data):
+        """Generate class data from a dict created by to_dict()
+
+        Args:
+            data: Dict of service data
+
+        Returns:
+            colugo.py.Service: Service object
+        """
+        self.topic = data["topic"]
+        self.address = data["address"]
+        self.port = data["port"]
+        self.socket_type = data["socket_type"]
+        self.node_uuid = data["node_uuid"]
+        self.mdns_name = "_{}._{}.{}".format(self.topic, self.node_uuid, COLUGO_TYPE_STR)
+        self.server = self.socket_type in SERVER_TYPES
+        self.timestamp = data["timestamp"]
+        self.host_id = data.get("host_id")
+        self.context_id = data.get("context_id")
+        self.ipc_endpoint = data.get("ipc")
+        self.inproc_endpoint = data.get("inproc")
+        self.codec = data.get("codec")
         return self
 
     def __eq__(self, s):
         """Custom comparitor for class
 
-        Currently checks to see if the topic, address, port, socket_type and node_uuid are the same
+        Currently checks to see if the topic, address, port, socket_type and node_uuid are the same. Clients
+        have no address, so they are also told apart by their socket, allowing a node to have several clients
+        with the same topic.
 
         Args:
             s: colugo.py.Service object to compare
@@ -103,7 +248,19 @@ class Service:
         """
 
         return (self.topic == s.topic) and (self.address == s.address) and (self.port == s.port) \
-            and (self.socket_type == s.socket_type) and (self.node_uuid == s.node_uuid)
+            and (self.socket_type == s.socket_type) and (self.node_uuid == s.node_uuid) \
+            and (self.address is not None or self.socket is s.socket)
+
+    def __hash__(self):
+        """Hash consistent with the custom comparitor, so services can be used as dict keys
+
+        Services should not be modified while they are stored in a dict or set.
+
+        Returns:
+            int: Hash of the topic, address, port, socket_type and node_uuid (and socket, for clients)
+        """
+        client_socket = id(self.socket) if self.address is None else None
+        return hash((self.topic, self.address, self.port, self.socket_type, self.node_uuid, client_socket))
 
     def __str__(self):
         """String representation of the class
@@ -120,6 +277,12 @@ class Service:
                 return "REQ"
             elif value == 4:
                 return "REP"
+            elif value == 5:
+                return "DEALER"
+            elif value == 6:
+                return "ROUTER"
+            elif value == 9:
+                return "XPUB"
             else:
                 return "?"
         return "Service({}): {}@{} | {}@{}".format(self.topic, self.address, self.port, socket_str(self.socket_type), self.node_uuid)
@@ -131,3 +294,7 @@ class Service:
             String: The serialized string for each element in the list
         """
         return self.__str__()
+
+
+# identifier of this machine, advertised with each service so clients on the same machine can use ipc://
+HOST_ID = Service.read_host_id()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import time
+
+from colugo.py.service import Service
+
+
+class Snapshot:
+    """Local file that persists the discovered server directory between runs
+
+    On startup, a node can connect to the servers recorded in the snapshot straight away, rather than
+    waiting for service discovery to find them again. The file is JSON, and is replaced atomically
+    when saved so that a crash never leaves a partially written snapshot behind.
+
+    Attributes:
+        logger: Logger instance, specific to activities within the service discovery layers
+        path: Path of the snapshot file
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        """Constructor
+
+        Args:
+            path: Path of the snapshot file
+        """
+        self.logger = logging.getLogger("Discovery")
+        self.path = path
+
+    def load(self, max_age=None):
+        """Read the services recorded in the snapshot
+
+        Args:
+            max_age: Services last seen on the network more than this many seconds ago are skipped
+                     (default: None)
+
+        Returns:
+            List: colugo.py.Service objects, empty if the snapshot doesn't exist or can't be read
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            self.logger.debug("Could not read snapshot {}: {}".format(self.path, e))
+            return []
+        if data.get("version") != self.VERSION:
+            self.logger.warn("Ignoring snapshot {} with unknown version".format(self.path))
+            return []
+        now = time.time()
+        services = []
+        for entry in data.get("services", []):
+            service = Service().fill_from_dict(entry)
+            if max_age is not None and now - service.timestamp > max_age:
+                continue
+            services.append(service)
+        return services
+
+    def save(self, services):
+        """Write services to the snapshot, replacing its previous contents
+
+        Args:
+            services: Iterable of colugo.py.Service objects to record
+        """
+        data = {"version": self.VERSION, "services": [s.to_dict() for s in services]}
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            self.logger.warn("Could not write snapshot {}: {}".format(self.path, e))
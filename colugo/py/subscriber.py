@@ -1,4 +1,8 @@
+import collections
 import zmq
+from colugo.py.repeater import Repeater
+from colugo.py.sequence import SequenceTracker
+from colugo.py.trace import Tracer
 from colugo.py.zsocket import Socket
 
 
@@ -10,42 +14,394 @@ class Subscriber(Socket):
 
     Address and port data for connection are resolved via a network discovery mechanism.
 
+    Messages published with a sub-key (see colugo.py.Publisher.send) can be routed to separate
+    callbacks with add_filter(). Each prefix becomes a zmq.SUBSCRIBE filter, so if the subscriber is
+    created without a main callback, messages that don't match any prefix are dropped by libzmq before
+    they reach python.
+
+    A subscriber may also be attached directly to a publisher in the same node with connect_local(). The
+    publisher then hands each message object to dispatch() on the event loop, without serializing it or
+    going through zmq, so the callback receives exactly the object that was passed to Publisher.send().
+
+    Messages from a traced publisher carry a third frame with trace metadata (see colugo.py.Tracer). When
+    the subscriber has a tracer, the latency of each of these messages and the time spent in its callbacks
+    are recorded under the subscriber's topic.
+
+    The sequence numbers of messages from sequenced or traced publishers are checked for gaps, duplicates
+    and publisher restarts by a colugo.py.SequenceTracker. Lost messages are counted in the tracker and the
+    socket's metrics, and reported to the on_gap callback. Duplicates are dropped.
+
+    In conflate mode, only the latest message of each key (messages without a key share one slot) is
+    delivered. Every time the socket becomes readable, all the messages queued on it are received at once
+    and only the newest of each key is decoded and passed to the callbacks, so a slow callback never
+    works through a backlog of stale messages. Messages from local publishers are conflated the same
+    way until the next event loop turn. zmq.CONFLATE is not used, since it doesn't support the multi-part
+    messages used for keys, trace and sequence frames.
+
+    With max_rate_hz, messages are held and delivered by a colugo.py.Repeater at most max_rate_hz times
+    per second, for consumers (eg, user interfaces) that don't need every update. By default, only the
+    latest message of each key is delivered on each tick, as in conflate mode. In batch mode, no messages
+    are skipped: the main callback is passed the list of every message received since the last tick, and
+    filter callbacks are passed (key, list of messages with that key). At most DRAIN_LIMIT messages are held
+    between ticks; beyond that, the oldest are dropped and counted in the socket's metrics.
+
+    A callback_batch handler is passed the messages received in one event loop wakeup as a single list.
+    Every time the socket becomes readable, up to batch_size messages that are already queued are received
+    without blocking and decoded, then handed over in one call, which saves the per-message python
+    overhead at high rates and suits vectorized consumers. The main and filter callbacks, if any, are
+    still passed the messages one at a time. In conflate and rate limited modes, callback_batch is
+    passed the messages of each flush.
+
     Attributes:
         loop: Reference to the tornado event loop
         topic: The topic associated with the socket on the network
         callback: Handler executed when the socket receives messages from a publisher
+        callback_batch: Handler executed with the list of messages received in one wakeup, or None
+        batch_size: Maximum number of messages received in one wakeup for callback_batch
+        filters: Dict of key prefix (bytes) to list of handlers registered with add_filter()
+        local_publishers: List of colugo.py.Publisher objects attached with connect_local()
+        sequences: colugo.py.SequenceTracker following the sequence numbers of received messages
+        conflate: If True, only the latest message of each key is delivered
+        batch: If True, every message held since the last tick is delivered as a list, in rate limited mode
+        repeater: colugo.py.Repeater that delivers the held messages in rate limited mode, or None
+        latest: Dict of key to (frames, message object) of the latest message of each key waiting for flush()
+        pending: collections.deque of (key, frames, message object) of the messages waiting for flush(), in
+                 batch mode
     """
 
-    def __init__(self, loop, topic, callback, on_connect=None):
+    DRAIN_LIMIT = 1000
+
+    def __init__(self, loop, topic, callback, on_connect=None, raw=False, ctx=None, codec=None, on_gap=None,
+                 conflate=False, max_rate_hz=None, batch=False, callback_batch=None, batch_size=100, timers=None):
         """Constructor for the subscriber class
 
         Args:
             topic: The topic associated with the socket on the network
-            callback: Handler executed when the socket receives messages from a publisher
+            callback: Handler executed when the socket receives messages from a publisher, may be None
+                      if only add_filter() callbacks are used
             on_connect: Callback handler when a connection is attempted (default: None)
+            raw: Pass messages to the callback as zero-copy memoryviews instead of decoded
+                 strings (default: False)
+            ctx: colugo.py.Context used to create the socket (default: None, process wide default)
+            codec: colugo.py.Codec used to decode messages, each message is decoded once no matter how
+                   many callbacks it is passed to (default: None, negotiated with the publisher)
+            on_gap: Callback handler executed with (node uuid, first missing sequence number, received sequence
+                    number) when messages from a sequenced publisher are lost (default: None)
+            conflate: Only deliver the latest message of each key (default: False)
+            max_rate_hz: Maximum number of times per second the callbacks are run (default: None, unlimited)
+            batch: With max_rate_hz, pass every message received since the last tick to the callbacks as a
+                   list, rather than only the latest message of each key, requires max_rate_hz (default: False)
+            callback_batch: Handler executed with the list of messages received in one event loop wakeup
+                            (default: None)
+            batch_size: Maximum number of messages passed to callback_batch at once (default: 100)
+            timers: Dict of timers shared by repeaters, for the rate limiting repeater, see colugo.py.Repeater
+                    (default: None, a private timer)
         """
-        super(Subscriber, self).__init__(loop, zmq.SUB)  # Socket.__init__()
+        if batch and not max_rate_hz:
+            raise ValueError("Subscriber \"{}\" batch mode requires max_rate_hz".format(topic))
+        super(Subscriber, self).__init__(loop, zmq.SUB, raw=raw, ctx=ctx, codec=codec)  # Socket.__init__()
         self.topic = topic
         self.callback = callback
+        self.callback_batch = callback_batch
+        self.batch_size = batch_size
         self.on_connect = on_connect
-        self.set_filter() # Socket.set_filter()
+        self.filters = {}
+        self.local_publishers = []
+        self.sequences = SequenceTracker(on_gap)
+        self.conflate = conflate
+        self.batch = batch
+        self.repeater = Repeater(loop, 1000.0 / max_rate_hz, self.flush, timers=timers) if max_rate_hz else None
+        self.latest = {}
+        self.pending = collections.deque()
+        if self.callback or self.callback_batch:
+            self.set_filter() # Socket.set_filter()
+
+    def add_filter(self, prefix, callback):
+        """Register a handler for keyed messages whose key starts with prefix
+
+        The handler is called with (key, message), where key is a string (or bytes with a
+        colugo.py.RawCodec, including raw mode).
 
-    def connect(self, address, port):
+        Args:
+            prefix: Key prefix to match (string or bytes)
+            callback: Handler executed when a matching keyed message is received
+        """
+        prefix = self.pack(prefix)  # Socket.pack()
+        if prefix not in self.filters:
+            self.filters[prefix] = []
+            self.set_filter(prefix)  # Socket.set_filter()
+        self.filters[prefix].append(callback)
+
+    def remove_filter(self, prefix):
+        """Remove all handlers for a prefix and its zmq.SUBSCRIBE filter
+
+        Args:
+            prefix: Key prefix that was passed to add_filter() (string or bytes)
+        """
+        prefix = self.pack(prefix)  # Socket.pack()
+        if self.filters.pop(prefix, None) is not None:
+            super(Subscriber, self).remove_filter(prefix)  # Socket.remove_filter()
+
+    def connect(self, address, port, endpoint=None):
         """Connect to a publisher socket at a specified address and port and setup listening
         task on event loop
 
         Args:
             address: Decimal separated string (eg, 127.0.0.1) where service is bound
             port: int associated with service port
+            endpoint: Endpoint to connect to instead of tcp://address:port (default: None)
         """
-        self.logger.debug("SUB \"{}\" connecting to tcp://{}:{}".format(self.topic, address, port))
-        super(Subscriber, self).connect(address, port)
-        super(Subscriber, self).receive(self.callback)
+        super(Subscriber, self).connect(address, port, endpoint)  # Socket.connect()
+        self.logger.debug("SUB \"{}\" connected to {}".format(self.topic, self.endpoint))
+        if self.conflate or self.repeater:
+            handler = self.buffer_handler
+        elif self.callback_batch:
+            handler = self.batch_handler
+        else:
+            handler = self.message_handler
+        super(Subscriber, self).receive(handler, multipart=True)  # Socket.receive()
         if self.on_connect: 
             self.on_connect()
 
+    def connect_local(self, publisher):
+        """Attach to a publisher in the same node, bypassing serialization and zmq
+
+        Args:
+            publisher: colugo.py.Publisher object owned by the same node
+        """
+        self.logger.debug("SUB \"{}\" attached to local publisher".format(self.topic))
+        self.connections[(publisher.address, publisher.port)] = "local"
+        self.local_publishers.append(publisher)
+        publisher.local_subscribers.append(self)
+        if self.on_connect:
+            self.on_connect()
+
+    def message_handler(self, frames):
+        """Split received frames into key and message and dispatch them
+
+        Args:
+            frames: List of frames received from the socket
+        """
+        (key, deliver) = self.check_frames(frames)
+        if deliver:
+            self.deliver(key, frames)
+
+    def batch_handler(self, frames):
+        """Receive up to batch_size messages queued on the socket and pass them to callback_batch at once
+
+        Args:
+            frames: List of frames of the first message received from the socket
+        """
+        entries = []
+        for message in [frames] + self.drain(self.batch_size - 1):  # Socket.drain()
+            (key, deliver) = self.check_frames(message)
+            if deliver:
+                entries.append((key, self.resolve(message)))
+        if not entries:
+            return
+        start = self.tracer.now() if self.tracer is not None else None
+        self.dispatch_all(entries)
+        if start is not None:
+            self.tracer.record_callback(self.topic, self.tracer.now() - start)
+
+    def buffer_handler(self, frames):
+        """Receive every message queued on the socket and hold them for flush(), in conflate and rate
+        limited modes
+
+        Without a rate limit, the held messages are flushed straight away.
+
+        Args:
+            frames: List of frames of the first message received from the socket
+        """
+        for message in [frames] + self.drain(self.DRAIN_LIMIT):  # Socket.drain()
+            (key, deliver) = self.check_frames(message)
+            if deliver:
+                self.buffer(key, message)
+        if self.repeater is None:
+            self.flush()
+
+    def buffer(self, key, frames, message=None):
+        """Hold a message until the next flush(), replacing the previous message of its key unless batching
+
+        Args:
+            key: Key of the message, or None
+            frames: List of frames received from the socket, or None for a message from a local publisher
+            message: Message object from a local publisher (default: None)
+        """
+        if self.batch:
+            if len(self.pending) >= self.DRAIN_LIMIT:
+                self.pending.popleft()
+                if self.metrics is not None:
+                    self.metrics.drops += 1
+            self.pending.append((key, frames, message))
+            return
+        # re-insert, so keys are delivered in the order of their latest message
+        if self.latest.pop(key, None) is not None and self.metrics is not None:
+            self.metrics.conflated += 1
+        self.latest[key] = (frames, message)
+
+    def flush(self):
+        """Decode and dispatch the messages held by buffer()
+        """
+        if not self.latest and not self.pending:
+            return
+        start = self.tracer.now() if self.tracer is not None else None
+        if self.batch:
+            (pending, self.pending) = (self.pending, collections.deque())
+            self.dispatch_batch([(key, self.resolve(frames, message)) for (key, frames, message) in pending])
+        else:
+            (latest, self.latest) = (self.latest, {})
+            self.dispatch_all([(key, self.resolve(frames, message)) for (key, (frames, message)) in latest.items()])
+        if start is not None:
+            self.tracer.record_callback(self.topic, self.tracer.now() - start)
+
+    def resolve(self, frames, message=None):
+        """Helper to decode a received message, unless it is a message object from a local publisher
+
+        Args:
+            frames: List of frames received from the socket, or None
+            message: Message object from a local publisher (default: None)
+
+        Returns:
+            The message
+        """
+        if frames is None:
+            return message
+        return self.unpack(frames[0] if len(frames) == 1 else frames[1])  # Socket.unpack()
+
+    def check_frames(self, frames):
+        """Helper to get the key of a received message and check its trace or sequence frame, if any
+
+        Args:
+            frames: List of frames received from the socket
+
+        Returns:
+            (bytes|None, Bool): Key of the message (None if it has no key), and if the message should be
+            delivered (ie, it isn't a duplicate)
+        """
+        if len(frames) == 1:
+            return (None, True)
+        key = self.frame_bytes(frames[0])  # Socket.frame_bytes()
+        if len(frames) == 2:
+            return (key, True)
+        # messages with a trace or sequence frame always have a key frame, which is empty if the message
+        # has no key
+        return (key or None, self.check_metadata(self.frame_bytes(frames[2])))  # Socket.frame_bytes()
+
+    def deliver(self, key, frames):
+        """Decode a received message and dispatch it, timing the callbacks when tracing
+
+        Args:
+            key: Key of the message, or None
+            frames: List of frames received from the socket
+        """
+        message = self.resolve(frames)
+        if self.tracer is None:
+            self.dispatch(key, message)
+            return
+        start = self.tracer.now()
+        self.dispatch(key, message)
+        self.tracer.record_callback(self.topic, self.tracer.now() - start)
+
+    def check_metadata(self, frame):
+        """Record the latency and check the sequence number carried by the trace or sequence frame of a message
+
+        Args:
+            frame: bytes of the frame following the message payload
+
+        Returns:
+            Bool: If the message should be delivered (ie, it isn't a duplicate)
+        """
+        if frame[:1] == Tracer.TRACE_TAG:
+            if self.tracer is not None:
+                trace = self.tracer.observe(self.topic, frame, self.tracer.now())
+            else:
+                trace = Tracer.parse(frame)
+            stamp = trace[1:] if trace else None
+        else:
+            stamp = SequenceTracker.parse(frame)
+        if stamp is None:
+            return True
+        return self.sequences.check(*stamp, metrics=self.metrics)
+
+    def deliver_local(self, key, message):
+        """Schedule the dispatch of a message object from a publisher attached with connect_local()
+
+        Args:
+            key: Key of the message (bytes), or None
+            message: The message object
+        """
+        if self.repeater is None:
+            if self.callback_batch and not self.conflate:
+                self.loop.add_callback(self.dispatch_all, [(key, message)])
+                return
+            if not self.conflate:
+                self.loop.add_callback(self.dispatch, key, message)
+                return
+            if not self.latest:
+                self.loop.add_callback(self.flush)
+        self.buffer(key, None, message)
+
+    def dispatch(self, key, message):
+        """Pass a message to the main callback and any filter callbacks matching its key
+
+        Args:
+            key: Key frame of the message (bytes), or None for messages without a key
+            message: The received message
+        """
+        if self.callback:
+            self.callback(message)
+        if key is None or not self.filters:
+            return
+        for prefix, callbacks in self.filters.items():
+            if key.startswith(prefix):
+                k = self.codec.decode_key(key)
+                for callback in callbacks:
+                    callback(k, message)
+
+    def dispatch_all(self, entries):
+        """Pass messages to callback_batch as one list, and to the main and filter callbacks one at a time
+
+        Args:
+            entries: List of (key, message), in the order they were received
+        """
+        if self.callback_batch:
+            self.callback_batch([message for (_, message) in entries])
+        if self.callback or self.filters:
+            for (key, message) in entries:
+                self.dispatch(key, message)
+
+    def dispatch_batch(self, entries):
+        """Pass a batch of messages to the main callback and to the filter callbacks matching their keys
+
+        Args:
+            entries: List of (key, message), in the order they were received
+        """
+        messages = [message for (_, message) in entries]
+        if self.callback_batch:
+            self.callback_batch(messages)
+        if self.callback:
+            self.callback(messages)
+        if not self.filters:
+            return
+        for prefix, callbacks in self.filters.items():
+            matched = {}
+            for (key, message) in entries:
+                if key is not None and key.startswith(prefix):
+                    matched.setdefault(key, []).append(message)
+            for (key, messages) in matched.items():
+                k = self.codec.decode_key(key)
+                for callback in callbacks:
+                    callback(k, messages)
+
     def close(self):
-        """Just calls the colugo.py.Socket.close()
+        """Stops the rate limiting repeater and calls colugo.py.Socket.close()
         """
         self.logger.debug("SUB \"{}\" disconnecting".format(self.topic))
+        if self.repeater is not None:
+            self.repeater.stop()
+        for publisher in self.local_publishers:
+            if self in publisher.local_subscribers:
+                publisher.local_subscribers.remove(self)
+        self.local_publishers = []
         super(Subscriber, self).close()  # Client.close()
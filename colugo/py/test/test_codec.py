@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py import codec
+from colugo.py.codec import Codec, JSONCodec, MsgpackCodec, RawCodec, StringCodec
+from colugo.py.zsocket import Socket
+from tornado import ioloop
+import zmq
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestCodec(unittest.TestCase):
+    def test_string(self):
+        c = StringCodec()
+        self.assertEqual(c.encode("asdf"), b"asdf")
+        self.assertEqual(c.encode(b"\x00\x01"), b"\x00\x01")
+        self.assertEqual(c.decode(memoryview(b"asdf")), "asdf")
+
+    def test_raw(self):
+        c = RawCodec()
+        self.assertTrue(c.zero_copy)
+        data = memoryview(b"\xff\x00")
+        self.assertIs(c.decode(data), data)
+
+    def test_json(self):
+        c = JSONCodec()
+        message = {"id": 0, "value": [1.5, 2.5], "message": "it's"}
+        self.assertEqual(c.decode(c.encode(message)), message)
+
+    @unittest.skipIf(codec.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        c = MsgpackCodec()
+        message = {"id": 0, "data": b"\x00\x01"}
+        self.assertEqual(c.decode(memoryview(c.encode(message))), message)
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            Codec()
+        self.assertEqual(StringCodec().decode_key(memoryview(b"pose")), "pose")
+        self.assertEqual(RawCodec().decode_key(b"\xff"), b"\xff")
+
+    def test_from_name(self):
+        self.assertIsInstance(Codec.from_name("json"), JSONCodec)
+        self.assertIsInstance(Codec.from_name("raw"), RawCodec)
+        self.assertIsNone(Codec.from_name("protobuf/test.TestMessage"))
+
+    def test_negotiate(self):
+        loop = ioloop.IOLoop.current()
+        socket = Socket(loop, zmq.SUB)
+        self.assertTrue(socket.negotiate_codec(None))
+        self.assertIsInstance(socket.codec, StringCodec)
+        self.assertTrue(socket.negotiate_codec("json"))
+        self.assertIsInstance(socket.codec, JSONCodec)
+        # the first server wins
+        self.assertFalse(socket.negotiate_codec("string"))
+        # codecs that need more than a name are received raw
+        socket_proto = Socket(loop, zmq.SUB)
+        self.assertTrue(socket_proto.negotiate_codec("protobuf/test.TestMessage"))
+        self.assertIsInstance(socket_proto.codec, RawCodec)
+        # codecs chosen by the application are never replaced
+        socket_json = Socket(loop, zmq.SUB, codec=JSONCodec())
+        self.assertFalse(socket_json.negotiate_codec("string"))
+        self.assertTrue(socket_json.negotiate_codec("json"))
+        # raw sockets accept anything
+        socket_raw = Socket(loop, zmq.SUB, raw=True)
+        self.assertTrue(socket_raw.negotiate_codec("json"))
+        self.assertIsInstance(socket_raw.codec, RawCodec)
+
+if __name__ == '__main__':
+    unittest.main()
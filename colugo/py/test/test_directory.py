@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py.directory import Directory
+from colugo.py.service import Service
+from zeroconf import ServiceInfo
+import zmq
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestDirectory(unittest.TestCase):
+    def test_service_hash(self):
+        s1 = Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")
+        s2 = Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")
+        s3 = Service("topic", "127.0.0.1", 10002, zmq.PUB, "uuid1")
+        self.assertEqual(s1, s2)
+        self.assertEqual(hash(s1), hash(s2))
+        self.assertNotEqual(s1, s3)
+        self.assertEqual(len({s1, s2, s3}), 2)
+
+    def test_client_hash(self):
+        # clients have no address, so two clients on the same topic are only told apart by their socket
+        (sock1, sock2) = (object(), object())
+        c1 = Service("topic", None, None, zmq.SUB, "uuid1", socket=sock1)
+        c2 = Service("topic", None, None, zmq.SUB, "uuid1", socket=sock2)
+        self.assertNotEqual(c1, c2)
+        self.assertEqual(c1, Service("topic", None, None, zmq.SUB, "uuid1", socket=sock1))
+        self.assertEqual(len({c1, c2}), 2)
+
+    def test_socket_types(self):
+        for socket_type in [zmq.PUB, zmq.XPUB, zmq.REP, zmq.ROUTER, zmq.SUB, zmq.REQ, zmq.DEALER]:
+            info = Service("topic", "127.0.0.1", 10001, socket_type, "uuid1").get_service_info()
+            # properties are bytes when they are received from the network
+            properties = {k.encode("utf-8"): v.encode("utf-8") for (k, v) in info.properties.items()}
+            received = ServiceInfo(info.type, info.name, address=info.address, port=info.port, properties=properties)
+            service = Service().fill_from_info(received)
+            self.assertEqual(service.socket_type, socket_type)
+            self.assertEqual(service.server, socket_type in (zmq.PUB, zmq.XPUB, zmq.REP, zmq.ROUTER))
+            self.assertNotIn("?", str(service))
+
+    def test_best_endpoint(self):
+        s1 = Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")
+        self.assertEqual(s1.best_endpoint("ctx1"), "tcp://127.0.0.1:10001")
+        s1.context_id = "ctx1"
+        s1.ipc_endpoint = "ipc:///tmp/colugo-127.0.0.1-10001.ipc"
+        s1.inproc_endpoint = "inproc://colugo-127.0.0.1-10001"
+        self.assertEqual(s1.best_endpoint("ctx1"), s1.inproc_endpoint)
+        self.assertEqual(s1.best_endpoint("ctx2"), s1.ipc_endpoint)
+        s1.host_id = "other-host"
+        self.assertEqual(s1.best_endpoint("ctx2"), "tcp://127.0.0.1:10001")
+        s2 = Service().fill_from_dict(s1.to_dict())
+        self.assertEqual(s2.best_endpoint("ctx1"), s1.inproc_endpoint)
+        # same machine id, but bound to an address of another machine (eg, a container or a cloned image)
+        s3 = Service("topic", "203.0.113.1", 10001, zmq.PUB, "uuid1")
+        s3.ipc_endpoint = "ipc:///tmp/colugo-203.0.113.1-10001.ipc"
+        self.assertEqual(s3.best_endpoint("ctx2"), "tcp://203.0.113.1:10001")
+
+    def test_add(self):
+        directory = Directory("uuid1")
+        s1 = Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")
+        self.assertTrue(directory.add(s1))
+        self.assertFalse(directory.add(Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")))
+        self.assertTrue(directory.check_existance(Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")))
+        self.assertEqual(directory.services, [s1])
+
+    def test_lookup(self):
+        directory = Directory("uuid1")
+        s1 = Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")
+        s2 = Service("topic", "127.0.0.1", 10002, zmq.PUB, "uuid2")
+        s3 = Service("other", "127.0.0.1", 10003, zmq.PUB, "uuid2")
+        for s in [s1, s2, s3]:
+            directory.add(s)
+        self.assertEqual(directory.get("topic"), [s1, s2])
+        self.assertEqual(directory.get("missing"), [])
+        self.assertEqual(directory.get_by_uuid("topic", "uuid2"), [s2])
+        self.assertEqual(directory.get_by_mdns_name(s3.mdns_name), [s3])
+
+    def test_remove(self):
+        directory = Directory("uuid1")
+        s1 = Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")
+        s2 = Service("topic", "127.0.0.1", 10002, zmq.PUB, "uuid2")
+        directory.add(s1)
+        directory.add(s2)
+        self.assertTrue(directory.remove("topic", "uuid2"))
+        self.assertFalse(directory.remove("topic", "uuid2"))
+        self.assertEqual(directory.get("topic"), [s1])
+        self.assertEqual(directory.get_by_uuid("topic", "uuid2"), [])
+        self.assertTrue(directory.remove_service(s1))
+        self.assertFalse(directory.remove_service(s1))
+        self.assertEqual(directory.services, [])
+        self.assertEqual(directory.topics, {})
+        self.assertEqual(directory.topic_uuids, {})
+        self.assertEqual(directory.mdns_names, {})
+
+if __name__ == '__main__':
+    unittest.main()
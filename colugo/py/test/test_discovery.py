@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from colugo.py.discovery import Discovery
+from colugo.py.discovery_backend import FileBackend, StaticBackend, ZeroconfBackend
+from colugo.py.service import Service, COLUGO_TYPE_STR
+import tempfile
+import threading
+import time
+from tornado import ioloop
+import zmq
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.loop = ioloop.IOLoop.current()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.added = []
+        self.removed = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_static_backend(self):
+        config = [{"topic": "topic", "address": "127.0.0.1", "port": 10001, "socket_type": "PUB"},
+                  {"topic": "rpc", "address": "127.0.0.1", "port": 10002, "socket_type": zmq.REP,
+                   "node_uuid": "uuid2"}]
+        discovery = Discovery("uuid1", self.added.append, self.removed.append, loop=self.loop,
+                              backend=StaticBackend(config))
+        self.loop.call_later(0.1, self.loop.stop)
+        self.loop.start()
+        discovery.stop()
+        self.assertEqual([(s.topic, s.port, s.socket_type) for s in self.added],
+                         [("topic", 10001, zmq.PUB), ("rpc", 10002, zmq.REP)])
+        self.assertEqual(self.added[0].node_uuid, "static")
+        self.assertEqual(self.removed, [])
+
+    def test_file_backend(self):
+        server = Discovery("uuid1", lambda s: None, lambda t: None, loop=self.loop,
+                           backend=FileBackend(self.tmp_dir.name, poll_ms=10))
+        client = Discovery("uuid2", self.added.append, self.removed.append, loop=self.loop,
+                           backend=FileBackend(self.tmp_dir.name, poll_ms=10))
+        service = server.register_server("topic", zmq.PUB, "uuid1", None, "127.0.0.1", 10001)
+
+        def unregister():
+            self.assertEqual(self.added, [service])
+            server.unregister_server(service)
+
+        self.loop.call_later(0.1, unregister)
+        self.loop.call_later(0.2, self.loop.stop)
+        self.loop.start()
+        server.stop()
+        client.stop()
+        self.assertEqual(self.removed, ["topic"])
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_snapshot_outlives_ttl(self):
+        path = os.path.join(self.tmp_dir.name, "snapshot.json")
+        config = [{"topic": "topic", "address": "127.0.0.1", "port": 10001, "socket_type": "PUB"}]
+        discovery = Discovery("uuid1", self.added.append, self.removed.append, loop=self.loop,
+                              backend=StaticBackend(config), snapshot_path=path, snapshot_ttl=0.2)
+        # the node runs for longer than the ttl after finding the service
+        self.loop.call_later(0.3, self.loop.stop)
+        self.loop.start()
+        discovery.stop()
+        restarted = Discovery("uuid1", lambda s: None, lambda t: None, backend=StaticBackend([]),
+                              snapshot_path=path, snapshot_ttl=0.2)
+        self.assertEqual(list(restarted.unconfirmed), self.added)
+        # a service that isn't confirmed after the restart isn't saved as fresh
+        time.sleep(0.25)
+        restarted.stop()
+        self.assertEqual(Discovery("uuid1", lambda s: None, lambda t: None, backend=StaticBackend([]),
+                                   snapshot_path=path, snapshot_ttl=0.2).unconfirmed, {})
+
+    def test_zeroconf_resolver(self):
+        backend = ZeroconfBackend(resolver_threads=2)
+        # report straight from the resolver threads, without browsing the network
+        backend.on_found = self.added.append
+        backend.on_lost = lambda topic, node_uuid: self.removed.append(topic)
+        resolving = threading.Event()
+        release = threading.Event()
+        def query(topic, node_uuid):
+            if topic != "fast":
+                resolving.set()
+                release.wait(5.0)
+            return Service(topic, "127.0.0.1", 10001, zmq.PUB, node_uuid)
+        backend.service_from_zeroconf_query = query
+        def browse(topic):
+            backend.add_service(backend.zeroconf, COLUGO_TYPE_STR, "_{}._uuid2.{}".format(topic, COLUGO_TYPE_STR))
+        def wait():
+            backend.resolver.shutdown(wait=True)
+            backend.resolver = ThreadPoolExecutor(2)
+        browse("fast")
+        wait()
+        self.assertEqual([s.topic for s in self.added], ["fast"])
+        # removed while it is being resolved
+        browse("slow")
+        resolving.wait(5.0)
+        backend.remove_service(backend.zeroconf, COLUGO_TYPE_STR, "_slow._uuid2.{}".format(COLUGO_TYPE_STR))
+        release.set()
+        wait()
+        self.assertEqual([s.topic for s in self.added], ["fast"])
+        self.assertEqual(self.removed, ["slow"])
+        # resolved after the backend is closed
+        (resolving, release) = (threading.Event(), threading.Event())
+        browse("late")
+        resolving.wait(5.0)
+        backend.close()
+        release.set()
+        backend.resolver.shutdown(wait=True)
+        self.assertEqual([s.topic for s in self.added], ["fast"])
+
+if __name__ == '__main__':
+    unittest.main()
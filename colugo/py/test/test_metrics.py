@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py.metrics import Histogram, SocketMetrics
+from colugo.py.publisher import Publisher
+from colugo.py.subscriber import Subscriber
+from tornado import ioloop
+import zmq
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for _ in range(98):
+            histogram.record(0.000010)
+        histogram.record(0.001)
+        histogram.record(0.5)
+        self.assertEqual(histogram.count, 100)
+        # upper bound of the bucket holding 10us
+        self.assertEqual(histogram.percentile(50), 16e-6)
+        self.assertEqual(histogram.percentile(99), 1024e-6)
+        self.assertEqual(histogram.percentile(100), 0.5)
+        summary = histogram.to_dict()
+        self.assertEqual(summary["max"], 0.5)
+        self.assertAlmostEqual(summary["mean"], (98 * 0.00001 + 0.001 + 0.5) / 100)
+
+    def test_socket_metrics(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        def callback(msg):
+            received.append(msg)
+            if len(received) == 2:
+                loop.stop()
+        def send():
+            pub.send("abc")
+            pub.send("defg", key="k")
+        pub = Publisher(loop, "topic")
+        pub.metrics = SocketMetrics()
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback)
+        sub.metrics = SocketMetrics()
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+        self.assertEqual(pub.metrics.messages_out, 2)
+        self.assertEqual(pub.metrics.bytes_out, 8)
+        self.assertEqual(sub.metrics.messages_in, 2)
+        self.assertEqual(sub.metrics.bytes_in, 8)
+        self.assertEqual(sub.metrics.connects, 1)
+        self.assertEqual(sub.metrics.callback_time.count, 2)
+        self.assertEqual(sub.metrics.to_dict()["callback_time"]["count"], 2)
+
+    def test_disabled(self):
+        loop = ioloop.IOLoop.current()
+        pub = Publisher(loop, "topic")
+        self.assertIsNone(pub.metrics)
+        pub.bind()
+        self.assertTrue(pub.send("abc"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,10 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
 
 import logging
+from colugo.py.codec import JSONCodec
+from colugo.py.discovery_backend import StaticBackend
 from colugo.py.node import Node
+from colugo.py.service import Service
 from tornado import ioloop
 import uuid
 import zmq
@@ -32,5 +35,131 @@ class TestSocket(unittest.TestCase):
         node.start()
         self.assertTrue(True)
 
+    def test_remove_delayed_callback(self):
+        node = Node("TestNode7", discovery_backend=StaticBackend([]), timer_tick_ms=5)
+        fired = []
+        handle = node.add_delayed_callback(50, lambda: fired.append(1))
+        node.add_delayed_callback(20, lambda: node.remove_delayed_callback(handle))
+        node.add_delayed_callback(100, node.stop)
+        node.start()
+        self.assertEqual(fired, [])
+        self.assertEqual(node.wheel.count, 0)
+
+    def test_local_dispatch(self):
+        node = Node("TestNode3", discovery_backend=StaticBackend([]), local_dispatch=True)
+        received = []
+        def callback(msg):
+            received.append(msg)
+            node.stop()
+        pub = node.add_publisher("topic")
+        sub = node.add_subscriber("topic", callback)
+        node.add_delayed_callback(100, lambda: pub.send("local"))
+        node.start()
+        self.assertEqual(received, ["local"])
+        self.assertEqual(list(sub.connections.values()), ["local"])
+        self.assertEqual(pub.local_subscribers, [sub])
+
+    def test_codec_negotiation(self):
+        node = Node("TestNode4", discovery_backend=StaticBackend([]))
+        received = []
+        def callback(msg):
+            received.append(msg)
+            node.stop()
+        pub = node.add_publisher("topic", codec=JSONCodec())
+        sub = node.add_subscriber("topic", callback)
+        node.add_delayed_callback(100, lambda: pub.send({"id": 1}))
+        node.start()
+        self.assertEqual(received, [{"id": 1}])
+        # adopted from the publisher's advertised codec
+        self.assertIsInstance(sub.codec, JSONCodec)
+
+    def test_metrics(self):
+        node = Node("TestNode5", discovery_backend=StaticBackend([]), metrics=True)
+        exported = []
+        def callback(msg):
+            pass
+        pub = node.add_publisher("topic")
+        sub = node.add_subscriber("topic", callback)
+        repeater = node.add_repeater(20, lambda: pub.send("abc"))
+        repeater.start()
+        exporter = node.add_metrics_exporter(100, exported.append)
+        exporter.start()
+        node.add_delayed_callback(250, node.stop)
+        node.start()
+        self.assertGreaterEqual(len(exported), 2)
+        metrics = {m["socket"]: m for m in node.metrics()}
+        self.assertEqual(metrics["Publisher"]["topic"], "topic")
+        self.assertGreater(metrics["Publisher"]["messages_out"], 0)
+        self.assertGreater(metrics["Subscriber"]["messages_in"], 0)
+        self.assertEqual(metrics["Subscriber"]["connects"], 1)
+
+    def test_trace(self):
+        node = Node("TestNode6", discovery_backend=StaticBackend([]), trace=True)
+        received = []
+        pub = node.add_publisher("topic")
+        sub = node.add_subscriber("topic", received.append)
+        repeater = node.add_repeater(20, lambda: pub.send("abc"))
+        repeater.start()
+        node.add_delayed_callback(250, node.stop)
+        node.start()
+        self.assertGreater(len(received), 0)
+        self.assertEqual(received[0], "abc")
+        latency = node.tracer.to_dict()["topics"]["topic"]["latency"]
+        self.assertEqual(latency["count"], len(received))
+        self.assertEqual(node.tracer.offset(node.uuid), 0.0)
+
+    def test_concurrent_reply_server(self):
+        node = Node("TestNode9", discovery_backend=StaticBackend([]))
+        replies = []
+        def reply(msg):
+            replies.append(msg)
+            node.stop()
+        node.add_reply_server("topic", lambda msg, send_reply: send_reply(msg), concurrent=True)
+        client = node.add_request_client("topic", None)
+        node.add_delayed_callback(100, lambda: client.send("ping", reply))
+        node.start()
+        self.assertEqual(replies, ["ping"])
+        # announced as the ROUTER socket it is
+        self.assertEqual([s.socket_type for s in node.discovery.servers.get("topic")], [zmq.ROUTER])
+
+    def test_evict(self):
+        node = Node("TestNode8", discovery_backend=StaticBackend([]), client_spares=1)
+        # a server loaded from the snapshot that never shows up on the network
+        stale = Service("topic", "127.0.0.1", 1, zmq.REP, str(uuid.uuid1()))
+        node.discovery.servers.add(stale)
+        node.discovery.unconfirmed[stale] = stale
+        server = node.add_reply_server("topic", lambda msg, send_reply: send_reply(msg))
+        client = node.add_request_client("topic", None)
+        pool = node.pools["topic"]
+        connections = []
+        spares = []
+        def evict():
+            connections.append(len(client.connections))
+            node.discovery.evict(stale)
+            # the spares follow the client, so they can still be swapped in
+            spares.append(len(pool.spares))
+            connections.append(dict(pool.connections))
+            node.stop()
+        node.add_delayed_callback(50, evict)
+        node.start()
+        self.assertEqual(list(client.connections), [(server.address, server.port)])
+        self.assertEqual(connections, [2, client.connections])
+        self.assertEqual(spares, [1])
+
+    def test_closed_sockets(self):
+        node = Node("TestNode10", discovery_backend=StaticBackend([]), metrics=True)
+        pub = node.add_publisher("topic")
+        sub = node.add_subscriber("topic", None)
+        client = node.add_request_client("other", None)
+        # a cycled socket is still open
+        client.cycle_socket()
+        self.assertEqual(node.sockets, [pub, sub, client])
+        pub.close()
+        self.assertEqual(node.sockets, [sub, client])
+        self.assertEqual([m["socket"] for m in node.metrics()], ["Subscriber", "RequestClient"])
+        sub.close()
+        client.close()
+        self.assertEqual(node.sockets, [])
+
 if __name__ == '__main__':
     unittest.main()
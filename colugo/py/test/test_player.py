@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py.codec import JSONCodec
+from colugo.py.discovery_backend import StaticBackend
+from colugo.py.message_log import LogWriter
+from colugo.py.node import Node
+from colugo.py.sequence import SequenceTracker
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestPlayer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.log")
+        # 21 messages, 50ms apart, alternating between a json topic and a sequenced string topic
+        writer = LogWriter(self.path, chunk_size=128)
+        a = writer.add_topic("a", "json")
+        b = writer.add_topic("b")
+        origin = uuid.uuid4().bytes
+        for i in range(21):
+            if i % 2:
+                writer.write(1000.0 + i * 0.05, a, [JSONCodec().encode({"i": i})])
+            else:
+                writer.write(1000.0 + i * 0.05, b, [b"", "{}".format(i).encode("utf-8"),
+                                                    SequenceTracker.stamp(1, i, origin)])
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def play(self, name, speed, **kwargs):
+        node = Node(name, discovery_backend=StaticBackend([]))
+        received = []
+        player = node.add_player(self.path, speed=speed, on_finish=lambda: node.add_delayed_callback(200, node.stop),
+                                 **kwargs)
+        for topic in player.topics:
+            node.add_subscriber(topic, lambda msg, topic=topic: received.append((time.monotonic(), topic, msg)))
+        node.add_delayed_callback(200, player.start)
+        node.start()
+        return (player, received)
+
+    def test_as_fast_as_possible(self):
+        (player, received) = self.play("TestPlayer1", None)
+        self.assertEqual(player.messages, 21)
+        self.assertEqual(player.position, 1001.0)
+        self.assertEqual([msg for (_, topic, msg) in received if topic == "a"], [{"i": i} for i in range(1, 21, 2)])
+        # the original sequence frames were replaced, so every message gets through
+        self.assertEqual([msg for (_, topic, msg) in received if topic == "b"], [str(i) for i in range(0, 21, 2)])
+        self.assertLess(received[-1][0] - received[0][0], 0.5)
+
+    def test_speed(self):
+        # one second of messages at twice real time
+        (player, received) = self.play("TestPlayer2", 2.0)
+        self.assertEqual(len(received), 21)
+        elapsed = received[-1][0] - received[0][0]
+        self.assertGreater(elapsed, 0.45)
+        self.assertLess(elapsed, 0.7)
+        self.assertLess(player.lag, 0.1)
+
+    def test_seek(self):
+        (player, received) = self.play("TestPlayer3", None, topics=["a"], start=1000.5, end=1000.8)
+        self.assertEqual(player.topics, ["a"])
+        self.assertEqual([msg for (_, _, msg) in received], [{"i": 11}, {"i": 13}, {"i": 15}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,12 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
 
 import logging
+from colugo.py.codec import JSONCodec, RawCodec
+from colugo.py.metrics import SocketMetrics
 from colugo.py.publisher import Publisher
 from colugo.py.subscriber import Subscriber
 from tornado import ioloop
+import time
 import zmq
 import unittest
 
@@ -33,5 +36,336 @@ class TestSocket(unittest.TestCase):
         loop.call_later(0.1, send)
         loop.start()
 
+    def test_raw_message(self):
+        loop = ioloop.IOLoop.current()
+        # not valid utf-8, would fail to decode without raw mode
+        message = b"\xff\x00\xfe"
+        def callback(msg):
+            self.assertIsInstance(msg, memoryview)
+            self.assertEqual(msg.tobytes(), message)
+            loop.stop()
+        def send():
+            pub.send(message)
+        pub = Publisher(loop, "topic")
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback, raw=True)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+
+    def test_raw_codec_key(self):
+        loop = ioloop.IOLoop.current()
+        # binary key, follows the codec rather than raw mode
+        key = b"\xffpose"
+        received = []
+        def pose_callback(k, msg):
+            received.append((k, msg.tobytes()))
+            loop.stop()
+        def send():
+            pub.send(b"\x00", key=key)
+        pub = Publisher(loop, "topic", codec=RawCodec())
+        pub.bind()
+        sub = Subscriber(loop, "topic", None, codec=RawCodec())
+        sub.add_filter(b"\xff", pose_callback)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        safety = loop.call_later(5.0, loop.stop)
+        loop.start()
+        loop.remove_timeout(safety)
+        self.assertEqual(received, [(key, b"\x00")])
+
+    def test_codec(self):
+        loop = ioloop.IOLoop.current()
+        message = {"message": "it's a message", "id": 0, "value": 1.5}
+        received = []
+        def callback(msg):
+            received.append(msg)
+        def pose_callback(key, msg):
+            # decoded once, the same object is passed to every callback
+            self.assertIs(msg, received[-1])
+            loop.stop()
+        def send():
+            pub.send(message, key="pose")
+        pub = Publisher(loop, "topic", codec=JSONCodec())
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback, codec=JSONCodec())
+        sub.add_filter("pose", pose_callback)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+        self.assertEqual(received, [message])
+
+    def test_filter(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        def main_callback(msg):
+            self.assertTrue(False)
+        def pose_callback(key, msg):
+            received.append((key, msg))
+            if len(received) == 2:
+                self.assertEqual(received, [("pose.front", "a"), ("pose.rear", "c")])
+                loop.stop()
+        def send():
+            pub.send("a", key="pose.front")
+            pub.send("b", key="status")
+            pub.send("c", key="pose.rear")
+        pub = Publisher(loop, "topic")
+        pub.bind()
+        sub = Subscriber(loop, "topic", None)
+        sub.add_filter("pose.", pose_callback)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+
+    def test_keyed_message_main_callback(self):
+        loop = ioloop.IOLoop.current()
+        def callback(msg):
+            self.assertEqual(msg, "body")
+            loop.stop()
+        def send():
+            pub.send("body", key="key")
+        pub = Publisher(loop, "topic")
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+
+    def test_send_many(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        def callback(msg):
+            received.append(msg)
+            if len(received) == 3:
+                self.assertEqual(received, ["a", "b", "c"])
+                loop.stop()
+        def send():
+            self.assertEqual(pub.send_many(["a", "b", "c"]), 3)
+        pub = Publisher(loop, "topic")
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+
+    def test_batch(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        def callback(msg):
+            received.append(msg)
+            if len(received) == 2:
+                self.assertEqual(received, ["a", "b"])
+                loop.stop()
+        def send():
+            pub.send("a")
+            pub.send("b")
+            # nothing is written until the next loop turn
+            self.assertEqual(len(pub.pending), 2)
+        pub = Publisher(loop, "topic", batch=True)
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+        self.assertEqual(len(pub.pending), 0)
+
+    def test_track_drops(self):
+        loop = ioloop.IOLoop.current()
+        def callback(msg):
+            pass
+        def send():
+            count = 20000
+            sent = pub.send_many(["x" * 100] * count)
+            self.assertGreater(pub.dropped, 0)
+            self.assertEqual(sent + pub.dropped, count)
+            loop.stop()
+        pub = Publisher(loop, "topic", sndhwm=10, track_drops=True)
+        self.assertEqual(pub.zmq_socket.getsockopt(zmq.SNDHWM), 10)
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+
+    def test_track_drops_slow_subscriber(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        count = 2000
+        def send(sent):
+            # bursts that the fast subscriber keeps up with
+            for _ in range(100):
+                pub.send("x")
+            if sent + 100 < count:
+                loop.call_later(0.005, send, sent + 100)
+            else:
+                loop.call_later(0.1, loop.stop)
+        pub = Publisher(loop, "topic", sndhwm=10, track_drops=True)
+        pub.bind()
+        fast = Subscriber(loop, "topic", received.append)
+        fast.connect(pub.address, pub.port, pub.inproc_endpoint)
+        # a subscriber that never reads
+        slow = pub.ctx.socket(zmq.SUB, {zmq.RCVHWM: 10, zmq.SUBSCRIBE: b""})
+        slow.connect(pub.inproc_endpoint)
+        loop.call_later(0.1, send, 0)
+        safety = loop.call_later(5.0, loop.stop)
+        loop.start()
+        loop.remove_timeout(safety)
+        slow.close()
+        # every message that couldn't be queued for the slow subscriber was dropped for the fast one too
+        self.assertGreater(pub.dropped, count / 2)
+        self.assertEqual(len(received), count - pub.dropped)
+        # the subscription messages were read
+        self.assertFalse(pub.zmq_socket.getsockopt(zmq.EVENTS) & zmq.POLLIN)
+        fast.close()
+        pub.close()
+
+    def test_local_dispatch(self):
+        loop = ioloop.IOLoop.current()
+        message = "pose data"
+        local = []
+        remote = []
+        def local_callback(msg):
+            # the same object, never encoded or decoded
+            self.assertIs(msg, message)
+            local.append(msg)
+        def pose_callback(key, msg):
+            local.append((key, msg))
+        def remote_callback(msg):
+            remote.append(msg)
+            if len(remote) == 2:
+                loop.stop()
+        def send():
+            pub.send(message)
+            pub.send(message, key="pose.x")
+        pub = Publisher(loop, "topic")
+        pub.bind()
+        sub_local = Subscriber(loop, "topic", local_callback)
+        sub_local.add_filter("pose", pose_callback)
+        sub_local.connect_local(pub)
+        self.assertEqual(pub.local_subscribers, [sub_local])
+        sub_remote = Subscriber(loop, "topic", remote_callback)
+        sub_remote.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.start()
+        self.assertEqual(local, [message, message, ("pose.x", message)])
+        self.assertEqual(remote, [message, message])
+        sub_local.close()
+        self.assertEqual(pub.local_subscribers, [])
+
+    def test_conflate(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        def callback(key, msg):
+            received.append((key, msg))
+            # a slow callback, so messages queue up behind it
+            time.sleep(0.01)
+            if ("k.a", "99") in received and ("k.b", "99") in received:
+                loop.stop()
+        def send():
+            for i in range(100):
+                pub.send(str(i), key="k.a")
+                pub.send(str(i), key="k.b")
+        pub = Publisher(loop, "topic")
+        pub.bind()
+        sub = Subscriber(loop, "topic", None, conflate=True)
+        sub.metrics = SocketMetrics()
+        sub.add_filter("k", callback)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        safety = loop.call_later(5.0, loop.stop)
+        loop.start()
+        loop.remove_timeout(safety)
+        self.assertEqual(received[-2:], [("k.a", "99"), ("k.b", "99")])
+        self.assertLess(len(received), 200)
+        self.assertEqual(sub.metrics.messages_in - sub.metrics.conflated, len(received))
+
+    def test_conflate_local(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        def callback(msg):
+            received.append(msg)
+        def send():
+            for i in range(10):
+                pub.send(str(i))
+            pub.send("x", key="k")
+        pub = Publisher(loop, "topic")
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback, conflate=True)
+        sub.connect_local(pub)
+        loop.call_later(0.1, send)
+        loop.call_later(0.3, loop.stop)
+        loop.start()
+        self.assertEqual(received, ["9", "x"])
+
+    def test_max_rate(self):
+        loop = ioloop.IOLoop.current()
+        latest = []
+        batches = []
+        keyed = []
+        def send():
+            for i in range(100):
+                pub.send(str(i), key="k.{}".format(i % 2))
+        pub = Publisher(loop, "topic")
+        pub.bind()
+        sub_latest = Subscriber(loop, "topic", latest.append, max_rate_hz=20)
+        sub_latest.connect(pub.address, pub.port)
+        sub_batch = Subscriber(loop, "topic", batches.append, max_rate_hz=20, batch=True)
+        sub_batch.add_filter("k.1", lambda key, msgs: keyed.append((key, msgs)))
+        sub_batch.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        loop.call_later(0.2, send)
+        loop.call_later(0.5, loop.stop)
+        loop.start()
+        sub_latest.close()
+        sub_batch.close()
+        # only the latest message of each key is delivered on each tick
+        self.assertLessEqual(len(latest), 10)
+        self.assertEqual(latest[-1], "99")
+        self.assertLessEqual(len(batches), 10)
+        self.assertEqual([m for b in batches for m in b], [str(i) for i in range(100)] * 2)
+        self.assertEqual([m for (_, msgs) in keyed for m in msgs], [str(i) for i in range(1, 100, 2)] * 2)
+        self.assertEqual(set(key for (key, _) in keyed), {"k.1"})
+
+    def test_rate_limit_batch_bounds(self):
+        loop = ioloop.IOLoop.current()
+        with self.assertRaises(ValueError):
+            Subscriber(loop, "topic", lambda msgs: None, batch=True)
+        batches = []
+        sub = Subscriber(loop, "topic", batches.append, max_rate_hz=1, batch=True)
+        sub.metrics = SocketMetrics()
+        for i in range(Subscriber.DRAIN_LIMIT + 5):
+            sub.buffer(None, None, i)
+        self.assertEqual(len(sub.pending), Subscriber.DRAIN_LIMIT)
+        self.assertEqual(sub.metrics.drops, 5)
+        sub.flush()
+        sub.close()
+        # the oldest messages are dropped
+        self.assertEqual(batches, [list(range(5, Subscriber.DRAIN_LIMIT + 5))])
+
+    def test_callback_batch(self):
+        loop = ioloop.IOLoop.current()
+        batches = []
+        keyed = []
+        def callback_batch(msgs):
+            batches.append(msgs)
+            if sum(len(b) for b in batches) == 500:
+                loop.stop()
+        def send():
+            for i in range(500):
+                pub.send(str(i), key="k" if i % 2 else None)
+        pub = Publisher(loop, "topic", sndhwm=1000)
+        pub.bind()
+        sub = Subscriber(loop, "topic", None, callback_batch=callback_batch, batch_size=64)
+        sub.add_filter("k", lambda key, msg: keyed.append(msg))
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        safety = loop.call_later(5.0, loop.stop)
+        loop.start()
+        loop.remove_timeout(safety)
+        self.assertEqual([m for b in batches for m in b], [str(i) for i in range(500)])
+        self.assertLessEqual(max(len(b) for b in batches), 64)
+        self.assertLess(len(batches), 500)
+        self.assertEqual(keyed, [str(i) for i in range(1, 500, 2)])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
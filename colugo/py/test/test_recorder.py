@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py.discovery_backend import StaticBackend
+from colugo.py.message_log import LogReader, LogWriter
+from colugo.py.node import Node
+import shutil
+import tempfile
+import time
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_log(self):
+        writer = LogWriter(self.path, chunk_size=256)
+        a = writer.add_topic("a", "json")
+        b = writer.add_topic("b")
+        for i in range(100):
+            writer.write(1000.0 + i, a if i % 2 else b, [b"key", "{}".format(i).encode("utf-8")])
+        writer.close()
+        return writer
+
+    def test_roundtrip(self):
+        writer = self.write_log()
+        self.assertEqual(writer.messages, 100)
+        reader = LogReader(self.path)
+        self.assertGreater(len(reader.chunks), 1)
+        self.assertEqual(reader.codecs, {"a": "json", "b": None})
+        self.assertEqual((reader.start_time, reader.end_time), (1000.0, 1099.0))
+        self.assertEqual((reader.count(), reader.count("a"), reader.count("c")), (100, 50, 0))
+        messages = [(t, topic, [bytes(f) for f in frames]) for (t, topic, frames) in reader.read()]
+        self.assertEqual(messages[3], (1003.0, "a", [b"key", b"3"]))
+        self.assertEqual([t for (t, _, _) in messages], [1000.0 + i for i in range(100)])
+        reader.close()
+
+    def test_seek(self):
+        self.write_log()
+        reader = LogReader(self.path)
+        times = [t for (t, _, _) in reader.read(start=1050.0, end=1059.5)]
+        self.assertEqual(times, [1050.0 + i for i in range(10)])
+        topics = set(topic for (_, topic, _) in reader.read(topics=["b"], start=1090.0))
+        self.assertEqual(topics, set(["b"]))
+        self.assertEqual(list(reader.read(topics=["c"])), [])
+        reader.close()
+
+    def test_truncated(self):
+        self.write_log()
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as f:
+            f.truncate(size - 10)
+        reader = LogReader(self.path)
+        # everything up to the last complete chunk is still readable
+        self.assertGreater(reader.count(), 0)
+        self.assertLess(reader.count(), 100)
+        self.assertEqual(len(list(reader.read())), reader.count())
+        reader.close()
+        with open(self.path, "wb") as f:
+            f.write(b"not a log")
+        with self.assertRaises(ValueError):
+            LogReader(self.path)
+
+    def test_recorder(self):
+        node = Node("TestRecorder", discovery_backend=StaticBackend([]))
+        pub = node.add_publisher("topic")
+        other = node.add_publisher("other")
+        recorder = node.add_recorder(self.path, ["topic", "other"], chunk_size=64)
+        received = []
+        # a regular subscriber on the same topic as the recorder still gets every message
+        node.add_subscriber("topic", received.append)
+        def send():
+            for i in range(20):
+                pub.send("{}".format(i))
+            other.send("x", key="k")
+        node.add_delayed_callback(200, send)
+        node.add_delayed_callback(500, node.stop)
+        node.start()
+        self.assertEqual(len(received), 20)
+        self.assertEqual(recorder.messages, 21)
+        reader = LogReader(self.path)
+        self.assertEqual((reader.count("topic"), reader.count("other")), (20, 1))
+        frames = [[bytes(f) for f in frames] for (_, _, frames) in reader.read(topics=["topic"])]
+        self.assertEqual(frames[0], [pub.pack("0")])
+        frames = [[bytes(f) for f in frames] for (_, _, frames) in reader.read(topics=["other"])]
+        self.assertEqual(frames, [[b"k", other.pack("x")]])
+        reader.close()
+
+    def test_recorder_times(self):
+        node = Node("TestRecorder2", discovery_backend=StaticBackend([]), trace=True)
+        pub = node.add_publisher("topic")
+        untraced = node.add_publisher("untraced")
+        untraced.tracer = None
+        recorder = node.add_recorder(self.path, ["topic", "untraced"])
+        def send():
+            # the loop is busy while these are sent, so they are all received in one burst
+            for i in range(5):
+                pub.send("{}".format(i))
+                untraced.send("{}".format(i))
+                time.sleep(0.02)
+        start = time.time()
+        node.add_delayed_callback(200, send)
+        node.add_delayed_callback(500, node.stop)
+        node.start()
+        self.assertEqual(recorder.messages, 10)
+        reader = LogReader(self.path)
+        times = [t for (t, _, _) in reader.read(topics=["topic"])]
+        self.assertEqual(len(times), 5)
+        # traced messages keep the spacing they were sent with
+        for (previous, t) in zip(times, times[1:]):
+            self.assertGreater(t - previous, 0.015)
+        self.assertGreater(times[0], start + 0.15)
+        self.assertLess(times[-1], time.time())
+        # untraced ones are stamped as they are received, and the log never goes back in time
+        all_times = [t for (t, _, _) in reader.read()]
+        self.assertEqual(all_times, sorted(all_times))
+        self.assertGreaterEqual(min(t for (t, _, _) in reader.read(topics=["untraced"])), times[-1])
+        reader.close()
+
+if __name__ == '__main__':
+    unittest.main()
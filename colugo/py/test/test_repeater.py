@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import gc
+import logging
+from colugo.py.repeater import Repeater
+from tornado import ioloop
+import time
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestRepeater(unittest.TestCase):
+    def run_loop(self, seconds):
+        loop = ioloop.IOLoop.current()
+        loop.call_later(seconds, loop.stop)
+        loop.start()
+
+    def test_drift(self):
+        loop = ioloop.IOLoop.current()
+        # slow callbacks don't push the following runs back
+        rep = Repeater(loop, 20, lambda: time.sleep(0.005))
+        self.run_loop(0.51)
+        rep.stop()
+        self.assertGreaterEqual(rep.stats.runs, 24)
+        self.assertLessEqual(rep.stats.runs, 26)
+        self.assertEqual(rep.stats.skipped, 0)
+        self.assertEqual(rep.stats.overruns, 0)
+        self.assertLess(rep.stats.lateness.percentile(50), 0.005)
+
+    def test_policies(self):
+        loop = ioloop.IOLoop.current()
+        block = [True]
+        def callback():
+            if block[0]:
+                block[0] = False
+                time.sleep(0.055)
+        skip = Repeater(loop, 10, callback)
+        self.run_loop(0.2)
+        skip.stop()
+        self.assertGreaterEqual(skip.stats.skipped, 4)
+        self.assertEqual(skip.stats.caught_up, 0)
+        self.assertEqual(skip.stats.overruns, 1)
+        block[0] = True
+        catch_up = Repeater(loop, 10, callback, policy=Repeater.CATCH_UP)
+        self.run_loop(0.2)
+        catch_up.stop()
+        self.assertGreaterEqual(catch_up.stats.caught_up, 4)
+        self.assertEqual(catch_up.stats.skipped, 0)
+        self.assertGreater(catch_up.stats.runs, skip.stats.runs)
+
+    def test_coalesce(self):
+        loop = ioloop.IOLoop.current()
+        timers = {}
+        runs = [0]
+        def callback():
+            runs[0] += 1
+        repeaters = [Repeater(loop, 10, callback, timers=timers) for _ in range(100)]
+        other = Repeater(loop, 15, callback, timers=timers)
+        self.assertEqual(len(timers), 2)
+        self.assertEqual(len(timers[(10, Repeater.SKIP)].repeaters), 100)
+        # a callback may stop repeaters that share its timer
+        repeaters.append(Repeater(loop, 10, lambda: repeaters[0].stop(), timers=timers))
+        self.run_loop(0.105)
+        for rep in repeaters:
+            rep.stop()
+        other.stop()
+        self.assertEqual(timers, {})
+        self.assertGreaterEqual(repeaters[1].stats.runs, 9)
+        self.assertLessEqual(repeaters[0].stats.runs, 1)
+        self.assertEqual(runs[0], sum(rep.stats.runs for rep in repeaters[:-1]) + other.stats.runs)
+
+    def test_unreferenced(self):
+        loop = ioloop.IOLoop.current()
+        runs = []
+        timers = {}
+        # runs until stopped, even without a reference
+        Repeater(loop, 10, lambda: runs.append(1), timers=timers)
+        gc.collect()
+        self.run_loop(0.1)
+        self.assertGreaterEqual(len(runs), 8)
+        timers[(10, Repeater.SKIP)].repeaters[0].stop()
+
+if __name__ == '__main__':
+    unittest.main()
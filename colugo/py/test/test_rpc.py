@@ -5,10 +5,15 @@ import sys
 # local path to library
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
 
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import logging
+from colugo.py.client_pool import ClientPool
+from colugo.py.codec import JSONCodec
+from colugo.py.context import Context
 from colugo.py.reply_server import ReplyServer
 from colugo.py.request_client import RequestClient
-from tornado import ioloop
+from tornado import gen, ioloop
 import zmq
 import time
 import unittest
@@ -37,6 +42,43 @@ class TestSocket(unittest.TestCase):
         loop.call_later(0.1, send_request)
         loop.start()
 
+    def test_rpc_chained(self):
+        loop = ioloop.IOLoop.current()
+        replies = []
+        def request_handler(msg, send_reply):
+            send_reply(msg)
+        def reply_handler(msg):
+            replies.append(msg)
+            if len(replies) == 3:
+                loop.stop()
+            else:
+                # the next request is sent from within the reply callback
+                req.send(str(len(replies)), reply_handler)
+        rep = ReplyServer(loop, "topic", request_handler)
+        rep.bind()
+        req = RequestClient(loop, "topic")
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, lambda: req.send("0", reply_handler))
+        loop.start()
+        self.assertEqual(replies, ["0", "1", "2"])
+
+    def test_rpc_codec(self):
+        loop = ioloop.IOLoop.current()
+        def request_handler(msg, send_reply):
+            self.assertEqual(msg, {"a": 1, "b": 2})
+            send_reply({"sum": msg["a"] + msg["b"]})
+        def reply_handler(msg):
+            self.assertEqual(msg, {"sum": 3})
+            loop.stop()
+        def send_request():
+            req.send({"a": 1, "b": 2}, reply_handler)
+        rep = ReplyServer(loop, "topic", request_handler, codec=JSONCodec())
+        rep.bind()
+        req = RequestClient(loop, "topic", codec=JSONCodec())
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, send_request)
+        loop.start()
+
     def test_rpc_timeout(self):
         loop = ioloop.IOLoop.current()
         req_message = "asdf"
@@ -61,5 +103,194 @@ class TestSocket(unittest.TestCase):
         loop.call_later(0.1, send_request)
         loop.start()
 
+    def retry_after_timeout(self, pool):
+        loop = ioloop.IOLoop.current()
+        replies = []
+        timeouts = []
+        def request_handler(msg, send_reply):
+            # the first reply is too late
+            loop.call_later(0.2 if msg == "first" else 0, send_reply, "re: " + msg)
+        def reply_handler(msg):
+            replies.append(msg)
+            loop.stop()
+        def timeout_handler():
+            timeouts.append(req.zmq_socket)
+            # the socket is reset once the handler returns
+            loop.call_later(0.05, lambda: req.send("second", reply_handler, 1000))
+        rep = ReplyServer(loop, "topic", request_handler)
+        rep.bind()
+        req = RequestClient(loop, "topic", pool=pool)
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, lambda: req.send("first", reply_handler, 100, timeout_handler))
+        safety = loop.call_later(2.0, loop.stop)
+        loop.start()
+        loop.remove_timeout(safety)
+        self.assertEqual(replies, ["re: second"])
+        self.assertEqual(len(timeouts), 1)
+        self.assertIsNot(req.zmq_socket, timeouts[0])
+        req.close()
+        rep.close()
+        return req
+
+    def test_rpc_timeout_reconnect(self):
+        # the reset socket is connected to the same server again, without help from discovery
+        self.retry_after_timeout(None)
+
+    def test_rpc_timeout_pool(self):
+        loop = ioloop.IOLoop.current()
+        pool = ClientPool(loop, Context.instance(), "topic", zmq.REQ)
+        req = self.retry_after_timeout(pool)
+        # a warm spare was swapped in, and replaced
+        self.assertEqual(pool.swaps, 1)
+        self.assertEqual(pool.created, 2)
+        self.assertEqual(len(pool.spares), 1)
+        self.assertEqual(list(pool.connections.values()), [req.endpoint])
+        pool.close()
+
+    def test_rpc_pipelined(self):
+        loop = ioloop.IOLoop.current()
+        replies = []
+        def request_handler(msg, send_reply):
+            send_reply("re: " + msg)
+        def reply_handler(expected, msg):
+            self.assertEqual(msg, expected)
+            replies.append(msg)
+            if len(replies) == 3:
+                self.assertEqual(len(req.pending), 0)
+                loop.stop()
+        def send_requests():
+            # all three requests are in flight before any reply arrives
+            for i in range(3):
+                msg = "request {}".format(i)
+                req.send(msg, functools.partial(reply_handler, "re: " + msg))
+            self.assertEqual(len(req.pending), 3)
+        rep = ReplyServer(loop, "topic", request_handler)
+        rep.bind()
+        req = RequestClient(loop, "topic", pipelined=True)
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, send_requests)
+        loop.start()
+
+    def test_rpc_pipelined_timeout(self):
+        loop = ioloop.IOLoop.current()
+        def request_handler(msg, send_reply):
+            # delay the reply to trigger the timeout
+            loop.call_later(0.2, send_reply, msg)
+        def reply_handler(msg):
+            # This shouldn't trigger
+            self.assertTrue(False)
+        def timeout_handler():
+            self.assertEqual(len(req.pending), 0)
+            # let the late reply arrive, it should be dropped
+            loop.call_later(0.3, loop.stop)
+        def send_request():
+            req.send(req_message, reply_handler, 100, timeout_handler)
+        req_message = "asdf"
+        rep = ReplyServer(loop, "topic", request_handler)
+        rep.bind()
+        req = RequestClient(loop, "topic", pipelined=True)
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, send_request)
+        loop.start()
+
+    def test_rpc_max_outstanding(self):
+        loop = ioloop.IOLoop.current()
+        req = RequestClient(loop, "topic", pipelined=True, max_outstanding=1)
+        req.connect("127.0.0.1", 30005)
+        self.assertIsNotNone(req.send("a", None, 0))
+        self.assertIsNone(req.send("b", None, 0))
+        req.close()
+
+    def test_rpc_concurrent(self):
+        loop = ioloop.IOLoop.current()
+        replies = []
+        async def request_handler(msg, send_reply):
+            # the first request is slower, so its reply should arrive last
+            await gen.sleep(0.2 if msg == "slow" else 0.01)
+            return "re: " + msg
+        def reply_handler(msg):
+            replies.append(msg)
+            if len(replies) == 2:
+                self.assertEqual(replies, ["re: fast", "re: slow"])
+                self.assertEqual(rep.in_flight, 0)
+                loop.stop()
+        def send_requests():
+            req.send("slow", reply_handler)
+            req.send("fast", reply_handler)
+        rep = ReplyServer(loop, "topic", request_handler, concurrent=True)
+        rep.bind()
+        req = RequestClient(loop, "topic", pipelined=True)
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, send_requests)
+        loop.start()
+
+    def test_rpc_executor(self):
+        loop = ioloop.IOLoop.current()
+        executor = ThreadPoolExecutor(2)
+        def request_handler(msg):
+            return "re: " + msg
+        def reply_handler(msg):
+            self.assertEqual(msg, "re: asdf")
+            loop.stop()
+        def send_request():
+            req.send("asdf", reply_handler)
+        rep = ReplyServer(loop, "topic", request_handler, executor=executor)
+        rep.bind()
+        # plain REQ clients work against concurrent servers too
+        req = RequestClient(loop, "topic")
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, send_request)
+        loop.start()
+        executor.shutdown()
+
+    def test_rpc_executor_closed(self):
+        loop = ioloop.IOLoop.current()
+        executor = ThreadPoolExecutor(1)
+        handled = []
+        def request_handler(msg):
+            time.sleep(0.2)
+            handled.append(msg)
+            return "re: " + msg
+        def close():
+            # the request is still running on the executor
+            self.assertEqual(rep.in_flight, 1)
+            rep.close()
+        rep = ReplyServer(loop, "topic", request_handler, executor=executor)
+        rep.bind()
+        req = RequestClient(loop, "topic")
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, req.send, "asdf", None)
+        loop.call_later(0.2, close)
+        loop.call_later(0.5, loop.stop)
+        with self.assertLogs("Socket", logging.DEBUG) as logs:
+            loop.start()
+        executor.shutdown()
+        req.close()
+        self.assertEqual(handled, ["asdf"])
+        self.assertIn("dropping late reply", "\n".join(logs.output))
+
+    def test_rpc_max_concurrency(self):
+        loop = ioloop.IOLoop.current()
+        replies = []
+        def request_handler(msg, send_reply):
+            self.assertEqual(rep.in_flight, 1)
+            self.assertTrue(rep.paused)
+            loop.call_later(0.05, send_reply, msg)
+        def reply_handler(msg):
+            replies.append(msg)
+            if len(replies) == 3:
+                self.assertEqual(replies, ["0", "1", "2"])
+                self.assertFalse(rep.paused)
+                loop.stop()
+        def send_requests():
+            for i in range(3):
+                req.send(str(i), reply_handler)
+        rep = ReplyServer(loop, "topic", request_handler, concurrent=True, max_concurrency=1)
+        rep.bind()
+        req = RequestClient(loop, "topic", pipelined=True)
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, send_requests)
+        loop.start()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
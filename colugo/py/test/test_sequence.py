@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py.metrics import SocketMetrics
+from colugo.py.publisher import Publisher
+from colugo.py.sequence import SequenceTracker
+from colugo.py.subscriber import Subscriber
+from tornado import ioloop
+import uuid
+import zmq
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestSequence(unittest.TestCase):
+    def test_stamp(self):
+        origin = uuid.uuid1()
+        frame = SequenceTracker.stamp(3, 42, origin.bytes)
+        self.assertEqual(SequenceTracker.parse(frame), (3, 42, str(origin)))
+        self.assertIsNone(SequenceTracker.parse(b"S"))
+
+    def test_tracker(self):
+        gaps = []
+        tracker = SequenceTracker(lambda origin, expected, received: gaps.append((origin, expected, received)))
+        metrics = SocketMetrics()
+        # joining a stream part way through is not a gap
+        self.assertTrue(tracker.check(1, 10, "a", metrics))
+        self.assertTrue(tracker.check(1, 11, "a", metrics))
+        self.assertTrue(tracker.check(1, 14, "a", metrics))
+        self.assertFalse(tracker.check(1, 14, "a", metrics))
+        self.assertFalse(tracker.check(1, 12, "a", metrics))
+        # streams from other nodes are independent
+        self.assertTrue(tracker.check(1, 1, "b", metrics))
+        # restarted publisher, its first message was lost
+        self.assertTrue(tracker.check(2, 2, "a", metrics))
+        self.assertEqual(gaps, [("a", 12, 14), ("a", 1, 2)])
+        self.assertEqual((tracker.gaps, tracker.lost, tracker.duplicates, tracker.restarts), (2, 3, 2, 1))
+        self.assertEqual((metrics.gaps, metrics.lost, metrics.duplicates, metrics.restarts), (2, 3, 2, 1))
+
+    def test_duplicates(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        def callback(msg):
+            received.append(msg)
+        def send():
+            for i in range(5):
+                pub.send(str(i))
+        pub = Publisher(loop, "topic", sequenced=True)
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback)
+        # connected twice to the same publisher, so every message arrives twice
+        sub.connect(pub.address, pub.port)
+        sub.connect(pub.address, pub.port, pub.inproc_endpoint)
+        loop.call_later(0.1, send)
+        loop.call_later(0.3, loop.stop)
+        loop.start()
+        self.assertEqual(received, ["0", "1", "2", "3", "4"])
+        self.assertEqual(sub.sequences.duplicates, 5)
+        self.assertEqual(sub.sequences.gaps, 0)
+
+    def test_gaps(self):
+        loop = ioloop.IOLoop.current()
+        received = []
+        gaps = []
+        def send():
+            pub.send("first")
+            # more than the high-water marks can hold, so the publisher drops messages
+            for i in range(20000):
+                pub.send(str(i))
+            # losses at the end of a stream only show up once the next message arrives
+            loop.call_later(0.5, pub.send, "last")
+        def callback(msg):
+            received.append(msg)
+            if msg == "last":
+                loop.stop()
+        pub = Publisher(loop, "topic", sndhwm=10, sequenced=True)
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback, on_gap=lambda *gap: gaps.append(gap))
+        sub.zmq_socket.setsockopt(zmq.RCVHWM, 10)
+        sub.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        safety = loop.call_later(5.0, loop.stop)
+        loop.start()
+        loop.remove_timeout(safety)
+        self.assertEqual(received[0], "first")
+        self.assertGreater(sub.sequences.gaps, 0)
+        self.assertEqual(len(gaps), sub.sequences.gaps)
+        self.assertEqual(len(received) + sub.sequences.lost, pub.sequence)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py.service import Service
+from colugo.py.snapshot import Snapshot
+import tempfile
+import time
+import zmq
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "snapshot.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_load(self):
+        s1 = Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")
+        s2 = Service("rpc", "127.0.0.1", 10002, zmq.REP, "uuid2")
+        snapshot = Snapshot(self.path)
+        snapshot.save([s1, s2])
+        services = snapshot.load()
+        self.assertEqual(services, [s1, s2])
+        self.assertEqual(services[0].mdns_name, s1.mdns_name)
+        self.assertEqual(services[1].timestamp, s2.timestamp)
+        self.assertTrue(services[1].server)
+
+    def test_max_age(self):
+        s1 = Service("topic", "127.0.0.1", 10001, zmq.PUB, "uuid1")
+        s2 = Service("topic", "127.0.0.1", 10002, zmq.PUB, "uuid2")
+        s1.timestamp = time.time() - 60
+        snapshot = Snapshot(self.path)
+        snapshot.save([s1, s2])
+        self.assertEqual(snapshot.load(max_age=30), [s2])
+
+    def test_missing_or_corrupt(self):
+        snapshot = Snapshot(self.path)
+        self.assertEqual(snapshot.load(), [])
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        self.assertEqual(snapshot.load(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,7 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
 
 import logging
+from colugo.py.context import Context
 from colugo.py.zsocket import Socket
 from tornado import ioloop
 import zmq
@@ -28,10 +29,29 @@ class TestSocket(unittest.TestCase):
         loop = ioloop.IOLoop.current()
         req_socket = Socket(loop, zmq.REQ)
         self.assertEqual(req_socket.protocol, zmq.REQ)
-        self.assertEqual(req_socket.ctx.getsockopt(zmq.REQ_CORRELATE), 1)
-        self.assertEqual(req_socket.ctx.getsockopt(zmq.REQ_RELAXED), 1)
-        self.assertEqual(req_socket.ctx.getsockopt(zmq.SNDTIMEO), 1000)
-        self.assertEqual(req_socket.ctx.getsockopt(zmq.LINGER), 0)
+        self.assertEqual(req_socket.zmq_socket.getsockopt(zmq.SNDTIMEO), 1000)
+        self.assertEqual(req_socket.zmq_socket.getsockopt(zmq.LINGER), 0)
+        # request options must not leak into other sockets through the shared context
+        pub_socket = Socket(loop, zmq.PUB)
+        self.assertIs(pub_socket.ctx, req_socket.ctx)
+        self.assertEqual(pub_socket.zmq_socket.getsockopt(zmq.SNDTIMEO), -1)
+        self.assertEqual(pub_socket.zmq_socket.getsockopt(zmq.LINGER), -1)
+
+    def test_context_options(self):
+        loop = ioloop.IOLoop.current()
+        ctx = Context(io_threads=2, max_sockets=128, socket_options={zmq.LINGER: 10, zmq.SNDHWM: 50})
+        self.assertEqual(ctx.zmq_context.get(zmq.IO_THREADS), 2)
+        self.assertEqual(ctx.zmq_context.get(zmq.MAX_SOCKETS), 128)
+        pub_socket = Socket(loop, zmq.PUB, ctx=ctx)
+        self.assertEqual(pub_socket.zmq_socket.getsockopt(zmq.LINGER), 10)
+        self.assertEqual(pub_socket.zmq_socket.getsockopt(zmq.SNDHWM), 50)
+        # socket specific options take precedence over the context wide options
+        req_socket = Socket(loop, zmq.REQ, ctx=ctx)
+        self.assertEqual(req_socket.zmq_socket.getsockopt(zmq.LINGER), 0)
+        self.assertEqual(req_socket.zmq_socket.getsockopt(zmq.SNDHWM), 50)
+        pub_socket.close()
+        req_socket.close()
+        ctx.term()
 
     def test_connect_disconnect(self):
         loop = ioloop.IOLoop.current()
@@ -64,6 +84,56 @@ class TestSocket(unittest.TestCase):
         loop.add_callback(unbind)
         loop.start()
 
+    def test_bind_local_transports(self):
+        loop = ioloop.IOLoop.current()
+        socket = Socket(loop, zmq.PUB)
+        (addr, p) = socket.bind()
+        self.assertEqual(socket.endpoints[0], "tcp://{}:{}".format(addr, p))
+        self.assertEqual(socket.inproc_endpoint, "inproc://colugo-{}-{}".format(addr, p))
+        self.assertIn(socket.inproc_endpoint, socket.endpoints)
+        if zmq.has("ipc"):
+            self.assertIn(socket.ipc_endpoint, socket.endpoints)
+            path = socket.ipc_endpoint[len("ipc://"):]
+            self.assertTrue(os.path.exists(path))
+        socket.unbind()
+        self.assertEqual(socket.endpoints, [])
+        if zmq.has("ipc"):
+            # zmq leaves the file behind
+            self.assertFalse(os.path.exists(path))
+            socket = Socket(loop, zmq.PUB)
+            socket.bind()
+            path = socket.ipc_endpoint[len("ipc://"):]
+            socket.close()
+            self.assertFalse(os.path.exists(path))
+        socket_tcp = Socket(loop, zmq.PUB)
+        socket_tcp.bind(local_transports=False)
+        self.assertIsNone(socket_tcp.inproc_endpoint)
+        self.assertIsNone(socket_tcp.ipc_endpoint)
+        self.assertEqual(len(socket_tcp.endpoints), 1)
+        socket_tcp.close()
+
+    def test_send_rec_local_transports(self):
+        loop = ioloop.IOLoop.current()
+        socket = Socket(loop, zmq.PUB)
+        (addr, p) = socket.bind()
+        endpoints = [e for e in (socket.inproc_endpoint, socket.ipc_endpoint) if e]
+        received = []
+        def handler(msg):
+            received.append(msg)
+            if len(received) == len(endpoints):
+                loop.stop()
+        def send():
+            socket.send("test")
+        for endpoint in endpoints:
+            socket_sub = Socket(loop, zmq.SUB)
+            socket_sub.connect(addr, p, endpoint)
+            self.assertEqual(socket_sub.connections, {(addr, p): endpoint})
+            socket_sub.set_filter()
+            socket_sub.receive(handler)
+        loop.call_later(0.1, send)
+        loop.start()
+        self.assertEqual(received, ["test"] * len(endpoints))
+
     def test_send_rec(self):
         loop = ioloop.IOLoop.current()
         socket = Socket(loop, zmq.PUB)
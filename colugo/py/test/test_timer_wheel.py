@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py.timer_wheel import TimerWheel
+from tornado import ioloop
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestTimerWheel(unittest.TestCase):
+    def run_loop(self, seconds):
+        loop = ioloop.IOLoop.current()
+        loop.call_later(seconds, loop.stop)
+        loop.start()
+
+    def test_expiry(self):
+        loop = ioloop.IOLoop.current()
+        # a small wheel, so the longer delays take more than one turn
+        wheel = TimerWheel(loop, tick_ms=5, slots=8)
+        fired = []
+        def callback(delay):
+            fired.append((delay, loop.time() - start))
+        start = loop.time()
+        for delay in [120, 0, 40, 10, 40, 75]:
+            wheel.call_later(delay, callback, delay)
+        self.run_loop(0.2)
+        self.assertEqual([delay for (delay, _) in fired], [0, 10, 40, 40, 75, 120])
+        for (delay, elapsed) in fired:
+            # never early, at most a tick (plus scheduling slack) late
+            self.assertGreaterEqual(elapsed, delay / 1000.0)
+            self.assertLess(elapsed, delay / 1000.0 + 0.015)
+        self.assertEqual(wheel.count, 0)
+        self.assertIsNone(wheel.timeout)
+
+    def test_remove(self):
+        loop = ioloop.IOLoop.current()
+        wheel = TimerWheel(loop, tick_ms=5)
+        fired = []
+        handles = [wheel.call_later(20, fired.append, i) for i in range(1000)]
+        for handle in handles[1:]:
+            wheel.remove_timeout(handle)
+        # removing twice, or after it ran, is harmless
+        wheel.remove_timeout(handles[1])
+        self.run_loop(0.05)
+        wheel.remove_timeout(handles[0])
+        self.assertEqual(fired, [0])
+        self.assertEqual(wheel.count, 0)
+        # the wheel goes idle once nothing is pending
+        wheel.call_later(10, fired.append, 1)
+        wheel.remove_timeout(wheel.call_later(10, fired.append, 2))
+        self.run_loop(0.05)
+        self.assertEqual(fired, [0, 1])
+        self.assertIsNone(wheel.timeout)
+
+    def test_reschedule(self):
+        loop = ioloop.IOLoop.current()
+        wheel = TimerWheel(loop, tick_ms=5)
+        fired = []
+        def callback(i):
+            fired.append(i)
+            if i < 5:
+                wheel.call_later(0, callback, i + 1)
+        wheel.call_later(5, callback, 0)
+        self.run_loop(0.1)
+        self.assertEqual(fired, [0, 1, 2, 3, 4, 5])
+
+if __name__ == '__main__':
+    unittest.main()
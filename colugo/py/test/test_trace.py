@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+import os
+import sys
+# local path to library
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+import logging
+from colugo.py.publisher import Publisher
+from colugo.py.reply_server import ReplyServer
+from colugo.py.request_client import RequestClient
+from colugo.py.subscriber import Subscriber
+from colugo.py.trace import Tracer
+from tornado import ioloop
+import uuid
+import zmq
+import unittest
+
+logging.basicConfig(
+    format="[%(asctime)s][%(name)s](%(levelname)s) %(message)s", level=logging.DEBUG)
+
+class TestTrace(unittest.TestCase):
+    def test_stamp(self):
+        node_uuid = str(uuid.uuid1())
+        tracer = Tracer(node_uuid)
+        frame = tracer.stamp(7)
+        self.assertEqual(len(frame), Tracer.TRACE.size)
+        (sent, epoch, sequence, origin) = tracer.parse(frame)
+        self.assertEqual(epoch, 0)
+        self.assertEqual(sequence, 7)
+        self.assertEqual(origin, node_uuid)
+        self.assertLessEqual(sent, tracer.now())
+        self.assertIsNone(tracer.parse(b"not a trace frame"))
+
+    def test_offset(self):
+        tracer = Tracer(str(uuid.uuid1()))
+        remote = str(uuid.uuid1())
+        # remote clock is 10s ahead, one way delay of 1ms
+        tracer.add_clock_sample(remote, 0.0, 10.001, 10.002, 0.003)
+        self.assertAlmostEqual(tracer.offset(remote), 10.0)
+        # slower exchanges with an asymmetric delay are filtered out
+        tracer.add_clock_sample(remote, 1.0, 11.009, 11.010, 1.011)
+        self.assertAlmostEqual(tracer.offset(remote), 10.0)
+        tracer.set_offset(remote, 0.0)
+        self.assertEqual(tracer.offset(remote), 0.0)
+
+    def test_min_delay(self):
+        tracer = Tracer(str(uuid.uuid1()))
+        remote = str(uuid.uuid1())
+        sender = Tracer(remote)
+        frame = sender.stamp(1)
+        (sent, _, _, _) = sender.parse(frame)
+        tracer.observe("topic", frame, sent + 5.0)
+        tracer.observe("topic", frame, sent + 5.5)
+        self.assertAlmostEqual(tracer.offset(remote), -5.0)
+        summary = tracer.to_dict()
+        self.assertEqual(summary["topics"]["topic"]["latency"]["count"], 2)
+        self.assertAlmostEqual(summary["topics"]["topic"]["latency"]["max"], 0.5)
+
+    def test_pubsub_trace(self):
+        loop = ioloop.IOLoop.current()
+        tracer = Tracer(str(uuid.uuid1()))
+        received = []
+        keyed = []
+        def done():
+            if len(received) == 2 and len(untraced) == 2:
+                loop.stop()
+        def callback(msg):
+            received.append(msg)
+            done()
+        def key_callback(key, msg):
+            keyed.append((key, msg))
+        def untraced_callback(msg):
+            untraced.append(msg)
+            done()
+        def send():
+            pub.send("abc")
+            pub.send("def", key="k")
+        pub = Publisher(loop, "topic")
+        pub.tracer = tracer
+        pub.bind()
+        sub = Subscriber(loop, "topic", callback)
+        sub.add_filter("k", key_callback)
+        sub.tracer = tracer
+        sub.connect(pub.address, pub.port)
+        untraced = []
+        other = Subscriber(loop, "topic", untraced_callback)
+        other.connect(pub.address, pub.port)
+        loop.call_later(0.1, send)
+        safety = loop.call_later(5.0, loop.stop)
+        loop.start()
+        loop.remove_timeout(safety)
+        self.assertEqual(received, ["abc", "def"])
+        self.assertEqual(keyed, [("k", "def")])
+        self.assertEqual(untraced, ["abc", "def"])
+        self.assertEqual(pub.sequence, 2)
+        histograms = tracer.to_dict()["topics"]["topic"]
+        self.assertEqual(histograms["latency"]["count"], 2)
+        self.assertEqual(histograms["callback"]["count"], 2)
+
+    def test_rpc_trace(self):
+        loop = ioloop.IOLoop.current()
+        client_tracer = Tracer(str(uuid.uuid1()))
+        server_tracer = Tracer(str(uuid.uuid1()))
+        def request_handler(msg, send_reply):
+            send_reply(msg)
+        def reply_handler(msg):
+            self.assertEqual(msg, "abc")
+            loop.stop()
+        rep = ReplyServer(loop, "topic", request_handler)
+        rep.tracer = server_tracer
+        rep.bind()
+        req = RequestClient(loop, "topic")
+        req.tracer = client_tracer
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, lambda: req.send("abc", reply_handler))
+        loop.start()
+        self.assertEqual(server_tracer.to_dict()["topics"]["topic"]["latency"]["count"], 1)
+        self.assertEqual(client_tracer.to_dict()["topics"]["topic"]["round_trip"]["count"], 1)
+        # both tracers read the same monotonic clock
+        self.assertLess(abs(client_tracer.offset(server_tracer.node_uuid)), 0.05)
+
+    def test_rpc_trace_pipelined(self):
+        loop = ioloop.IOLoop.current()
+        client_tracer = Tracer(str(uuid.uuid1()))
+        server_tracer = Tracer(str(uuid.uuid1()))
+        replies = []
+        def request_handler(msg, reply):
+            reply(msg)
+        def reply_handler(msg):
+            replies.append(msg)
+            if len(replies) == 3:
+                loop.stop()
+        def send():
+            for i in range(3):
+                req.send(str(i), reply_handler)
+        rep = ReplyServer(loop, "topic", request_handler, concurrent=True)
+        rep.tracer = server_tracer
+        rep.bind()
+        req = RequestClient(loop, "topic", pipelined=True)
+        req.tracer = client_tracer
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, send)
+        loop.start()
+        self.assertEqual(sorted(replies), ["0", "1", "2"])
+        self.assertEqual(client_tracer.to_dict()["topics"]["topic"]["round_trip"]["count"], 3)
+        self.assertIn(server_tracer.node_uuid, client_tracer.clock_samples)
+
+    def test_rpc_trace_untraced_server(self):
+        loop = ioloop.IOLoop.current()
+        tracer = Tracer(str(uuid.uuid1()))
+        def request_handler(msg, send_reply):
+            send_reply(msg)
+        def reply_handler(msg):
+            self.assertEqual(msg, "abc")
+            loop.stop()
+        rep = ReplyServer(loop, "topic", request_handler)
+        rep.bind()
+        req = RequestClient(loop, "topic")
+        req.tracer = tracer
+        req.connect(rep.address, rep.port)
+        loop.call_later(0.1, lambda: req.send("abc", reply_handler))
+        loop.start()
+        self.assertEqual(tracer.to_dict()["topics"], {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import logging
+import math
+
+
+class WheelTimeout:
+    """Handle of a callback scheduled on a colugo.py.TimerWheel
+
+    Attributes:
+        expires: Tick of the wheel the callback runs on
+        callback: Function to execute
+        args: Tuple of arguments passed to the callback
+        slot: Dict of the wheel slot holding the timeout, or None once it has run or been removed
+    """
+
+    __slots__ = ("expires", "callback", "args", "slot")
+
+    def __init__(self, expires, callback, args):
+        """Constructor
+
+        Args:
+            expires: Tick of the wheel the callback runs on
+            callback: Function to execute
+            args: Tuple of arguments passed to the callback
+        """
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.slot = None
+
+
+class TimerWheel:
+    """Hashed timer wheel for large numbers of short, mostly cancelled timeouts (eg, request timeouts)
+
+    Time is cut into ticks of tick_ms, counted from the creation of the wheel on the event loop's clock.
+    A timeout is stored in the slot of the tick it expires on, modulo the number of slots, so scheduling
+    and removing a timeout are a dict insert and delete, whatever the number of timeouts pending. A
+    single event loop timer wakes the wheel once per tick while timeouts are pending, and every timeout
+    that expired since the last tick is run in that one wakeup, in order of expiry.
+
+    Callbacks run at most one tick after their deadline, never before it, so tick_ms sets the trade-off
+    between timer precision and wakeups. Use the event loop directly for callbacks that need better
+    precision.
+
+    Attributes:
+        logger: Logger instance for timer activity
+        loop: Reference to the tornado event loop
+        tick: Number of seconds per tick
+        slots: List of dicts of colugo.py.WheelTimeout (used as an ordered set), one per slot
+        start: Loop time of tick 0
+        current: Last tick processed
+        count: Number of timeouts pending
+        timeout: Handle of the event loop timer of the next tick, or None when the wheel is idle
+    """
+
+    def __init__(self, loop, tick_ms=10, slots=512):
+        """Constructor
+
+        Args:
+            loop: Reference to the tornado event loop
+            tick_ms: Number of milliseconds per tick (default: 10)
+            slots: Number of slots in the wheel, timeouts more than slots ticks ahead wait for the wheel to
+                   turn more than once (default: 512)
+        """
+        self.logger = logging.getLogger("TimerWheel")
+        self.loop = loop
+        self.tick = tick_ms / 1000.0
+        self.slots = [{} for _ in range(slots)]
+        self.start = loop.time()
+        self.current = 0
+        self.count = 0
+        self.timeout = None
+
+    def call_later(self, delay_ms, callback, *args):
+        """Schedule a callback
+
+        Args:
+            delay_ms: Number of milliseconds to wait before running the callback
+            callback: Function to execute
+            *args: Arguments passed to the callback
+
+        Returns:
+            colugo.py.WheelTimeout handle, to pass to remove_timeout()
+        """
+        now = (self.loop.time() - self.start) / self.tick
+        if not self.count:
+            # the wheel was idle, skip the ticks that went by without anything to do
+            self.current = max(self.current, int(now))
+        expires = max(int(math.ceil(now + delay_ms / 1000.0 / self.tick)), self.current + 1)
+        handle = WheelTimeout(expires, callback, args)
+        handle.slot = self.slots[expires % len(self.slots)]
+        handle.slot[handle] = None
+        self.count += 1
+        if self.timeout is None:
+            self.schedule()
+        return handle
+
+    def remove_timeout(self, handle):
+        """Cancel a scheduled callback, if it hasn't run yet
+
+        Args:
+            handle: colugo.py.WheelTimeout returned by call_later()
+        """
+        if handle.slot is None:
+            return
+        del handle.slot[handle]
+        handle.slot = None
+        self.count -= 1
+        if not self.count and self.timeout is not None:
+            self.loop.remove_timeout(self.timeout)
+            self.timeout = None
+
+    def schedule(self):
+        """Helper to set the event loop timer for the next tick
+        """
+        self.timeout = self.loop.call_at(self.start + (self.current + 1) * self.tick, self.advance)
+
+    def advance(self):
+        """Run every callback that expired since the last tick, then schedule the next tick
+        """
+        self.timeout = None
+        # the loop may wake up a hair before the tick boundary
+        target = int((self.loop.time() - self.start) / self.tick + 1e-6)
+        expired = []
+        # after a long stall, one turn of the wheel visits every slot
+        for tick in range(self.current + 1, self.current + 1 + min(target - self.current, len(self.slots))):
+            slot = self.slots[tick % len(self.slots)]
+            for handle in [handle for handle in slot if handle.expires <= target]:
+                del slot[handle]
+                handle.slot = None
+                expired.append(handle)
+        self.current = max(self.current, target)
+        self.count -= len(expired)
+        if len(expired) > 1:
+            expired.sort(key=lambda handle: handle.expires)
+        for handle in expired:
+            try:
+                handle.callback(*handle.args)
+            except Exception:
+                self.logger.exception("Timer callback {} failed".format(handle.callback))
+        if self.count and self.timeout is None:
+            self.schedule()
@@ -0,0 +1,233 @@
+import collections
+import struct
+import time
+import uuid
+
+from colugo.py.metrics import Histogram
+
+
+class Tracer:
+    """Stamps outgoing messages with trace metadata and aggregates the latencies of traced messages
+
+    A node created with tracing enabled gives every socket the same tracer (see colugo.py.Node). Traced
+    messages carry one extra frame, after the message payload, holding the send time, the epoch and
+    sequence number of the sending socket (see colugo.py.SequenceTracker) and the uuid of the node that
+    sent it:
+
+        b"T" | send time (double, seconds of time.monotonic()) | epoch (uint32) | sequence (uint64) |
+        node uuid (16 bytes)
+
+    Replies to traced requests carry an echo frame instead, holding the send time of the request and the
+    times the reply server received the request and sent the reply:
+
+        b"E" | request send time | request receive time | reply send time (doubles) | node uuid (16 bytes)
+
+    Sockets without a tracer ignore these frames, so traced and untraced nodes can be mixed.
+
+    Send and receive times come from the monotonic clock of each node, which is shared by every process on
+    a host. Between hosts, the clocks are related by an offset that is estimated in two ways:
+        - Every traced request/reply exchange is a clock sample, as in NTP: with the request sent at t0
+          and received at t1, and the reply sent at t2 and received at t3, the offset of the server is
+          ((t1 - t0) + (t2 - t3)) / 2, with an error of at most half the round trip (t3 - t0) - (t2 - t1).
+          Of the last few samples from a node, the one with the shortest round trip is used.
+        - Without request/reply samples, the smallest observed (receive time - send time) from the node is
+          taken as the (negated) offset, so one way latencies are reported relative to the fastest message
+          seen.
+    Offsets of nodes on the same host are set to zero with set_offset().
+
+    Latencies are recorded in colugo.py.Histogram objects per topic:
+        latency: Send time to the receiving socket handing the message to colugo, offset corrected. This
+                 covers queueing in the sending socket, the wire, and queueing in the receiving zmq socket
+                 and event loop
+        callback: Time spent in the application callback (subscribers only)
+        round_trip: Time from sending a request to receiving its reply (request clients only)
+
+    Attributes:
+        node_uuid: uuid of the node, stamped on outgoing messages
+        origin: node_uuid as 16 bytes
+        histograms: Dict of topic to dict of histogram name to colugo.py.Histogram
+        offsets: Dict of node uuid to a fixed clock offset in seconds, set with set_offset()
+        clock_samples: Dict of node uuid to recent (round trip, offset) samples from request/reply exchanges
+        min_delays: Dict of node uuid to smallest (receive time - send time) observed from that node
+    """
+
+    TRACE_TAG = b"T"
+    ECHO_TAG = b"E"
+    TRACE = struct.Struct("!cdIQ16s")
+    ECHO = struct.Struct("!cddd16s")
+    CLOCK_SAMPLES = 8
+
+    def __init__(self, node_uuid):
+        """Constructor
+
+        Args:
+            node_uuid: uuid string of the node that owns the tracer
+        """
+        self.node_uuid = node_uuid
+        self.origin = uuid.UUID(node_uuid).bytes
+        self.histograms = {}
+        self.offsets = {node_uuid: 0.0}
+        self.clock_samples = {}
+        self.min_delays = {}
+
+    def now(self):
+        """Helper to get the clock that trace times are taken from
+
+        Returns:
+            float: Seconds of time.monotonic()
+        """
+        return time.monotonic()
+
+    def stamp(self, sequence, epoch=0):
+        """Build the trace frame for an outgoing message
+
+        Args:
+            sequence: Sequence number of the message
+            epoch: Epoch of the sending socket (default: 0)
+
+        Returns:
+            bytes: Trace frame
+        """
+        return self.TRACE.pack(self.TRACE_TAG, self.now(), epoch, sequence, self.origin)
+
+    @staticmethod
+    def parse(frame):
+        """Unpack a trace frame
+
+        Args:
+            frame: bytes of the frame following the message payload
+
+        Returns:
+            (float, int, int, String)|None: Send time, epoch, sequence number and node uuid of the sender, or
+            None if the frame isn't a trace frame
+        """
+        if len(frame) != Tracer.TRACE.size or frame[:1] != Tracer.TRACE_TAG:
+            return None
+        (_, sent, epoch, sequence, origin) = Tracer.TRACE.unpack(frame)
+        return (sent, epoch, sequence, str(uuid.UUID(bytes=origin)))
+
+    def echo(self, request_frame, received):
+        """Build the echo frame for the reply to a traced request
+
+        Args:
+            request_frame: Trace frame of the request
+            received: Time the request was received, from now()
+
+        Returns:
+            bytes|None: Echo frame, or None if the request wasn't traced
+        """
+        trace = self.parse(request_frame)
+        if trace is None:
+            return None
+        return self.ECHO.pack(self.ECHO_TAG, trace[0], received, self.now(), self.origin)
+
+    def histogram(self, topic, name):
+        """Helper to get a histogram of a topic, creating it if needed
+
+        Args:
+            topic: Topic of the socket
+            name: Histogram name, eg latency
+
+        Returns:
+            colugo.py.Histogram: The histogram
+        """
+        histograms = self.histograms.setdefault(topic, {})
+        if name not in histograms:
+            histograms[name] = Histogram()
+        return histograms[name]
+
+    def observe(self, topic, frame, received):
+        """Record the latency of a received traced message
+
+        Args:
+            topic: Topic of the receiving socket
+            frame: Trace frame of the message
+            received: Time the message was received, from now()
+
+        Returns:
+            (float, int, String)|None: The parsed trace frame (see parse()), or None if the frame isn't a trace
+            frame
+        """
+        trace = self.parse(frame)
+        if trace is None:
+            return None
+        (sent, _, _, origin) = trace
+        delay = received - sent
+        if origin not in self.min_delays or delay < self.min_delays[origin]:
+            self.min_delays[origin] = delay
+        self.histogram(topic, "latency").record(max(0.0, delay + self.offset(origin)))
+        return trace
+
+    def observe_reply(self, topic, frame, received):
+        """Record the round trip of a traced request and the clock sample of its reply
+
+        Args:
+            topic: Topic of the request client
+            frame: Echo frame of the reply
+            received: Time the reply was received, from now()
+        """
+        if len(frame) != self.ECHO.size or frame[:1] != self.ECHO_TAG:
+            return
+        (_, t0, t1, t2, origin) = self.ECHO.unpack(frame)
+        self.histogram(topic, "round_trip").record(received - t0)
+        self.add_clock_sample(str(uuid.UUID(bytes=origin)), t0, t1, t2, received)
+
+    def record_callback(self, topic, seconds):
+        """Record the time spent in an application callback
+
+        Args:
+            topic: Topic of the socket
+            seconds: Duration of the callback
+        """
+        self.histogram(topic, "callback").record(seconds)
+
+    def add_clock_sample(self, origin, t0, t1, t2, t3):
+        """Add a clock offset sample from a request/reply exchange with another node
+
+        Args:
+            origin: uuid of the node that replied
+            t0: Time the request was sent, local clock
+            t1: Time the request was received, remote clock
+            t2: Time the reply was sent, remote clock
+            t3: Time the reply was received, local clock
+        """
+        if origin not in self.clock_samples:
+            self.clock_samples[origin] = collections.deque(maxlen=self.CLOCK_SAMPLES)
+        self.clock_samples[origin].append(((t3 - t0) - (t2 - t1), ((t1 - t0) + (t2 - t3)) / 2.0))
+
+    def set_offset(self, origin, offset):
+        """Fix the clock offset of another node, eg zero for nodes on the same host
+
+        Args:
+            origin: uuid of the node
+            offset: Seconds, remote clock minus local clock
+        """
+        self.offsets[origin] = offset
+
+    def offset(self, origin):
+        """Estimate the clock offset of another node
+
+        Args:
+            origin: uuid of the node
+
+        Returns:
+            float: Seconds, remote clock minus local clock
+        """
+        if origin in self.offsets:
+            return self.offsets[origin]
+        samples = self.clock_samples.get(origin)
+        if samples:
+            return min(samples)[1]
+        return -self.min_delays.get(origin, 0.0)
+
+    def to_dict(self):
+        """Summarize the latency histograms and clock offsets
+
+        Returns:
+            Dict: topics, a dict of topic to dict of histogram name to colugo.py.Histogram.to_dict(), and
+            offsets, a dict of node uuid to estimated clock offset in seconds
+        """
+        origins = set(self.offsets) | set(self.clock_samples) | set(self.min_delays)
+        return {"topics": {topic: {name: h.to_dict() for (name, h) in histograms.items()}
+                           for (topic, histograms) in self.histograms.items()},
+                "offsets": {origin: self.offset(origin) for origin in origins}}
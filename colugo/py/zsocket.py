@@ -1,11 +1,17 @@
 import functools
 import logging
+import os
 import socket
+import tempfile
+import time
 from tornado import ioloop
 import zmq
 from zmq.eventloop.future import Poller
 from zmq.eventloop.zmqstream import ZMQStream
 
+from colugo.py.codec import Codec, RawCodec, StringCodec
+from colugo.py.context import Context
+
 
 class Socket:
     """Wrapper class for zmq.Socket
@@ -19,32 +25,78 @@ class Socket:
         loop: Tornado event loop instance
         address: Assigned address of the zmq.Socket
         protocol: Assigned zmq socket type
-        ctx: ZMQ context instance
+        ctx: colugo.py.Context instance that creates the underlying zmq.Socket
         stream: ZmqStream instance
         zmq_socket: Underlying zmq.Socket object
+        connections: Dict of (address, port) the socket is connected to, to the endpoint used to connect
+        endpoint: Endpoint (eg, tcp://127.0.0.1:10001) of the most recent connection
+        endpoints: List of endpoints the socket is bound to
+        ipc_endpoint: ipc:// endpoint the socket is bound to, for clients on the same host, or None
+        inproc_endpoint: inproc:// endpoint the socket is bound to, for clients in the same context, or None
+        raw: If True, received messages are passed to handlers as memoryviews (zero-copy) instead
+             of decoded UTF-8 strings
+        codec: colugo.py.Codec used to encode sent messages and decode received messages
+        codec_negotiable: If True, the codec was not chosen by the application and is replaced by the
+                          codec of the first server the socket connects to (see negotiate_codec())
+        metrics: colugo.py.SocketMetrics updated as the socket is used, or None to disable instrumentation
+        tracer: colugo.py.Tracer used to stamp sent messages and record the latency of received messages, or
+                None to disable tracing
+        wheel: colugo.py.TimerWheel used for receive timeouts, or None to use the event loop's timers
+        on_close: Callback executed with the socket once it is closed (eg, to forget it in its node), or None
     """
 
-    def __init__(self, loop, protocol):
+    def __init__(self, loop, protocol, raw=False, ctx=None, codec=None):
         """Constructor for Socket class
 
         Args:
             loop: Tornado event loop
             protocol: Assigned protocol for the zmq.Socket
+            raw: Deliver received messages as zero-copy memoryviews rather than decoded strings, same
+                 as codec=colugo.py.RawCodec() (default: False)
+            ctx: colugo.py.Context used to create the socket (default: None, process wide default)
+            codec: colugo.py.Codec for message payloads (default: None, UTF-8 strings unless negotiated)
         """
         self.logger = logging.getLogger("Socket")
         self.loop = loop
         self.protocol = protocol
-        self.server = True if (protocol == zmq.PUB or protocol == zmq.REP) else False
-        self.ctx = zmq.Context().instance()
+        self.raw = raw
+        self.codec_negotiable = codec is None and not raw
+        if codec is None:
+            codec = RawCodec() if raw else StringCodec()
+        self.codec = codec
+        self.metrics = None
+        self.tracer = None
+        self.wheel = None
+        self.on_close = None
+        self.server = True if (protocol in (zmq.PUB, zmq.XPUB, zmq.REP, zmq.ROUTER)) else False
+        self.ctx = ctx if ctx else Context.instance()
         self.stream = None
         self.zmq_socket = None
         self.address = None
         self.port = None
+        self.endpoint = None
+        self.endpoints = []
+        self.ipc_endpoint = None
+        self.inproc_endpoint = None
+        self.connections = {}
         self.create_socket(protocol)
 
     def create_socket(self, protocol):
         """Helper function for creating a zmq.Socket of various types with various options
 
+        The options (see socket_options()) are applied to this socket only (on top of any context wide
+        options), never to the shared context.
+
+        Args:
+            protocol: zmq socket type
+
+        """
+        self.zmq_socket = self.ctx.socket(protocol, self.socket_options(protocol))
+
+    @staticmethod
+    def socket_options(protocol):
+        """Get the zmq options for a socket type
+
         Assumes that request sockets need extra configuration options to prevent erroneous states
         when two requests are sent before a reply is received. REQ_RELAXED will drop the first
         request and reset the underlying socket automatically allowing the second request to be
@@ -54,30 +106,58 @@ class Socket:
         Args:
             protocol: zmq socket type
 
+        Returns:
+            Dict: zmq socket option to value
         """
-
+        options = {}
         if protocol == zmq.REQ:
             # make sure that replies back to req's are coordinated with header data
-            self.ctx.setsockopt(zmq.REQ_CORRELATE, 1)
+            options[zmq.REQ_CORRELATE] = 1
             # allow req socket to internall try to reconnect if two sends are sent in a row
-            self.ctx.setsockopt(zmq.REQ_RELAXED, 1)
+            options[zmq.REQ_RELAXED] = 1
             # timeout for trying to send
-            self.ctx.setsockopt(zmq.SNDTIMEO, 1000)
+            options[zmq.SNDTIMEO] = 1000
             # ensure that the socket doesn't block on close
-            self.ctx.setsockopt(zmq.LINGER, 0)
-        self.zmq_socket = self.ctx.socket(protocol)
+            options[zmq.LINGER] = 0
+        elif protocol == zmq.DEALER:
+            # requests that are still queued when the socket closes are abandoned anyway
+            options[zmq.LINGER] = 0
+        return options
+
+    def set_send_buffer(self, hwm=None, buf=None):
+        """Configure the outgoing queue limits of the underlying zmq socket
+
+        The high-water mark must be set before the socket binds or connects to take effect on
+        those connections.
 
-    def connect(self, address, port):
+        Args:
+            hwm: Maximum number of messages queued per peer before messages are dropped or sends
+                 block, depending on socket type (zmq.SNDHWM) (default: None, leave unchanged)
+            buf: Size in bytes of the kernel transmit buffer (zmq.SNDBUF) (default: None, leave unchanged)
+        """
+        if hwm is not None:
+            self.zmq_socket.setsockopt(zmq.SNDHWM, hwm)
+        if buf is not None:
+            self.zmq_socket.setsockopt(zmq.SNDBUF, buf)
+
+    def connect(self, address, port, endpoint=None):
         """Connect the socket to a local or remote address:port
 
         Args:
             address: Decimal separated string (eg, 127.0.0.1) where service is bound
             port: int associated with service port
+            endpoint: Endpoint to connect to instead of tcp://address:port, eg the ipc:// or inproc://
+                      endpoint of the same service (default: None)
         """
-
-        self.zmq_socket.connect("tcp://{}:{}".format(address, port))
+        if endpoint is None:
+            endpoint = "tcp://{}:{}".format(address, port)
+        self.zmq_socket.connect(endpoint)
         self.address = address  # 127.0.0.1
         self.port = port  # 10001
+        self.endpoint = endpoint
+        self.connections[(address, port)] = endpoint
+        if self.metrics is not None:
+            self.metrics.connected(address, port)
         self.start_stream()
         return (self.address, self.port)
 
@@ -87,9 +167,26 @@ class Socket:
         # TODO(pickledgator): Figure out why this fails with error: Socket operation on non-socket
         self.stop_stream()
         try:
-            self.zmq_socket.disconnect("tcp://{}:{}".format(self.address, self.port))
+            self.zmq_socket.disconnect(self.endpoint)
         except Exception as e:
             pass
+        self.connections.pop((self.address, self.port), None)
+
+    def disconnect_from(self, address, port):
+        """Disconnect the underlying socket from one of the servers it is connected to, eg when the
+        server has left the network
+
+        Args:
+            address: Decimal separated string (eg, 127.0.0.1) where service is bound
+            port: int associated with service port
+        """
+        endpoint = self.connections.pop((address, port), None)
+        if endpoint is None or endpoint == "local":
+            return
+        try:
+            self.zmq_socket.disconnect(endpoint)
+        except zmq.ZMQError as e:
+            self.logger.debug("Disconnecting from {} failed: {}".format(endpoint, e))
 
     def get_local_ip(self):
         """Identifies the ip address of the local node
@@ -114,21 +211,41 @@ class Socket:
 
         In zmq, the filter (string or bytes) can be used to screen multi-part messages such 
         that only messages with the first element of the array match an associated string. 
-        Currently, we configure the subscriber sockets to receive all messages from any publisher.
-        TODO(pickledgator): Add support for filter->separate callbacks?
+        Filtering happens inside libzmq, so messages that don't match any filter never reach python.
 
         Args:
             filter_string: Setup socket to only allow multi-part messages whose first element 
-                           match this string
+                           match this string (string or bytes)
         """
         # "" is a wildcard to accept all messages
-        self.zmq_socket.setsockopt_string(zmq.SUBSCRIBE, filter_string)
+        if type(filter_string) == str:
+            self.zmq_socket.setsockopt_string(zmq.SUBSCRIBE, filter_string)
+        else:
+            self.zmq_socket.setsockopt(zmq.SUBSCRIBE, filter_string)
 
-    def bind(self):
+    def remove_filter(self, filter_string=""):
+        """Helper function to remove a previously set zmq.SUBSCRIBER filter
+
+        Args:
+            filter_string: Filter (string or bytes) that was passed to set_filter()
+        """
+        if type(filter_string) == str:
+            self.zmq_socket.setsockopt_string(zmq.UNSUBSCRIBE, filter_string)
+        else:
+            self.zmq_socket.setsockopt(zmq.UNSUBSCRIBE, filter_string)
+
+    def bind(self, local_transports=True):
         """Bind the underlying zmq socket to an ip on the local machine at a random available port
 
+        The socket is also bound to an inproc:// endpoint, and an ipc:// endpoint where supported, both
+        named after the tcp address and port so they are unique on the host. Clients in the same context
+        or on the same host can then connect without going through the TCP stack.
+
         Also kicks off the zmqStream after binding.
 
+        Args:
+            local_transports: Also bind the inproc:// and ipc:// endpoints (default: True)
+
         Returns:
             (String, int): Tuple containing the address string and the port chosen
         """
@@ -138,32 +255,122 @@ class Socket:
         port = self.zmq_socket.bind_to_random_port("tcp://{}".format(ip), min_port=10001, max_port=20000, max_tries=100)
         self.address = ip
         self.port = port
+        self.endpoints = ["tcp://{}:{}".format(ip, port)]
+        if local_transports:
+            name = "colugo-{}-{}".format(ip, port)
+            self.inproc_endpoint = self.bind_endpoint("inproc://{}".format(name))
+            if zmq.has("ipc"):
+                path = os.path.join(tempfile.gettempdir(), "{}.ipc".format(name))
+                self.ipc_endpoint = self.bind_endpoint("ipc://{}".format(path))
         self.start_stream()
         return (self.address, self.port)
 
+    def bind_endpoint(self, endpoint):
+        """Helper to bind an additional endpoint, for transports that are only an optimization
+
+        Args:
+            endpoint: Endpoint string to bind (eg, inproc://name)
+
+        Returns:
+            String|None: The endpoint if it was bound, otherwise None
+        """
+        try:
+            self.zmq_socket.bind(endpoint)
+        except zmq.ZMQError as e:
+            self.logger.warn("Could not bind {}: {}".format(endpoint, e))
+            return None
+        self.endpoints.append(endpoint)
+        return endpoint
+
     def unbind(self):
         """Reverse the bind of the underlying zmq socket and stop the zmqStream
         """
         # TODO(pickledgator): Figure out why this fails with error: Socket operation on non-socket
         self.stop_stream()
+        for endpoint in self.endpoints:
+            try:
+                self.zmq_socket.unbind(endpoint)
+            except Exception as e:
+                pass
+        self.endpoints = []
+        self.remove_ipc_file()
+
+    def remove_ipc_file(self):
+        """Helper to delete the file of the ipc:// endpoint the socket was bound to, which zmq leaves behind
+        in the temp directory when the socket is unbound or closed
+        """
+        if self.ipc_endpoint is None:
+            return
+        path = self.ipc_endpoint[len("ipc://"):]
+        self.ipc_endpoint = None
         try:
-            self.zmq_socket.unbind("tcp://{}:{}".format(self.address, self.port))
-        except Exception as e:
+            os.remove(path)
+        except OSError:
             pass
 
     def send(self, message):
         """Identifies the correct underlying zmq send method based on the type of message
 
+        A list or tuple is sent as a single multi-part message, with one frame per element.
+
         Args:
-            message: Message to be sent (string or bytes)
+            message: Message to be sent (string, bytes or list of strings/bytes)
         """
-        self.logger.debug("Sending message: {}".format(message))
-        if type(message) == str:
-            # assumes string
-            self.stream.send_string(message)
+        if type(message) in (list, tuple):
+            frames = [self.pack(m) for m in message]
+            self.stream.send_multipart(frames)
         else:
-            # assumes bytes
-            self.stream.send(message)
+            # strings are encoded, bytes are passed through
+            frames = [self.pack(message)]
+            self.stream.send(frames[0])
+        if self.metrics is not None:
+            self.metrics.sent(frames)
+
+    def negotiate_codec(self, name):
+        """Check that the socket can exchange messages with a server that advertises a codec
+
+        A socket whose codec was not chosen by the application adopts the codec of the first server it
+        negotiates with. Codecs that can't be created from their name alone (eg, protobuf) are received
+        as raw buffers instead.
+
+        Args:
+            name: Codec name advertised by the server, or None if unknown
+
+        Returns:
+            Bool: If the socket should connect to the server
+        """
+        if name is None or name == self.codec.name or self.raw:
+            return True
+        if self.codec_negotiable:
+            codec = Codec.from_name(name)
+            self.codec = codec if codec else RawCodec()
+            self.codec_negotiable = False
+            return True
+        return False
+
+    def encode(self, message):
+        """Encode an outgoing message payload with the socket's codec
+
+        Args:
+            message: Application object to be sent
+
+        Returns:
+            bytes: The encoded message
+        """
+        return self.codec.encode(message)
+
+    def pack(self, frame):
+        """Convert an outgoing message part into something zmq can send
+
+        Args:
+            frame: Message part (string or bytes)
+
+        Returns:
+            bytes|buffer: Strings are encoded as UTF-8, everything else is passed through
+        """
+        if type(frame) == str:
+            return frame.encode("utf-8")
+        return frame
 
     def start_stream(self):
         if not self.stream:
@@ -178,21 +385,127 @@ class Socket:
             self.stream = None
 
     def cycle_socket(self):
+        """Replace the zmq socket with a new one, connected to the same endpoints
+
+        Used to reset client sockets after a receive timeout.
+        """
+        if self.metrics is not None:
+            self.metrics.cycles += 1
+        connections = dict(self.connections)
+        # the socket lives on, so its owner isn't told about the close
+        (on_close, self.on_close) = (self.on_close, None)
         self.close()
+        self.on_close = on_close
         self.create_socket(self.protocol)
-        # self.connect(self.address, self.port)
+        for ((address, port), endpoint) in connections.items():
+            Socket.connect(self, address, port, endpoint)
+
+    def unpack(self, frame):
+        """Convert a received frame into the representation handed to the application
+
+        For codecs that support it (eg, raw mode), frames are received with copy=False, so the codec
+        is given a memoryview that references the zmq message buffer directly and no copies are made.
+
+        Args:
+            frame: zmq.Frame (zero-copy codecs) or bytes received from the socket
+
+        Returns:
+            The message decoded by the socket's codec (eg, memoryview in raw mode, otherwise a string)
+        """
+        return self.codec.decode(frame.buffer if isinstance(frame, zmq.Frame) else frame)
+
+    def frame_bytes(self, frame):
+        """Helper to get the contents of a received frame as bytes, for keys and envelope frames
+
+        Args:
+            frame: zmq.Frame or bytes received from the socket
 
-    def receive(self, handler, timeout_ms=None, timeout_callback=None):
+        Returns:
+            bytes: The frame contents
+        """
+        return frame.bytes if isinstance(frame, zmq.Frame) else frame
+
+    def drain(self, limit):
+        """Receive the messages that are already queued on the socket, without blocking
+
+        Used by handlers that want to deal with everything that is ready in a single event loop wakeup. The
+        ZmqStream keeps watching the socket, so any messages left over are handled on the next wakeup.
+
+        Args:
+            limit: Maximum number of messages to receive
+
+        Returns:
+            List: Messages received, each a list of frames (zmq.Frame for zero-copy codecs, otherwise bytes)
+        """
+        messages = []
+        copy = not self.codec.zero_copy
+        while len(messages) < limit:
+            try:
+                frames = self.zmq_socket.recv_multipart(zmq.NOBLOCK, copy=copy)
+            except zmq.Again:
+                break
+            if self.metrics is not None:
+                self.metrics.received(frames)
+            messages.append(frames)
+        return messages
+
+    def call_later(self, delay_ms, callback, *args):
+        """Schedule a timeout callback, on the timer wheel if the socket has one
+
+        Args:
+            delay_ms: Number of milliseconds to wait before running the callback
+            callback: Function to execute
+            *args: Arguments passed to the callback
+
+        Returns:
+            Handle to pass to remove_timeout()
+        """
+        if self.wheel is not None:
+            return self.wheel.call_later(delay_ms, callback, *args)
+        return self.loop.call_later(delay_ms / 1000.0, callback, *args)
+
+    def remove_timeout(self, handle):
+        """Cancel a timeout callback scheduled with call_later()
+
+        Args:
+            handle: Handle returned by call_later()
+        """
+        if self.wheel is not None:
+            self.wheel.remove_timeout(handle)
+        else:
+            self.loop.remove_timeout(handle)
+
+    def receive(self, handler, timeout_ms=None, timeout_callback=None, multipart=False):
+        """Setup a handler for messages received on the stream
+
+        Args:
+            handler: Function executed with each received message
+            timeout_ms: Number of milliseconds to wait for a message before giving up (default: None)
+            timeout_callback: Function executed if timeout_ms elapses without a message (default: None)
+            multipart: If True, the handler is passed the full list of received frames, unconverted,
+                       rather than just the first frame run through unpack() (default: False)
+        """
         def msg_handler(handler, timeout, message):
-            # this callback receives a message list, with one element, so just pass the contents to the
-            # application handler
-            handler(message[0].decode("utf-8"))
+            metrics = self.metrics
+            if metrics is not None:
+                metrics.received(message)
+                start = time.perf_counter()
+            if multipart:
+                handler(message)
+            else:
+                # this callback receives a message list, with one element, so just pass the contents
+                # to the application handler
+                handler(self.unpack(message[0]))
+            if metrics is not None:
+                metrics.callback_time.record(time.perf_counter() - start)
             # if we received the message, then we need to cancel the watchdog timeout from
             # the last receive call
             if timeout:
-                self.loop.remove_timeout(timeout)
+                self.remove_timeout(timeout)
 
         def handle_timeout(timeout_callback):
+            if self.metrics is not None:
+                self.metrics.timeouts += 1
             if timeout_callback:
                 timeout_callback()
             # the event that we hit a timeout, cycle the socket so that it doesn't
@@ -200,15 +513,18 @@ class Socket:
             self.cycle_socket()
 
         if self.stream:
-            if timeout_ms:
+            if multipart and not timeout_ms and self.metrics is None:
+                # nothing to do around the handler, so the stream can call it directly
+                self.stream.on_recv(handler, copy=not self.codec.zero_copy)
+            elif timeout_ms:
                 # if we want to detect when recv fails, setup a timeout that cleans up the
                 # socket (RequestClients)
-                timeout = self.loop.call_later(timeout_ms / 1000.0, functools.partial(handle_timeout, timeout_callback))
+                timeout = self.call_later(timeout_ms, handle_timeout, timeout_callback)
                 # always set the handler, in case it changed
-                self.stream.on_recv(functools.partial(msg_handler, handler, timeout))
+                self.stream.on_recv(functools.partial(msg_handler, handler, timeout), copy=not self.codec.zero_copy)
             else:
                 # handle cases when we dont want to put a timeout on the recv function (subscribers)
-                self.stream.on_recv(functools.partial(msg_handler, handler, None))
+                self.stream.on_recv(functools.partial(msg_handler, handler, None), copy=not self.codec.zero_copy)
         else:
             self.logger.error("Stream is not open")
 
@@ -218,3 +534,7 @@ class Socket:
         except:
             pass
         self.zmq_socket.close()
+        self.connections = {}
+        self.remove_ipc_file()
+        if self.on_close:
+            self.on_close(self)
@@ -1,20 +1,19 @@
 #!/usr/bin/env python
 
-import json
 import os
 import sys
+from colugo.py.codec import JSONCodec
 from colugo.py.node import Node
 
 class PublisherExample(Node):
     def __init__(self, name):
         Node.__init__(self, name)
-        self.publisher = self.add_publisher("json.pub.topic")
+        self.publisher = self.add_publisher("json.pub.topic", codec=JSONCodec())
         self.repeater = self.add_repeater(1000, self.callback)
         self.count = 0
 
     def callback(self):
-        json_message = json.dumps({"message": "This is a message", "id": 0, "value": self.count})
-        self.publisher.send(json_message)
+        self.publisher.send({"message": "This is a message", "id": 0, "value": self.count})
         self.count += 1
 
 if __name__ == "__main__":
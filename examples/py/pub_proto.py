@@ -3,12 +3,14 @@
 import os
 import sys
 import examples.proto.test_pb2
+from colugo.py.codec import ProtobufCodec
 from colugo.py.node import Node
 
 class PublisherExample(Node):
     def __init__(self, name):
         Node.__init__(self, name)
-        self.publisher = self.add_publisher("proto.pub.topic")
+        self.publisher = self.add_publisher("proto.pub.topic",
+                                            codec=ProtobufCodec(examples.proto.test_pb2.TestMessage))
         self.repeater = self.add_repeater(1000, self.callback)
         self.count = 0
 
@@ -17,7 +19,7 @@ class PublisherExample(Node):
         test_message.message = "This is a message"
         test_message.id = 0
         test_message.value = self.count
-        self.publisher.send(test_message.SerializeToString())
+        self.publisher.send(test_message)
         self.count += 1
 
 if __name__ == "__main__":
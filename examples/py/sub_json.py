@@ -1,21 +1,18 @@
 #!/usr/bin/env python
 
-import json
 import os
 import sys
+from colugo.py.codec import JSONCodec
 from colugo.py.node import Node
 
 class SubscriberExample(Node):
     def __init__(self, name):
         super(SubscriberExample, self).__init__(name)
-        self.subscriber = self.add_subscriber("json.pub.topic", self.callback)
+        # messages are decoded from json before they reach the callback
+        self.subscriber = self.add_subscriber("json.pub.topic", self.callback, codec=JSONCodec())
 
     def callback(self, message):
-        # Decode UTF-8 bytes to Unicode, and convert single quotes 
-        # to double quotes to make it valid JSON
-        msg_unicode = message.decode('utf8').replace("'", '"')
-        json_message = json.loads(msg_unicode)
-        self.logger.info("Received message!\n{}".format(json_message))
+        self.logger.info("Received message!\n{}".format(message))
 
 if __name__ == "__main__":
 
@@ -3,20 +3,18 @@
 import os
 import sys
 import examples.proto.test_pb2
+from colugo.py.codec import ProtobufCodec
 from colugo.py.node import Node
 
 class SubscriberExample(Node):
     def __init__(self, name):
         super(SubscriberExample, self).__init__(name)
-        self.subscriber = self.add_subscriber("proto.pub.topic", self.callback)
+        # messages are parsed into TestMessage objects before they reach the callback
+        self.subscriber = self.add_subscriber("proto.pub.topic", self.callback,
+                                              codec=ProtobufCodec(examples.proto.test_pb2.TestMessage))
 
     def callback(self, message):
-        msg = examples.proto.test_pb2.TestMessage()
-        try:
-            msg.ParseFromString(message)
-            self.logger.info("Received message!\n{}".format(msg))
-        except Exception as e:
-            self.logger.error("Failed to parse message")
+        self.logger.info("Received message!\n{}".format(message))
 
 
 if __name__ == "__main__":